@@ -0,0 +1,124 @@
+# benchmarks/db_overhead.py
+"""
+单条群消息的数据库开销微基准。
+
+模拟 chat_handler 处理一条普通群消息时的数据库访问序列：
+黑名单查询 -> 群组设置 -> 用户设置 -> save_message (含 update_known_chat) -> db_add_points。
+
+- before: 旧实现，每次查询都 sqlite3.connect + close，默认 PRAGMA (DELETE 日志 / synchronous=FULL)
+- after:  statistics 模块当前实现，线程长连接 + 语句缓存 + WAL/NORMAL 等 PRAGMA
+
+用法: python -m benchmarks.db_overhead [消息条数]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from bot import statistics as db
+
+CHAT_ID = -1001234567890
+USER_ID = 123456789
+
+
+# --- 旧实现：每次调用都新建连接 ---
+
+def _legacy_connect(db_file: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _legacy_select_one(db_file: str, sql: str, params: tuple):
+    conn = _legacy_connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+def _legacy_write(db_file: str, sql: str, params: tuple):
+    conn = _legacy_connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+def _legacy_message(db_file: str, i: int):
+    _legacy_select_one(db_file, "SELECT * FROM blacklist WHERE user_id = ?", (str(USER_ID),))
+    _legacy_select_one(db_file, "SELECT * FROM group_settings WHERE chat_id = ?", (str(CHAT_ID),))
+    _legacy_select_one(db_file, "SELECT * FROM user_settings WHERE user_id = ?", (str(USER_ID),))
+    _legacy_write(db_file, """
+        INSERT INTO known_chats (chat_id, chat_title) VALUES (?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET chat_title = excluded.chat_title
+    """, (str(CHAT_ID), "Bench Group"))
+    _legacy_write(db_file, """
+        INSERT INTO messages (chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, text)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (str(CHAT_ID), "Bench Group", '', str(USER_ID), "Bench User", '', datetime.now().isoformat(), f"message {i}"))
+    conn = _legacy_connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO user_points (user_id, chat_id, points, last_update_timestamp) VALUES (?, ?, 0, ?)",
+                   (str(USER_ID), str(CHAT_ID), datetime(1970, 1, 1).isoformat()))
+    cursor.execute("SELECT points FROM user_points WHERE user_id = ? AND chat_id = ?", (str(USER_ID), str(CHAT_ID)))
+    points = cursor.fetchone()['points']
+    cursor.execute("UPDATE user_points SET points = ?, last_update_timestamp = ? WHERE user_id = ? AND chat_id = ?",
+                   (points + 1, datetime.now(timezone.utc).isoformat(), str(USER_ID), str(CHAT_ID)))
+    conn.commit()
+    conn.close()
+
+
+# --- 新实现：直接调用 statistics 模块 ---
+
+def _pooled_message(i: int):
+    # 黑名单检查已改为查内存索引，不再访问数据库
+    db.db_get_group_settings(CHAT_ID)
+    db.db_get_user_settings(USER_ID)
+    db.save_message(CHAT_ID, "Bench Group", None, USER_ID, "Bench User", None, f"message {i}")
+    db.db_add_points(USER_ID, CHAT_ID, 1, cooldown_seconds=0)
+
+
+def _use_database(db_file: str):
+    """让 statistics 模块切换到指定的数据库文件并建表。"""
+    db.close_all_connections()
+    db.DB_FILE = db_file
+    db._initialize_database()
+
+
+def _run(label: str, func, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    elapsed = time.perf_counter() - start
+    per_message_us = elapsed / count * 1_000_000
+    print(f"{label:<8} {count} 条消息, 总计 {elapsed:.3f}s, 每条 {per_message_us:.1f} µs")
+    return per_message_us
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    original_db_file = db.DB_FILE
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        before_file = os.path.join(tmp_dir, 'before.db')
+        after_file = os.path.join(tmp_dir, 'after.db')
+
+        # 旧实现使用默认日志模式，所以先用一条普通连接建表
+        _use_database(before_file)
+        db.close_all_connections()
+        with sqlite3.connect(before_file) as conn:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        before = _run("before", lambda i: _legacy_message(before_file, i), count)
+
+        _use_database(after_file)
+        after = _run("after", _pooled_message, count)
+        db.close_all_connections()
+
+    db.DB_FILE = original_db_file
+    print(f"每条消息的数据库开销降低 {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
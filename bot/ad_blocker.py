@@ -1,7 +1,12 @@
 # bot/ad_blocker.py
 
 import os
+import time
+import asyncio
 import logging
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -9,44 +14,148 @@ logger = logging.getLogger(__name__)
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
 KEYWORD_FILE = os.path.join(DATA_DIR, 'blacklist_keywords.txt')
 
+
+class KeywordMatcher:
+    """
+    Aho-Corasick 多模式匹配自动机。
+    构建后只需对文本扫描一遍即可找出任意关键词，耗时与文本长度成正比，与关键词数量无关。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]  # 到达该状态时匹配到的关键词 (含失败链上的)
+        for keyword in keywords:
+            if keyword:
+                self._add(keyword)
+        self._build_fail_links()
+
+    def _add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = next_state
+        if self._output[state] is None:
+            self._output[state] = keyword
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                if self._output[next_state] is None:
+                    self._output[next_state] = self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> Optional[str]:
+        """返回文本中最先出现的关键词，没有匹配时返回 None。text 需已转为小写。"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
 # 使用集合(set)来存储关键词，查询速度极快
 BLOCKED_KEYWORDS = set()
+_matcher = KeywordMatcher(())
+_loaded_mtime: Optional[float] = None  # 已加载文件的修改时间，用于检测文件变化
+_failed_mtime: Optional[float] = None  # 上次热重载失败时文件的修改时间，文件未再变化前不重复尝试
+_reload_lock = threading.Lock()
+last_build_seconds = 0.0
+
+def _keyword_file_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(KEYWORD_FILE)
+    except OSError:
+        return None
 
-def load_blocked_keywords():
-    """从 blacklist_keywords.txt 文件加载关键词到内存中。"""
-    global BLOCKED_KEYWORDS
+def load_blocked_keywords(initial: bool = True) -> bool:
+    """
+    从 blacklist_keywords.txt 文件加载关键词，并编译成匹配自动机，返回是否加载成功。
+    initial=True 只用于启动时的首次加载：文件不存在时创建空文件，出错时清空过滤器。
+    热重载 (initial=False) 失败时只记录日志并保留上一次成功加载的关键词，也不会创建或改写文件，
+    以免编辑器“删除再重命名”保存文件的间隙把过滤器关掉或截断刚写好的文件。
+    """
+    global BLOCKED_KEYWORDS, _matcher, _loaded_mtime, last_build_seconds
     try:
-        if os.path.exists(KEYWORD_FILE):
-            with open(KEYWORD_FILE, 'r', encoding='utf-8') as f:
-                # 读取文件，去除每行首尾的空白，并转换为小写，忽略空行
-                keywords = {line.strip().lower() for line in f if line.strip()}
-                BLOCKED_KEYWORDS = keywords
-                logger.info(f"成功加载 {len(BLOCKED_KEYWORDS)} 个广告关键词。")
-        else:
-            logger.warning(f"关键词黑名单文件 {KEYWORD_FILE} 不存在，将创建一个空文件。")
-            # 创建一个空文件，防止下次启动时报错
-            with open(KEYWORD_FILE, 'w', encoding='utf-8') as f:
+        mtime = _keyword_file_mtime()
+        start = time.perf_counter()
+        with open(KEYWORD_FILE, 'r', encoding='utf-8') as f:
+            # 读取文件，去除每行首尾的空白，并转换为小写，忽略空行
+            keywords = {line.strip().lower() for line in f if line.strip()}
+        # 先构建好新的自动机再整体替换，匹配中的消息不会看到半成品
+        BLOCKED_KEYWORDS, _matcher = keywords, KeywordMatcher(keywords)
+        last_build_seconds = time.perf_counter() - start
+        _loaded_mtime = mtime
+        logger.info(f"成功加载 {len(BLOCKED_KEYWORDS)} 个广告关键词，构建耗时 {last_build_seconds * 1000:.1f} ms。")
+        return True
+    except FileNotFoundError:
+        if not initial:
+            logger.warning(f"关键词黑名单文件 {KEYWORD_FILE} 暂时不存在，继续使用已加载的 {len(BLOCKED_KEYWORDS)} 个关键词。")
+            return False
+        logger.warning(f"关键词黑名单文件 {KEYWORD_FILE} 不存在，将创建一个空文件。")
+        try:
+            # 以 'x' 模式创建，文件已存在时不会截断
+            with open(KEYWORD_FILE, 'x', encoding='utf-8'):
                 pass
-            BLOCKED_KEYWORDS = set()
+        except OSError as e:
+            logger.error(f"创建关键词黑名单文件时出错: {e}")
+        BLOCKED_KEYWORDS, _matcher = set(), KeywordMatcher(())
     except Exception as e:
+        if not initial:
+            logger.error(f"重新加载广告关键词时出错，继续使用已加载的 {len(BLOCKED_KEYWORDS)} 个关键词: {e}", exc_info=True)
+            return False
         logger.error(f"加载广告关键词时出错: {e}", exc_info=True)
-        BLOCKED_KEYWORDS = set()
+        BLOCKED_KEYWORDS, _matcher = set(), KeywordMatcher(())
+    return False
 
-def is_spam(text: str) -> bool:
+def reload_blocked_keywords(force: bool = False) -> Tuple[bool, int, float]:
     """
-    检查给定文本是否包含任何被屏蔽的关键词。
+    关键词文件有变化 (或 force=True) 时重新加载。
+    返回 (是否重新加载, 关键词数量, 构建耗时秒数)。会读文件和构建自动机，应在线程中调用。
+    """
+    global _failed_mtime
+    with _reload_lock:
+        mtime = _keyword_file_mtime()
+        if not force and mtime in (_loaded_mtime, _failed_mtime):
+            return False, len(BLOCKED_KEYWORDS), last_build_seconds
+        reloaded = load_blocked_keywords(initial=False)
+        _failed_mtime = None if reloaded else mtime
+        return reloaded, len(BLOCKED_KEYWORDS), last_build_seconds
+
+async def keyword_reload_job(context):
+    """定时任务：检查关键词文件的修改时间，有变化时在线程中重建匹配器并原子替换。"""
+    await asyncio.to_thread(reload_blocked_keywords)
+
+def find_spam_keyword(text: str) -> Optional[str]:
+    """
+    返回文本中命中的第一个屏蔽关键词，未命中时返回 None。
     """
     if not text or not BLOCKED_KEYWORDS:
-        return False
-    
+        return None
     # 将输入文本也转换为小写以进行不区分大小写的比较
-    lower_text = text.lower()
-    
-    for keyword in BLOCKED_KEYWORDS:
-        if keyword in lower_text:
-            return True
-            
-    return False
+    return _matcher.find(text.lower())
+
+def is_spam(text: str) -> bool:
+    """
+    检查给定文本是否包含任何被屏蔽的关键词。
+    """
+    return find_spam_keyword(text) is not None
 
 # 在模块加载时，立即执行一次关键词加载
-load_blocked_keywords()
\ No newline at end of file
+load_blocked_keywords()
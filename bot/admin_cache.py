@@ -0,0 +1,149 @@
+# bot/admin_cache.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Dict, FrozenSet, Optional, Set
+
+from cachetools import LRUCache
+from telegram.error import TelegramError
+
+from .config import ADMIN_CACHE_TTL_SECONDS, ADMIN_CACHE_MAX_CHATS, ADMIN_CACHE_FAILURE_BACKOFF_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class _AdminEntry:
+    __slots__ = ('admin_ids', 'fetched_at')
+
+    def __init__(self, admin_ids: FrozenSet[int], fetched_at: float):
+        self.admin_ids = admin_ids
+        self.fetched_at = fetched_at
+
+
+class AdminCache:
+    """
+    按群组缓存完整的管理员 ID 集合，判断“某用户是否为管理员”只需一次集合查询。
+
+    - 首次查询某群组时调用一次 get_chat_administrators，同一群组的并发查询共用这一次请求。
+    - 超过 ADMIN_CACHE_TTL_SECONDS 的条目仍然先用旧值回答，同时在后台刷新，消息处理不会等待网络请求。
+    - 收到 chat_member 更新 (提升/撤销管理员) 时直接修改缓存中的集合，不必等到过期；
+      请求进行中收到的更新会在请求返回后补到新集合上，不会被更早的快照覆盖。
+    - 获取失败后 ADMIN_CACHE_FAILURE_BACKOFF_SECONDS 内不再重试：有旧值时继续用旧值，
+      没有时按非管理员处理，避免每条消息都重新请求。
+    - 缓存的群组数有界，超出 ADMIN_CACHE_MAX_CHATS 时淘汰最久未使用的。
+
+    只在事件循环线程中使用，不需要加锁。
+    """
+
+    def __init__(self, ttl_seconds: int = ADMIN_CACHE_TTL_SECONDS, max_chats: int = ADMIN_CACHE_MAX_CHATS,
+                 backoff_seconds: int = ADMIN_CACHE_FAILURE_BACKOFF_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.backoff_seconds = backoff_seconds
+        self._entries: LRUCache = LRUCache(maxsize=max_chats)
+        self._retry_after: LRUCache = LRUCache(maxsize=max_chats)  # 获取失败的群组 -> 允许再次请求的时间
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._inflight_updates: Dict[int, Dict[int, bool]] = {}  # 请求进行中收到的成员变更
+        self._background: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.backed_off = 0
+        self.member_updates = 0
+
+    async def _fetch(self, bot, chat_id: int) -> Optional[FrozenSet[int]]:
+        """请求管理员列表并写入缓存，失败时返回 None 并保留旧值。同一群组同时只会有一个请求。"""
+        future = self._inflight.get(chat_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[chat_id] = future
+        self._inflight_updates[chat_id] = {}
+        admin_ids = None
+        try:
+            admins = await bot.get_chat_administrators(chat_id)
+            admin_ids = {admin.user.id for admin in admins}
+            # 请求期间收到的成员变更比这份列表更新，补上后再写入缓存
+            for user_id, is_admin in self._inflight_updates[chat_id].items():
+                if is_admin:
+                    admin_ids.add(user_id)
+                else:
+                    admin_ids.discard(user_id)
+            admin_ids = frozenset(admin_ids)
+            self._entries[chat_id] = _AdminEntry(admin_ids, time.monotonic())
+            self._retry_after.pop(chat_id, None)
+        except TelegramError as e:
+            self.failures += 1
+            self._retry_after[chat_id] = time.monotonic() + self.backoff_seconds
+            logger.warning(f"无法获取群组 {chat_id} 的管理员列表，{self.backoff_seconds} 秒内不再重试: {e}")
+        finally:
+            del self._inflight[chat_id]
+            del self._inflight_updates[chat_id]
+            future.set_result(admin_ids)
+        return admin_ids
+
+    def _in_backoff(self, chat_id: int) -> bool:
+        retry_after = self._retry_after.get(chat_id)
+        return retry_after is not None and time.monotonic() < retry_after
+
+    def _refresh_in_background(self, bot, chat_id: int):
+        if chat_id in self._inflight:
+            return
+        self.refreshes += 1
+        task = asyncio.create_task(self._fetch(bot, chat_id))
+        # 保存任务引用，避免任务在完成前被垃圾回收
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def is_admin(self, bot, chat_id: int, user_id: int) -> bool:
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            self.hits += 1
+            if time.monotonic() - entry.fetched_at > self.ttl_seconds and not self._in_backoff(chat_id):
+                self._refresh_in_background(bot, chat_id)
+            return user_id in entry.admin_ids
+
+        if self._in_backoff(chat_id):
+            self.backed_off += 1
+            return False
+        self.misses += 1
+        admin_ids = await self._fetch(bot, chat_id)
+        return admin_ids is not None and user_id in admin_ids
+
+    def apply_member_update(self, chat_id: int, user_id: int, is_admin: bool):
+        """根据 chat_member 更新修改已缓存的管理员集合；未缓存的群组等下次查询时再加载。"""
+        pending = self._inflight_updates.get(chat_id)
+        if pending is not None:
+            pending[user_id] = is_admin
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return
+        self.member_updates += 1
+        if is_admin:
+            entry.admin_ids = entry.admin_ids | {user_id}
+        else:
+            entry.admin_ids = entry.admin_ids - {user_id}
+
+    def invalidate(self, chat_id: int):
+        self._entries.pop(chat_id, None)
+        self._retry_after.pop(chat_id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        lookups = self.hits + self.misses
+        return {
+            'chats': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'backed_off': self.backed_off,
+            'member_updates': self.member_updates,
+        }
+
+
+# 全局唯一的管理员缓存
+admin_cache = AdminCache()
@@ -0,0 +1,135 @@
+# bot/ai_cache.py
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import diskcache
+
+from .config import (
+    AI_CACHE_SIZE_LIMIT_MB, AI_CACHE_PROMPT_TTL_SECONDS, AI_CACHE_CONTEXT_TTL_SECONDS,
+    AI_CACHE_CONTEXT_TURNS, AI_CACHE_IMAGE_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'ai_cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# 各层的过期时间 (秒)，0 表示关闭该层
+TIER_TTLS = {
+    'context': AI_CACHE_CONTEXT_TTL_SECONDS,
+    'prompt': AI_CACHE_PROMPT_TTL_SECONDS,
+    'image': AI_CACHE_IMAGE_TTL_SECONDS,
+}
+
+_SPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n?？!！.。,，~～…、;；:：'\"“”‘’"
+
+# 含有这些指代/追问词的问题依赖上下文，不能只按问题本身缓存
+_CONTEXT_MARKERS = (
+    '它', '他', '她', '这个', '那个', '这些', '那些', '这样', '那样', '上面', '刚才', '刚刚', '之前', '前面',
+    '继续', '然后呢', '还有呢', '为什么', '再来', '再说', '详细', '展开', '换个', '翻译一下',
+)
+_CONTEXT_WORDS_RE = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|he|she|above|previous|again|continue|more|why|else)\b"
+)
+MIN_PROMPT_CHARS = 4
+
+
+def normalize_prompt(text: str) -> str:
+    """规范化问题文本：全角转半角、统一小写、合并空白、去掉首尾标点。"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _SPACE_RE.sub(' ', text).strip(_EDGE_PUNCT)
+
+
+def is_standalone_prompt(normalized: str) -> bool:
+    """粗略判断问题是否不依赖上下文 (不含指代、追问词，且不是过短的寒暄)。"""
+    if len(normalized) < MIN_PROMPT_CHARS:
+        return False
+    if any(marker in normalized for marker in _CONTEXT_MARKERS):
+        return False
+    return not _CONTEXT_WORDS_RE.search(normalized)
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+class AiResponseCache:
+    """
+    分层的 AI 回复缓存 (磁盘)：
+
+    - context: 聊天 ID + 最近 AI_CACHE_CONTEXT_TURNS 条对话 + 问题，命中率低但答案最贴切；
+    - prompt: 只按规范化后的问题缓存，用于不依赖上下文的独立问题 (自动聊天群里最常见)；
+    - image: 图片内容哈希 + 问题，同一张图片被反复转发时直接复用描述。
+
+    查询时按上面的顺序查找，写入时写入所有适用的层，每层有独立的过期时间和命中统计。
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, size_limit_mb: int = AI_CACHE_SIZE_LIMIT_MB):
+        self._cache = diskcache.Cache(directory, size_limit=size_limit_mb * 1024 * 1024)
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {tier: {'hits': 0, 'misses': 0, 'stores': 0} for tier in TIER_TTLS}
+
+    def keys_for(self, lang_code: str, model_name: str, chat_history: list, prompt: str,
+                 chat_id: Optional[int] = None, image_bytes: Optional[bytes] = None) -> List[Tuple[str, str]]:
+        """计算一次请求在各层的缓存键，按查找顺序返回 [(层, 键)]。"""
+        normalized = normalize_prompt(prompt)
+        base = (model_name, lang_code)
+        if image_bytes:
+            if not TIER_TTLS['image']:
+                return []
+            image_hash = hashlib.sha256(image_bytes).hexdigest()
+            return [('image', 'image:' + _digest(*base, image_hash, normalized))]
+
+        keys = []
+        if TIER_TTLS['context'] and chat_id is not None:
+            # 历史记录的最后一条通常就是本次问题，不重复计入
+            history = [msg for msg in chat_history if msg.get('content')]
+            if history and history[-1].get('role') == 'user' and history[-1]['content'] == prompt:
+                history = history[:-1]
+            recent = [f"{msg.get('role')}:{normalize_prompt(msg['content'])}" for msg in history[-AI_CACHE_CONTEXT_TURNS:]] \
+                if AI_CACHE_CONTEXT_TURNS > 0 else []
+            keys.append(('context', 'context:' + _digest(*base, str(chat_id), *recent, normalized)))
+        if TIER_TTLS['prompt'] and is_standalone_prompt(normalized):
+            keys.append(('prompt', 'prompt:' + _digest(*base, normalized)))
+        return keys
+
+    def _count(self, tier: str, field: str):
+        with self._stats_lock:
+            self._stats[tier][field] += 1
+
+    def get(self, keys: List[Tuple[str, str]]) -> Optional[str]:
+        """依次查找各层，返回第一个命中的回复。"""
+        for tier, key in keys:
+            value = self._cache.get(key)
+            if value is not None:
+                self._count(tier, 'hits')
+                logger.info(f"AI 回复缓存命中 ({tier}): '{key[-8:]}'")
+                return value
+            self._count(tier, 'misses')
+        return None
+
+    def set(self, keys: List[Tuple[str, str]], response: str):
+        """把回复写入所有适用的层。"""
+        for tier, key in keys:
+            self._cache.set(key, response, expire=TIER_TTLS[tier])
+            self._count(tier, 'stores')
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        with self._stats_lock:
+            stats = {tier: dict(values) for tier, values in self._stats.items()}
+        for values in stats.values():
+            lookups = values['hits'] + values['misses']
+            values['hit_rate'] = values['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# 全局唯一的 AI 回复缓存
+ai_response_cache = AiResponseCache()
@@ -0,0 +1,178 @@
+# bot/ai_dispatcher.py
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Set
+
+from .config import AI_MAX_CONCURRENCY, AI_QUEUE_MAX_PENDING, AI_QUEUE_MAX_PER_CHAT
+
+logger = logging.getLogger(__name__)
+
+
+class AiQueueFull(Exception):
+    """排队的 AI 请求过多，本次请求被拒绝。"""
+
+
+class AiRequestSuperseded(Exception):
+    """同一聊天中有更新的消息，本次排队中的请求已被合并丢弃。"""
+
+
+class _AiRequest:
+    __slots__ = ('func', 'future', 'enqueued_at', 'coalesce')
+
+    def __init__(self, func: Callable, future: asyncio.Future, enqueued_at: float, coalesce: bool):
+        self.func = func
+        self.future = future
+        self.enqueued_at = enqueued_at
+        self.coalesce = coalesce
+
+
+class AiDispatcher:
+    """
+    AI 请求调度器：所有阻塞的 Gemini 调用都在专用线程池中执行，不再占用默认线程池。
+
+    - 最多同时执行 AI_MAX_CONCURRENCY 个请求，其余按聊天排队。
+    - 各聊天轮流出队 (每个聊天同一时间只执行一个请求)，繁忙的群组不会饿死其他聊天。
+    - coalesce=True 的请求 (如自动聊天模式触发的) 会取代同一聊天中尚未开始的同类请求。
+    - 排队总数超过 AI_QUEUE_MAX_PENDING 或单个聊天超过 AI_QUEUE_MAX_PER_CHAT 时直接拒绝。
+
+    只能在事件循环线程中调用 submit。
+    """
+
+    def __init__(self, max_workers: int = AI_MAX_CONCURRENCY, max_pending: int = AI_QUEUE_MAX_PENDING,
+                 max_pending_per_chat: int = AI_QUEUE_MAX_PER_CHAT):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ai-worker")
+        self._queues: Dict[int, Deque[_AiRequest]] = {}
+        self._ready: Deque[int] = deque()  # 有请求排队且当前没有请求在执行的聊天，按轮转顺序
+        self._running_chats: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.pending = 0
+        # 统计
+        self.total_submitted = 0
+        self.total_completed = 0
+        self.total_failed = 0
+        self.total_superseded = 0
+        self.total_rejected = 0
+        self.total_background = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_service_seconds = 0.0
+        self.max_service_seconds = 0.0
+
+    @property
+    def running(self) -> int:
+        return len(self._running_chats)
+
+    async def submit(self, chat_id: int, func: Callable, *args, coalesce: bool = False, **kwargs) -> Any:
+        """
+        排队执行阻塞函数 func 并返回其结果。
+        队列已满时抛出 AiQueueFull，被同一聊天的新请求取代时抛出 AiRequestSuperseded。
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._queues.setdefault(chat_id, deque())
+        if coalesce:
+            for request in [r for r in queue if r.coalesce]:
+                queue.remove(request)
+                self.pending -= 1
+                self.total_superseded += 1
+                if not request.future.done():
+                    request.future.set_exception(AiRequestSuperseded())
+        if self.pending >= self.max_pending or len(queue) >= self.max_pending_per_chat:
+            self.total_rejected += 1
+            if not queue:
+                self._queues.pop(chat_id, None)
+            raise AiQueueFull()
+
+        request = _AiRequest(functools.partial(func, *args, **kwargs), loop.create_future(), loop.time(), coalesce)
+        queue.append(request)
+        self.pending += 1
+        self.total_submitted += 1
+        if chat_id not in self._running_chats and chat_id not in self._ready:
+            self._ready.append(chat_id)
+        self._dispatch()
+        return await request.future
+
+    async def run_background(self, func: Callable, *args, **kwargs) -> Any:
+        """在 AI 线程池中执行后台任务 (如对话摘要)，不占用聊天队列，也不受排队上限限制。"""
+        self.total_background += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _dispatch(self):
+        while self._ready and len(self._running_chats) < self.max_workers:
+            chat_id = self._ready.popleft()
+            queue = self._queues.get(chat_id)
+            request = None
+            while queue:
+                candidate = queue.popleft()
+                self.pending -= 1
+                # 等待方已取消的请求直接跳过
+                if not candidate.future.done():
+                    request = candidate
+                    break
+            if request is None:
+                self._queues.pop(chat_id, None)
+                continue
+            self._running_chats.add(chat_id)
+            task = asyncio.ensure_future(self._execute(chat_id, request))
+            # 保存任务引用，避免任务在完成前被垃圾回收
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, chat_id: int, request: _AiRequest):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        wait_seconds = started - request.enqueued_at
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        try:
+            result = await loop.run_in_executor(self._executor, request.func)
+        except Exception as e:
+            self.total_failed += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            self.total_completed += 1
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            service_seconds = loop.time() - started
+            self.total_service_seconds += service_seconds
+            self.max_service_seconds = max(self.max_service_seconds, service_seconds)
+            self._running_chats.discard(chat_id)
+            # 该聊天还有排队的请求时排到轮转队尾
+            if self._queues.get(chat_id):
+                self._ready.append(chat_id)
+            else:
+                self._queues.pop(chat_id, None)
+            self._dispatch()
+
+    def get_stats(self) -> dict:
+        finished = self.total_completed + self.total_failed
+        started = finished + self.running
+        return {
+            'running': self.running,
+            'pending': self.pending,
+            'queued_chats': sum(1 for queue in self._queues.values() if queue),
+            'submitted': self.total_submitted,
+            'completed': self.total_completed,
+            'failed': self.total_failed,
+            'superseded': self.total_superseded,
+            'rejected': self.total_rejected,
+            'background': self.total_background,
+            'avg_wait_seconds': self.total_wait_seconds / started if started else 0.0,
+            'max_wait_seconds': self.max_wait_seconds,
+            'avg_service_seconds': self.total_service_seconds / finished if finished else 0.0,
+            'max_service_seconds': self.max_service_seconds,
+        }
+
+
+# 全局唯一的 AI 请求调度器
+ai_dispatcher = AiDispatcher()
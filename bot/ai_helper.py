@@ -2,28 +2,32 @@
 from __future__ import annotations
 
 import logging
-import os
-import hashlib
+import threading
 from PIL import Image
 from io import BytesIO
-from typing import Optional
+from typing import Dict, Iterator, Optional, Tuple
+import google.ai.generativelanguage as glm
 import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import diskcache
 
 from .key_manager import api_key_manager
-from .config import GOOGLE_SEARCH_API_KEY, GOOGLE_SEARCH_ENGINE_ID
+from .ai_cache import ai_response_cache
+from .config import GOOGLE_SEARCH_API_KEY, GOOGLE_SEARCH_ENGINE_ID, AI_HISTORY_SUMMARY_MAX_CHARS
 from .localization import get_text
 
-# --- 缓存设置 ---
-CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'ai_cache')
-os.makedirs(CACHE_DIR, exist_ok=True)
-response_cache = diskcache.Cache(CACHE_DIR, size_limit=256 * 1024 * 1024)
-
 logger = logging.getLogger(__name__)
 
+AI_MODEL_NAME = 'gemini-2.5-flash'
+
+# --- 模型与客户端缓存 ---
+# 每个 API 密钥对应一个独立的 gRPC 客户端，每个 (密钥, 语言) 对应一个模型实例。
+# 不再调用 genai.configure() 修改 SDK 的全局状态，并发请求之间不会互相覆盖密钥。
+_clients: Dict[str, glm.GenerativeServiceClient] = {}
+_models: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+_model_lock = threading.Lock()
+
 
 def get_system_instruction(lang_code: str) -> str:
     """根据语言代码生成完整的系统指令。"""
@@ -34,6 +38,33 @@ def get_system_instruction(lang_code: str) -> str:
     return base_prompt + formatting_prompt + language_enforcement_prompt
 
 
+def _get_client(api_key: str) -> glm.GenerativeServiceClient:
+    """返回绑定到指定密钥的客户端，调用方需持有 _model_lock。"""
+    client = _clients.get(api_key)
+    if client is None:
+        client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        _clients[api_key] = client
+    return client
+
+
+def get_model(api_key: str, lang_code: str) -> genai.GenerativeModel:
+    """获取 (密钥, 语言) 对应的模型实例，首次使用时创建。模型本身无会话状态，可在线程间共享。"""
+    cache_key = (api_key, lang_code)
+    model = _models.get(cache_key)
+    if model is not None:
+        return model
+    with _model_lock:
+        model = _models.get(cache_key)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=AI_MODEL_NAME,
+                system_instruction=get_system_instruction(lang_code)
+            )
+            model._client = _get_client(api_key)
+            _models[cache_key] = model
+        return model
+
+
 def google_search(query: str, num_results: int = 5) -> Optional[dict]:
     """执行Google自定义搜索并返回原始结果。"""
     logger.info(f"正在执行谷歌搜索，查询: '{query}'")
@@ -52,39 +83,57 @@ def google_search(query: str, num_results: int = 5) -> Optional[dict]:
         return None
 
 
-def generate_ai_response(chat_history: list, new_prompt: str, user_name: str, lang_code: str, image_bytes: bytes = None) -> str:
+def estimate_tokens(chat_history: list, new_prompt: str, image_bytes: bytes = None) -> int:
+    """粗略估算一次请求的 token 数 (约 4 个字符 1 个 token，图片按固定 258 个)，用于密钥池预扣 TPM 配额。"""
+    chars = len(new_prompt or '') + sum(len(msg.get('content') or '') for msg in chat_history)
+    return chars // 4 + (258 if image_bytes else 0) + 1
+
+
+def generate_ai_response(chat_history: list, new_prompt: str, user_name: str, lang_code: str, image_bytes: bytes = None,
+                         chat_id: Optional[int] = None) -> str:
     """
     通过轮换API密钥来生成AI响应，并提供更清晰的错误反馈。
+    传入 chat_id 时启用按聊天上下文缓存的那一层。
+    """
+    return "".join(_iter_ai_response(chat_history, new_prompt, lang_code, image_bytes, chat_id, stream=False))
+
+
+def stream_ai_response(chat_history: list, new_prompt: str, user_name: str, lang_code: str, image_bytes: bytes = None,
+                       chat_id: Optional[int] = None) -> Iterator[str]:
     """
-    # 如果没有图片，为纯文本请求创建缓存键
-    cache_key = None
-    if not image_bytes:
-        history_str = "".join([msg.get('content', '') for msg in chat_history])
-        raw_key = f"{lang_code}-{history_str}-{new_prompt}"
-        cache_key = hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
-
-        if cache_key in response_cache:
-            logger.info(f"缓存命中: 为哈希键 '{cache_key[:8]}...' 返回缓存的响应。")
-            return response_cache.get(cache_key)
-
-    # 加上初始尝试，总共可以尝试 len(keys) + 1 次
-    max_retries = len(api_key_manager.keys)
-    attempt = 0
-    while attempt <= max_retries:
-        current_key = api_key_manager.get_current_key()
+    流式生成AI响应，逐段产出文本片段 (拼接起来即完整回复)。
+    这是一个阻塞的生成器，应在线程中迭代。出错时产出错误提示文本；已输出部分内容后出错则抛出异常。
+    """
+    return _iter_ai_response(chat_history, new_prompt, lang_code, image_bytes, chat_id, stream=True)
+
+
+def _iter_ai_response(chat_history: list, new_prompt: str, lang_code: str, image_bytes: Optional[bytes],
+                      chat_id: Optional[int], stream: bool) -> Iterator[str]:
+    # 分层缓存：上下文层 / 独立问题层 / 图片层，详见 ai_cache
+    cache_keys = ai_response_cache.keys_for(lang_code, AI_MODEL_NAME, chat_history, new_prompt, chat_id, image_bytes)
+    cached_response = ai_response_cache.get(cache_keys)
+    if cached_response is not None:
+        yield cached_response
+        return
+
+    if not api_key_manager.keys:
+        logger.error("配置中没有任何可用的Google AI API密钥。")
+        yield get_text('internal_error', lang_code)
+        return
+
+    estimated_tokens = estimate_tokens(chat_history, new_prompt, image_bytes)
+    # 每个密钥最多尝试一次，配额耗尽的密钥会进入冷却，由密钥池换一个重试
+    tried_keys = set()
+    while len(tried_keys) < len(api_key_manager.keys):
+        current_key = api_key_manager.acquire(estimated_tokens, exclude=tried_keys)
         if not current_key:
-            # 如果一开始就没有可用的密钥
-            logger.error("配置中没有任何可用的Google AI API密钥。")
-            return get_text('internal_error', lang_code)
+            break
+        tried_keys.add(current_key)
+        emitted = []
 
         try:
-            genai.configure(api_key=current_key)
-            system_instruction = get_system_instruction(lang_code)
-            model = genai.GenerativeModel(
-                model_name='gemini-2.5-flash',
-                system_instruction=system_instruction
-            )
-            
+            model = get_model(current_key, lang_code)
+
             content_parts = []
             if image_bytes:
                 img = Image.open(BytesIO(image_bytes))
@@ -98,31 +147,95 @@ def generate_ai_response(chat_history: list, new_prompt: str, user_name: str, la
             ]
             
             chat_session = model.start_chat(history=gemini_history)
-            response = chat_session.send_message(content_parts)
-            final_response_text = response.text
+            response = chat_session.send_message(content_parts, stream=stream)
+            if stream:
+                for chunk in response:
+                    text = chunk.text
+                    if text:
+                        emitted.append(text)
+                        yield text
+            else:
+                emitted.append(response.text)
+            final_response_text = "".join(emitted)
+            usage = getattr(response, 'usage_metadata', None)
+            api_key_manager.report_success(
+                current_key, getattr(usage, 'total_token_count', None) or None, estimated_tokens
+            )
 
-            # 如果响应成功且是纯文本，则存入缓存
-            if not image_bytes and cache_key:
-                response_cache.set(cache_key, final_response_text, expire=3600)
+            # 如果响应成功，则存入缓存
+            if final_response_text:
+                ai_response_cache.set(cache_keys, final_response_text)
             
-            return final_response_text
+            if not stream:
+                yield final_response_text
+            return
+
+        except GeneratorExit:
+            # 调用方提前停止了迭代，只需归还密钥
+            api_key_manager.report_success(current_key, None, estimated_tokens)
+            raise
 
         except google_exceptions.ResourceExhausted as e:
             logger.warning(f"API密钥配额耗尽: {e}")
-            api_key_manager.switch_to_next_key()
-            attempt += 1
-            if attempt <= max_retries:
+            api_key_manager.report_exhausted(current_key)
+            if stream and emitted:
+                # 已经输出了部分内容，无法透明地换密钥重试
+                raise
+            if len(tried_keys) < len(api_key_manager.keys):
                 logger.info("正在尝试使用下一个密钥重试...")
             continue
         
         except Exception as e:
+            api_key_manager.report_failure(current_key)
+            if stream and emitted:
+                raise
             # 【修改】添加强制打印，以便在终端直接看到任何未知错误
             print(f"DEBUG: AI call failed with a non-retriable error: {e}")
             logger.error(f"调用 Gemini API 时发生未知错误: {e}", exc_info=True)
             # 遇到未知错误，直接返回，不再尝试其他密钥
-            return get_text('internal_error', lang_code)
+            yield get_text('internal_error', lang_code)
+            return
 
-    # 【修改】如果 while 循环正常结束，说明所有密钥都已尝试过且均因用量耗尽而失败
-    logger.error("所有Google AI API密钥均已耗尽或无效！机器人已放弃尝试。")
+    # 所有密钥都已尝试过且因用量耗尽而失败，或全部处于冷却中
+    logger.error("所有Google AI API密钥均已耗尽或处于冷却中，本次请求放弃。")
 
-    return get_text('internal_error', lang_code)
+    yield get_text('internal_error', lang_code)
+
+
+def summarize_history(previous_summary: Optional[str], messages: list, lang_code: str) -> Optional[str]:
+    """
+    把旧摘要和一批较早的对话压缩成新的滚动摘要 (纯文本)，失败时返回 None。
+    不经过回复缓存；配额耗尽时与普通请求一样换密钥重试。
+    """
+    transcript = "\n".join(
+        f"{'User' if msg.get('role') == 'user' else 'Assistant'}: {msg.get('content', '')}" for msg in messages
+    )
+    prompt = (
+        "Update the running summary of this conversation so it can replace the messages below as context.\n"
+        f"Keep names, facts, decisions and open questions. Reply with plain text only (no Markdown), "
+        f"in language code {lang_code}, at most {AI_HISTORY_SUMMARY_MAX_CHARS} characters.\n\n"
+        f"--- Previous summary ---\n{previous_summary or '(none)'}\n\n--- Messages ---\n{transcript}"
+    )
+    estimated_tokens = estimate_tokens([], prompt)
+    tried_keys = set()
+    while len(tried_keys) < len(api_key_manager.keys):
+        current_key = api_key_manager.acquire(estimated_tokens, exclude=tried_keys)
+        if not current_key:
+            break
+        tried_keys.add(current_key)
+        try:
+            response = get_model(current_key, lang_code).generate_content(prompt)
+            summary = response.text.strip()
+            usage = getattr(response, 'usage_metadata', None)
+            api_key_manager.report_success(
+                current_key, getattr(usage, 'total_token_count', None) or None, estimated_tokens
+            )
+            return summary[:AI_HISTORY_SUMMARY_MAX_CHARS] or None
+        except google_exceptions.ResourceExhausted as e:
+            logger.warning(f"生成对话摘要时API密钥配额耗尽: {e}")
+            api_key_manager.report_exhausted(current_key)
+        except Exception as e:
+            api_key_manager.report_failure(current_key)
+            logger.error(f"生成对话摘要时出错: {e}", exc_info=True)
+            return None
+    return None
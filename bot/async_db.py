@@ -0,0 +1,81 @@
+# bot/async_db.py
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+from typing import Any, Callable, List
+
+from . import statistics
+from .config import DB_WORKER_THREADS
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """
+    aiosqlite 风格的异步数据库门面。
+
+    所有阻塞的数据库调用都被放入请求队列，由专用的数据库线程依次执行，
+    调用方只需 await 结果，事件循环不会被任何查询阻塞。
+    每个数据库线程复用 statistics 模块中属于自己的长连接。
+
+    用法:
+        settings = await adb.db_get_user_settings(user.id)     # 直接代理 statistics 中的函数
+        level = await adb.run(memory.record_and_get_warning_level, chat.id, user.id)  # 执行任意会访问数据库的函数
+    """
+
+    def __init__(self, worker_count: int = DB_WORKER_THREADS):
+        self._worker_count = max(1, worker_count)
+        self._requests: queue.SimpleQueue = queue.SimpleQueue()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self._worker_count):
+                thread = threading.Thread(target=self._worker, name=f"db-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            future, func, args, kwargs = self._requests.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """将调用放入请求队列，返回 concurrent.futures.Future。可在任意线程中使用。"""
+        self._ensure_started()
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._requests.put((future, func, args, kwargs))
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在数据库线程中执行 func(*args, **kwargs) 并等待结果。"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def __getattr__(self, name: str):
+        target = getattr(statistics, name)
+        if not callable(target):
+            raise AttributeError(name)
+
+        @functools.wraps(target)
+        async def _proxy(*args, **kwargs):
+            return await self.run(target, *args, **kwargs)
+        return _proxy
+
+
+# 全局唯一的异步数据库门面
+adb = AsyncDatabase()
@@ -1,68 +1,192 @@
 # bot/blacklist_manager.py
 from __future__ import annotations
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import os
 import json
+import heapq
+import logging
+import threading
 from datetime import datetime, timedelta, timezone
 
+from . import statistics as db
+from .async_db import adb
+
+logger = logging.getLogger(__name__)
+
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+# 旧版本使用的 JSON 黑名单文件，启动时一次性迁移到数据库
 BLACKLIST_FILE = os.path.join(DATA_DIR, 'blacklist.json')
 os.makedirs(DATA_DIR, exist_ok=True)
 
-blacklisted_users = {}
 
-def _save_blacklist():
-    """将内存中的黑名单（datetime对象）转换为ISO格式字符串并保存到文件。"""
+# ==============================================================================
+# 黑名单 (内存索引 + SQLite blacklist 表批量持久化)
+# ==============================================================================
+
+def _parse_expiration(value: str) -> Optional[datetime]:
     try:
-        serializable_blacklist = {
-            str(uid): dt.isoformat() for uid, dt in blacklisted_users.items()
-        }
-        with open(BLACKLIST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(serializable_blacklist, f, indent=2)
-    except Exception as e:
-        print(f"保存黑名单时出错: {e}")
+        expiration = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    # 早期写入的时间可能不带时区，按 UTC 处理
+    return expiration if expiration.tzinfo else expiration.replace(tzinfo=timezone.utc)
 
-def _load_blacklist():
-    """从文件加载黑名单，并将ISO格式字符串转换回datetime对象。"""
-    global blacklisted_users
-    if not os.path.exists(BLACKLIST_FILE):
-        return
 
-    try:
-        with open(BLACKLIST_FILE, 'r', encoding='utf-8') as f:
-            serialized_blacklist = json.load(f)
+class BlacklistIndex:
+    """
+    黑名单的内存索引：user_id -> 解封时间，外加按解封时间排序的最小堆。
+
+    - 查询是一次字典查找，不访问数据库也不解析时间字符串；
+    - 已过期的条目在查询时惰性删除，定时任务通过最小堆批量清理，每条 O(log n)；
+    - 添加、移除只更新内存并记入待写入变更，由定时任务在数据库线程中批量写入 blacklist 表
+      (同一用户的多次变更只保留最后一次)。
+
+    堆中可能残留被覆盖或已移除的旧条目，弹出时与字典中的当前值比对后跳过。
+    """
+
+    def __init__(self):
+        self._expirations: Dict[int, datetime] = {}
+        self._heap: List[Tuple[datetime, int]] = []
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Optional[str]] = {}  # user_id -> 解封时间 (None 表示删除)
+        self._flush_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expirations)
 
+    def load(self) -> int:
+        """
+        从数据库加载所有未过期的条目并迁移旧版 JSON 文件 (会访问数据库，应在启动时于数据库线程中调用)，
+        返回条目数。
+        """
         now = datetime.now(timezone.utc)
-        temp_blacklist = {}
-        for uid_str, dt_str in serialized_blacklist.items():
+        expirations = {}
+        for row in db.db_get_all_blacklist_entries():
+            expiration = _parse_expiration(row['expiration_timestamp'])
+            if expiration is not None and expiration > now:
+                expirations[int(row['user_id'])] = expiration
+        migrated = self._migrate_json_file(expirations, now)
+        heap = [(expiration, user_id) for user_id, expiration in expirations.items()]
+        heapq.heapify(heap)
+        with self._lock:
+            self._expirations, self._heap = expirations, heap
+            for user_id in migrated:
+                self._pending[user_id] = expirations[user_id].isoformat()
+        self.flush()
+        logger.info(f"已加载 {len(expirations)} 条黑名单记录。")
+        return len(expirations)
+
+    @staticmethod
+    def _migrate_json_file(expirations: Dict[int, datetime], now: datetime) -> List[int]:
+        """把旧版 blacklist.json 中未过期的条目合并进 expirations (取较晚的解封时间)，完成后重命名为 .migrated。"""
+        if not os.path.exists(BLACKLIST_FILE):
+            return []
+        migrated = []
+        try:
+            with open(BLACKLIST_FILE, 'r', encoding='utf-8') as f:
+                serialized_blacklist = json.load(f)
+            for uid_str, dt_str in serialized_blacklist.items():
+                expiration = _parse_expiration(dt_str)
+                try:
+                    user_id = int(uid_str)
+                except ValueError:
+                    continue  # 忽略格式错误的数据
+                if expiration is None or expiration <= now:
+                    continue
+                if user_id not in expirations or expirations[user_id] < expiration:
+                    expirations[user_id] = expiration
+                    migrated.append(user_id)
+            os.replace(BLACKLIST_FILE, BLACKLIST_FILE + '.migrated')
+            logger.info(f"已从 {BLACKLIST_FILE} 迁移 {len(migrated)} 条黑名单记录到数据库。")
+        except Exception as e:
+            logger.error(f"迁移 JSON 黑名单时出错: {e}")
+        return migrated
+
+    def get_expiration(self, user_id: int) -> Optional[datetime]:
+        """返回用户的解封时间；未被拉黑或已过期时返回 None (过期条目顺便移除)。"""
+        expiration = self._expirations.get(user_id)
+        if expiration is None:
+            return None
+        if expiration > datetime.now(timezone.utc):
+            return expiration
+        self.remove(user_id)
+        return None
+
+    def add(self, user_id: int, expiration: datetime):
+        with self._lock:
+            self._expirations[user_id] = expiration
+            heapq.heappush(self._heap, (expiration, user_id))
+            self._pending[user_id] = expiration.isoformat()
+
+    def remove(self, user_id: int) -> bool:
+        with self._lock:
+            removed = self._expirations.pop(user_id, None) is not None
+            if removed:
+                self._pending[user_id] = None
+        return removed
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> int:
+        """把待写入的变更在一个事务中写入数据库，返回写入的条数。失败时变更放回队列。可在任意线程中同步调用。"""
+        with self._flush_lock:
+            with self._lock:
+                changes, self._pending = self._pending, {}
+            if not changes:
+                return 0
+            upserts = [(user_id, expiration) for user_id, expiration in changes.items() if expiration is not None]
+            deletes = [user_id for user_id, expiration in changes.items() if expiration is None]
             try:
-                expiration_dt = datetime.fromisoformat(dt_str)
-                if expiration_dt > now:
-                    temp_blacklist[int(uid_str)] = expiration_dt
-            except (ValueError, TypeError):
-                continue # 忽略格式错误的数据
-        blacklisted_users = temp_blacklist
-        _save_blacklist()
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"加载黑名单时出错: {e}")
-        blacklisted_users = {}
+                db.db_save_blacklist_changes(upserts, deletes)
+            except Exception:
+                with self._lock:
+                    # 期间产生的新变更优先
+                    changes.update(self._pending)
+                    self._pending = changes
+                raise
+            return len(changes)
+
+    async def flush_async(self) -> int:
+        """在数据库线程中执行 flush()，不阻塞事件循环。"""
+        return await adb.run(self.flush)
+
+    def purge_expired(self) -> List[int]:
+        """从堆顶弹出所有已过期的条目，返回被移除的用户 ID。数据库中的过期记录由调用方另行清理。"""
+        now = datetime.now(timezone.utc)
+        purged = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expiration, user_id = heapq.heappop(self._heap)
+                if self._expirations.get(user_id) == expiration:
+                    del self._expirations[user_id]
+                    purged.append(user_id)
+        return purged
+
+
+# 全局唯一的黑名单索引
+blacklist_index = BlacklistIndex()
+
+
+async def blacklist_flush_job(context):
+    """定时任务：批量写入黑名单的变更。"""
+    try:
+        await blacklist_index.flush_async()
+    except Exception as e:
+        logger.error(f"写入黑名单变更时出错: {e}", exc_info=True)
+
+
+# --- 兼容旧接口 ---
 
 def add_to_blacklist(user_id: int, duration_seconds: int = 3600):
     """将用户添加到黑名单。"""
-    expiration_time = datetime.now(timezone.utc) + timedelta(seconds=duration_seconds)
-    blacklisted_users[user_id] = expiration_time
-    print(f"用户 {user_id} 已被添加到黑名单，直到 {expiration_time.isoformat()}")
-    _save_blacklist()
+    blacklist_index.add(user_id, datetime.now(timezone.utc) + timedelta(seconds=duration_seconds))
 
-def remove_from_blacklist(user_id: int):
+def remove_from_blacklist(user_id: int) -> bool:
     """从黑名单中移除用户。"""
-    if user_id in blacklisted_users:
-        del blacklisted_users[user_id]
-        print(f"用户 {user_id} 已从内部黑名单中移除。")
-        _save_blacklist()
-        return True
-    return False
+    return blacklist_index.remove(user_id)
 
 def get_user_blacklist_expiration(user_id: int) -> Optional[datetime]:
     """
@@ -70,15 +194,4 @@ def get_user_blacklist_expiration(user_id: int) -> Optional[datetime]:
     如果被拉黑，则返回其解封时间的datetime对象。
     如果未被拉黑或已过期，则返回 None。
     """
-    expiration_time = blacklisted_users.get(user_id)
-    if not expiration_time:
-        return None
-
-    if datetime.now(timezone.utc) > expiration_time:
-        remove_from_blacklist(user_id) # 使用新函数来移除
-        print(f"用户 {user_id} 的黑名单已过期并被移除。")
-        return None
-
-    return expiration_time
-
-_load_blacklist()
\ No newline at end of file
+    return blacklist_index.get_expiration(user_id)
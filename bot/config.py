@@ -46,4 +46,89 @@ USER_RANKING_BLACKLIST = [
     '777000',  # Telegram 官方账号
     # '12345678', # 示例：添加另一个你想屏蔽的 bot ID
     # '87654321', # 示例：再添加一个
-]
\ No newline at end of file
+]
+
+# ### SQLite 连接池与 PRAGMA 配置 ###
+# 每个线程复用一条长连接，以下 PRAGMA 在连接创建时统一设置
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))  # 字节
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))  # 负数表示 KiB
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))  # 每条连接缓存的预编译语句数
+
+
+# ### 消息批量写入队列配置 ###
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "100"))  # 缓冲达到该条数时立即写入
+MESSAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_SECONDS", "2"))  # 定时写入间隔
+MESSAGE_QUEUE_MAX_PENDING = int(os.getenv("MESSAGE_QUEUE_MAX_PENDING", "5000"))  # 内存中最多缓冲的消息条数
+
+# ### 异步数据库门面配置 ###
+# 所有处理器中的数据库调用都在这些专用线程中执行，多于 1 个线程时慢查询不会阻塞点查询
+DB_WORKER_THREADS = int(os.getenv("DB_WORKER_THREADS", "2"))
+
+# ### 用户/群组设置缓存配置 ###
+SETTINGS_CACHE_MAXSIZE = int(os.getenv("SETTINGS_CACHE_MAXSIZE", "4096"))  # 用户和群组各自最多缓存的条数
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "300"))  # 缓存过期时间
+
+# ### 排名服务配置 ###
+RANK_SERVICE_MAX_BOARDS = int(os.getenv("RANK_SERVICE_MAX_BOARDS", "300"))  # 内存中最多保留的排行榜个数 (每个群组每个周期一个)
+
+# ### 话题统计配置 ###
+TOPIC_WORKER_THREADS = int(os.getenv("TOPIC_WORKER_THREADS", "1"))  # 分词线程数
+TOPIC_RETENTION_DAYS = int(os.getenv("TOPIC_RETENTION_DAYS", "62"))  # 话题词频保留天数 (需覆盖最长的统计周期“本月”)
+TOPIC_MAX_TEXT_LENGTH = int(os.getenv("TOPIC_MAX_TEXT_LENGTH", "500"))  # 每条消息只对前 N 个字符分词
+
+# ### 广告关键词热加载配置 ###
+KEYWORD_RELOAD_INTERVAL_SECONDS = int(os.getenv("KEYWORD_RELOAD_INTERVAL_SECONDS", "30"))  # 检查 blacklist_keywords.txt 是否变化的间隔
+
+# ### 关键词回复 (FAQ) 匹配配置 ###
+FAQ_INDEX_CACHE_SIZE = int(os.getenv("FAQ_INDEX_CACHE_SIZE", "1000"))  # 内存中最多缓存的群组 FAQ 索引数
+FAQ_RERANK_TOP_K = int(os.getenv("FAQ_RERANK_TOP_K", "10"))  # 经 n-gram 索引筛选后，用 SequenceMatcher 精确比较的候选数
+
+# ### Google AI 密钥池配置 ###
+GOOGLE_API_KEY_RPM = int(os.getenv("GOOGLE_API_KEY_RPM", "10"))  # 每个密钥每分钟最多请求数
+GOOGLE_API_KEY_TPM = int(os.getenv("GOOGLE_API_KEY_TPM", "250000"))  # 每个密钥每分钟最多 token 数
+GOOGLE_API_KEY_COOLDOWN_SECONDS = float(os.getenv("GOOGLE_API_KEY_COOLDOWN_SECONDS", "60"))  # 配额耗尽后首次冷却时间，连续耗尽时翻倍
+GOOGLE_API_KEY_MAX_COOLDOWN_SECONDS = float(os.getenv("GOOGLE_API_KEY_MAX_COOLDOWN_SECONDS", "3600"))  # 冷却时间上限
+GOOGLE_API_KEY_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_API_KEY_ACQUIRE_TIMEOUT_SECONDS", "10"))  # 所有密钥都受限时最多等待多久
+
+# ### AI 流式回复配置 ###
+AI_STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("AI_STREAM_EDIT_INTERVAL_SECONDS", "1.5"))  # 两次编辑占位消息的最小间隔 (Telegram 限制编辑频率)
+
+# ### AI 请求调度配置 ###
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))  # 同时进行的 AI 请求数 (专用线程数)
+AI_QUEUE_MAX_PENDING = int(os.getenv("AI_QUEUE_MAX_PENDING", "50"))  # 全局最多排队的请求数，超出时回复“忙碌”
+AI_QUEUE_MAX_PER_CHAT = int(os.getenv("AI_QUEUE_MAX_PER_CHAT", "5"))  # 每个聊天最多排队的请求数
+
+# ### AI 回复缓存配置 ###
+AI_CACHE_SIZE_LIMIT_MB = int(os.getenv("AI_CACHE_SIZE_LIMIT_MB", "256"))  # 磁盘缓存大小上限
+AI_CACHE_PROMPT_TTL_SECONDS = int(os.getenv("AI_CACHE_PROMPT_TTL_SECONDS", "86400"))  # 独立问题层：只按规范化后的问题缓存
+AI_CACHE_CONTEXT_TTL_SECONDS = int(os.getenv("AI_CACHE_CONTEXT_TTL_SECONDS", "1800"))  # 上下文层：按聊天 + 最近几轮对话 + 问题缓存，设为 0 关闭
+AI_CACHE_CONTEXT_TURNS = int(os.getenv("AI_CACHE_CONTEXT_TURNS", "4"))  # 上下文层参与缓存键的最近对话条数
+AI_CACHE_IMAGE_TTL_SECONDS = int(os.getenv("AI_CACHE_IMAGE_TTL_SECONDS", "86400"))  # 图片层：按图片内容哈希 + 问题缓存
+
+# ### AI 对话历史窗口配置 ###
+AI_HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "3000"))  # 每次请求携带的历史记录 (含摘要) 的 token 上限
+AI_HISTORY_SUMMARY_TRIGGER_TOKENS = int(os.getenv("AI_HISTORY_SUMMARY_TRIGGER_TOKENS", "1500"))  # 窗口外的旧消息累计到该 token 数时压缩进摘要
+AI_HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("AI_HISTORY_SUMMARY_MAX_CHARS", "800"))  # 滚动摘要的最大长度
+
+# ### AI 对话历史持久化配置 ###
+CHAT_HISTORY_SAVE_INTERVAL_SECONDS = int(os.getenv("CHAT_HISTORY_SAVE_INTERVAL_SECONDS", "30"))  # 保存有变化的聊天记录的间隔
+
+# ### 黑名单配置 ###
+BLACKLIST_FLUSH_INTERVAL_SECONDS = float(os.getenv("BLACKLIST_FLUSH_INTERVAL_SECONDS", "5"))  # 批量写入黑名单变更的间隔
+
+# ### 刷屏检测配置 ###
+FLOOD_MAX_MESSAGES = int(os.getenv("FLOOD_MAX_MESSAGES", "3"))  # 默认阈值：窗口内发送这么多条即判定为刷屏 (群组可用 /setflood 单独设置)
+FLOOD_WINDOW_SECONDS = float(os.getenv("FLOOD_WINDOW_SECONDS", "3"))  # 默认滑动窗口长度
+FLOOD_TRACKER_MAX_ENTRIES = int(os.getenv("FLOOD_TRACKER_MAX_ENTRIES", "50000"))  # 最多同时跟踪的 (群组, 用户) 数
+FLOOD_TRACKER_IDLE_SECONDS = int(os.getenv("FLOOD_TRACKER_IDLE_SECONDS", "600"))  # 超过这么久没发言的用户不再跟踪
+
+# ### 机器人身份缓存配置 ###
+BOT_IDENTITY_REFRESH_INTERVAL_SECONDS = int(os.getenv("BOT_IDENTITY_REFRESH_INTERVAL_SECONDS", "3600"))  # 重新获取机器人用户名的间隔
+
+# ### 群管理员缓存配置 ###
+ADMIN_CACHE_TTL_SECONDS = int(os.getenv("ADMIN_CACHE_TTL_SECONDS", "600"))  # 管理员列表过期后在后台刷新，期间继续使用旧值
+ADMIN_CACHE_MAX_CHATS = int(os.getenv("ADMIN_CACHE_MAX_CHATS", "5000"))  # 最多缓存的群组数
+ADMIN_CACHE_FAILURE_BACKOFF_SECONDS = int(os.getenv("ADMIN_CACHE_FAILURE_BACKOFF_SECONDS", "60"))  # 获取管理员列表失败后，这段时间内不再重试
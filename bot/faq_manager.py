@@ -1,13 +1,20 @@
 # bot/faq_manager.py (已完全改造为使用数据库)
 from __future__ import annotations
 
+import bisect
+import heapq
 import logging
 import re
+import threading
+from collections import Counter, defaultdict
 from difflib import SequenceMatcher
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
+
+from cachetools import LRUCache
 
 # 导入 statistics 模块作为数据库访问的唯一入口
 from . import statistics as db
+from .config import FAQ_INDEX_CACHE_SIZE, FAQ_RERANK_TOP_K
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +37,143 @@ def _extract_keywords(text: str) -> str:
     # 按空格分割，并移除空字符串，最后重新组合
     return " ".join([word for word in cleaned_text.split() if word])
 
+def _ngrams(keywords: str) -> Set[str]:
+    """把关键词字符串切成字符二元组 (单字词保留为一元组)，中英文通用。"""
+    grams = set()
+    for word in keywords.split():
+        if len(word) == 1:
+            grams.add(word)
+        else:
+            grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+class _FaqIndex:
+    """
+    单个群组的 FAQ 相似度索引：在 keywords 列的字符 n-gram 上建立倒排表。
+    查询时只访问与消息共享 n-gram 的 FAQ，按 Dice 系数取前几名，再用 SequenceMatcher 精确打分。
+    """
+
+    def __init__(self, faqs: List[Dict]):
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self.gram_counts: List[int] = []
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for idx, faq in enumerate(faqs):
+            grams = _ngrams(faq.get('keywords') or _extract_keywords(faq['question']))
+            self.questions.append(faq['question'].lower())
+            self.answers.append(faq['answer'])
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(idx)
+
+    def candidates(self, text: str, top_k: int) -> List[int]:
+        query_grams = _ngrams(_extract_keywords(text))
+        if not query_grams:
+            return []
+        overlap: Counter = Counter()
+        for gram in query_grams:
+            for idx in self.postings.get(gram, ()):
+                overlap[idx] += 1
+        query_size = len(query_grams)
+        return heapq.nlargest(
+            top_k, overlap,
+            key=lambda idx: 2 * overlap[idx] / (query_size + self.gram_counts[idx])
+        )
+
+
+class _FaqBounds:
+    """
+    单个群组 FAQ 的廉价上界：问题长度 (已排序) 和问题中出现过的全部字符。
+    SequenceMatcher 的 ratio = 2M / (la + lb)，其中匹配字符数 M 不超过较短一方的长度，
+    也不超过消息中出现在 FAQ 字符集里的字符数 S，所以 ratio <= 2 * min(S, lb) / (la + lb)。
+    """
+
+    def __init__(self, questions: List[str]):
+        lowered = [q.lower() for q in questions]
+        self.lengths = sorted(len(q) for q in lowered)
+        self.charset = set().union(*lowered)
+
+    def max_similarity(self, lower_text: str) -> float:
+        la = len(lower_text)
+        shared = sum(1 for char in lower_text if char in self.charset)
+        # 上界在 lb <= S 时随 lb 递增、在 lb >= S 时递减，只需检查 S 两侧最近的长度
+        pos = bisect.bisect_left(self.lengths, shared)
+        best = 0.0
+        for i in (pos - 1, pos):
+            if 0 <= i < len(self.lengths):
+                lb = self.lengths[i]
+                best = max(best, 2 * min(shared, lb) / (la + lb))
+        return best
+
+
+# --- 预筛选：在事件循环中直接判断，不访问数据库 ---
+_prefilter_bounds: Dict[str, _FaqBounds] = {}  # 只包含至少有一条 FAQ 的群组
+_prefilter_loaded = False
+_prefilter_stats = {'checked': 0, 'rejected_no_faq': 0, 'rejected_bounds': 0}
+
+def load_prefilter():
+    """启动时从数据库加载所有群组的 FAQ 长度与字符集。"""
+    global _prefilter_bounds, _prefilter_loaded
+    questions_by_chat: Dict[str, List[str]] = defaultdict(list)
+    for chat_id, question in db.db_get_all_faq_questions():
+        questions_by_chat[chat_id].append(question)
+    _prefilter_bounds = {chat_id: _FaqBounds(questions) for chat_id, questions in questions_by_chat.items()}
+    _prefilter_loaded = True
+    logger.info(f"已加载 {len(_prefilter_bounds)} 个群组的 FAQ 预筛选数据。")
+
+def _refresh_prefilter(chat_id: int):
+    questions = [faq['question'] for faq in get_faqs_for_chat(chat_id)]
+    if questions:
+        _prefilter_bounds[str(chat_id)] = _FaqBounds(questions)
+    else:
+        _prefilter_bounds.pop(str(chat_id), None)
+
+def should_try_match(chat_id: int, text: str) -> bool:
+    """
+    判断消息是否有可能达到 SIMILARITY_THRESHOLD。返回 False 时可以跳过 find_similar_question。
+    预筛选数据尚未加载时一律放行。
+    """
+    _prefilter_stats['checked'] += 1
+    if not _prefilter_loaded:
+        return True
+    bounds = _prefilter_bounds.get(str(chat_id))
+    if bounds is None:
+        _prefilter_stats['rejected_no_faq'] += 1
+        return False
+    if not text or bounds.max_similarity(text.lower()) < SIMILARITY_THRESHOLD:
+        _prefilter_stats['rejected_bounds'] += 1
+        return False
+    return True
+
+def get_prefilter_stats() -> Dict[str, int]:
+    """返回预筛选的检查次数和各类拒绝次数。"""
+    return dict(_prefilter_stats)
+
+
+_indexes: LRUCache = LRUCache(maxsize=FAQ_INDEX_CACHE_SIZE)
+_index_lock = threading.Lock()
+_index_invalidations = 0  # 每次失效 +1，防止构建中的旧索引在失效后被写回缓存
+
+def _get_index(chat_id: int) -> _FaqIndex:
+    with _index_lock:
+        index = _indexes.get(chat_id)
+        if index is not None:
+            return index
+        generation = _index_invalidations
+    index = _FaqIndex(get_faqs_for_chat(chat_id))
+    with _index_lock:
+        if generation == _index_invalidations:
+            _indexes[chat_id] = index
+    return index
+
+def _invalidate_index(chat_id: int):
+    global _index_invalidations
+    with _index_lock:
+        _index_invalidations += 1
+        _indexes.pop(chat_id, None)
+    _refresh_prefilter(chat_id)
+
 def add_faq(chat_id: int, question: str, answer: str) -> bool:
     """
     为指定群组在数据库中添加一条新的FAQ。
@@ -40,6 +184,7 @@ def add_faq(chat_id: int, question: str, answer: str) -> bool:
     success = db.db_add_faq(chat_id, question, answer, keywords)
     
     if success:
+        _invalidate_index(chat_id)
         logger.info(f"为群组 {chat_id} 添加了新FAQ到数据库: '{question[:20]}...'")
     else:
         logger.warning(f"尝试为群组 {chat_id} 添加已存在的FAQ (数据库操作被阻止): '{question[:20]}...'")
@@ -64,14 +209,23 @@ def delete_faq(chat_id: int, index: int) -> Optional[str]:
     deleted_question_text = item_to_delete['question']
     
     # 根据主键 ID 调用数据库删除函数
-    if db.db_delete_faq(faq_id_to_delete):
-        logger.info(f"从群组 {chat_id} 的数据库中删除了FAQ (ID: {faq_id_to_delete})")
+    if delete_faq_by_id(chat_id, faq_id_to_delete):
         return deleted_question_text
     else:
         # 这种情况很少发生，但作为保障
         logger.error(f"尝试从数据库删除FAQ (ID: {faq_id_to_delete}) 失败")
         return None
 
+def delete_faq_by_id(chat_id: int, faq_id: int) -> bool:
+    """
+    根据数据库主键 ID 删除指定群组的一条FAQ。
+    """
+    if not db.db_delete_faq(faq_id):
+        return False
+    _invalidate_index(chat_id)
+    logger.info(f"从群组 {chat_id} 的数据库中删除了FAQ (ID: {faq_id})")
+    return True
+
 def get_faqs_for_chat(chat_id: int) -> List[Dict]:
     """
     从数据库获取指定群组的所有FAQ列表。
@@ -87,29 +241,27 @@ def find_similar_question(chat_id: int, new_question: str) -> Optional[str]:
     在指定群组的FAQ库中查找与新问题最相似的问题。
     如果找到相似度超过阈值的问题，则返回其答案。
     """
-    # 核心逻辑不变，只是数据源变了
-    all_faqs = get_faqs_for_chat(chat_id)
-    
-    if not all_faqs:
+    # 简单优化：如果消息过短，则不进行匹配
+    if len(new_question) < 1:
+        return None
+
+    index = _get_index(chat_id)
+    if not index.questions:
         return None
 
     best_match_answer = None
     highest_similarity = 0.0
 
-    # 简单优化：如果消息过短，则不进行匹配
-    if len(new_question) < 1:
-        return None
-        
     # 将新问题转换为小写以进行不区分大小写的比较
     lower_new_question = new_question.lower()
 
-    for item in all_faqs:
-        # 使用SequenceMatcher计算两个字符串的相似度
-        similarity = SequenceMatcher(None, lower_new_question, item['question'].lower()).ratio()
+    # 只对索引筛选出的少数候选计算 SequenceMatcher 相似度
+    for idx in index.candidates(new_question, FAQ_RERANK_TOP_K):
+        similarity = SequenceMatcher(None, lower_new_question, index.questions[idx]).ratio()
         
         if similarity > highest_similarity:
             highest_similarity = similarity
-            best_match_answer = item['answer']
+            best_match_answer = index.answers[idx]
 
     if highest_similarity >= SIMILARITY_THRESHOLD:
         logger.info(f"为问题 '{new_question[:30]}...' 找到了相似度为 {highest_similarity:.2f} 的匹配。")
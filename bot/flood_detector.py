@@ -0,0 +1,130 @@
+# bot/flood_detector.py
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Optional, Tuple
+
+from cachetools import TLRUCache, TTLCache
+
+from . import user_manager
+from .async_db import adb
+from .config import (
+    FLOOD_MAX_MESSAGES, FLOOD_WINDOW_SECONDS, FLOOD_TRACKER_MAX_ENTRIES, FLOOD_TRACKER_IDLE_SECONDS,
+    SETTINGS_CACHE_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Window:
+    """固定容量的环形缓冲区，保存最近 N 条消息的时间戳 (float 数组，每条 8 字节)。"""
+
+    __slots__ = ('times', 'pos')
+
+    def __init__(self, size: int):
+        self.times = array('d', bytes(8 * size))
+        self.pos = 0
+
+    def record(self, now: float, window_seconds: float) -> bool:
+        """记录一条消息，返回最近 N 条是否都落在窗口内。"""
+        self.times[self.pos] = now
+        self.pos = (self.pos + 1) % len(self.times)
+        # 写入后下一个槽位就是最近 N 条中最早的一条，为 0 说明还不满 N 条
+        oldest = self.times[self.pos]
+        return oldest > 0 and now - oldest < window_seconds
+
+    def reset(self):
+        for i in range(len(self.times)):
+            self.times[i] = 0.0
+
+
+class FloodDetector:
+    """
+    按 (群组, 用户) 统计的刷屏检测器：窗口内发送超过阈值条数即判定为刷屏。
+
+    - 每个 (群组, 用户) 一个环形时间戳缓冲区，超过 FLOOD_TRACKER_IDLE_SECONDS 未发言自动淘汰，
+      总数不超过 FLOOD_TRACKER_MAX_ENTRIES，内存占用有界。
+    - 阈值可按群组设置 (group_settings 表)，检测器内缓存一份，私聊使用全局默认值。
+    - 同时负责记录“已提示过禁言”的 (群组, 用户, 解封时间)，记录在解封时间到达时过期，不论禁言多长。
+
+    只在事件循环线程中使用，但统计接口可能在其他线程读取，因此用锁保护。
+    """
+
+    def __init__(self, max_entries: int = FLOOD_TRACKER_MAX_ENTRIES, idle_seconds: int = FLOOD_TRACKER_IDLE_SECONDS):
+        self._lock = threading.Lock()
+        # 时间戳缓冲区超过 idle_seconds 未更新就会被淘汰，窗口再长也等不到判定，因此窗口长度以此为上限
+        self.max_window_seconds = max(idle_seconds, FLOOD_WINDOW_SECONDS)
+        self._windows: TTLCache = TTLCache(maxsize=max_entries, ttl=self.max_window_seconds)
+        self._thresholds: TTLCache = TTLCache(maxsize=10000, ttl=SETTINGS_CACHE_TTL_SECONDS)
+        # 值为解封时间的时间戳，禁言结束时记录随之过期
+        self._notified: TLRUCache = TLRUCache(maxsize=max_entries, ttu=lambda key, until, now: until, timer=time.time)
+        self.total_checked = 0
+        self.total_flagged = 0
+
+    async def get_thresholds(self, chat_id: int, is_group: bool) -> Tuple[int, float]:
+        if not is_group:
+            return FLOOD_MAX_MESSAGES, FLOOD_WINDOW_SECONDS
+        thresholds = self._thresholds.get(chat_id)
+        if thresholds is None:
+            max_messages, window_seconds = await user_manager.get_setting(user_manager.get_flood_thresholds, chat_id)
+            thresholds = (max_messages, min(window_seconds, self.max_window_seconds))
+            self._thresholds[chat_id] = thresholds
+        return thresholds
+
+    def invalidate_thresholds(self, chat_id: int):
+        self._thresholds.pop(chat_id, None)
+
+    async def check(self, chat_id: int, user_id: int, is_group: bool, now: Optional[float] = None) -> bool:
+        """记录一条消息，返回该用户在该群组中是否正在刷屏。判定为刷屏后窗口清空，重新计数。"""
+        max_messages, window_seconds = await self.get_thresholds(chat_id, is_group)
+        if max_messages <= 0:
+            return False
+        now = time.monotonic() if now is None else now
+        key = (chat_id, user_id)
+        with self._lock:
+            self.total_checked += 1
+            window = self._windows.get(key)
+            if window is None or len(window.times) != max_messages:
+                window = _Window(max_messages)
+            # 重新赋值以刷新过期时间
+            self._windows[key] = window
+            flooding = window.record(now, window_seconds)
+            if flooding:
+                window.reset()
+                self.total_flagged += 1
+        return flooding
+
+    def should_notify(self, chat_id: int, user_id: int, expiration) -> bool:
+        """同一次禁言在同一群组只提示一次。"""
+        key = (chat_id, user_id, expiration)
+        with self._lock:
+            if key in self._notified:
+                return False
+            self._notified[key] = expiration.timestamp()
+        return True
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._windows.expire()
+            windows = list(self._windows.values())
+            tracked = len(windows)
+            self._notified.expire()
+            notified = len(self._notified)
+        memory_bytes = sum(sys.getsizeof(w) + sys.getsizeof(w.times) for w in windows)
+        # 每个缓存条目还有键元组和字典槽位的开销，按 (群组, 用户) 二元组估算
+        memory_bytes += tracked * (sys.getsizeof((0, 0)) + 100)
+        return {
+            'tracked': tracked,
+            'notified': notified,
+            'checked': self.total_checked,
+            'flagged': self.total_flagged,
+            'memory_bytes': memory_bytes,
+        }
+
+
+# 全局唯一的刷屏检测器
+flood_detector = FloodDetector()
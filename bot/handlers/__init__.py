@@ -3,7 +3,8 @@
 # 【第一部分】从各个子模块中导入所有需要被外部（如 main.py）使用的函数
 from .admin import (
     ban_command, unban_command, auto_chat_on_command, auto_chat_off_command,
-    add_reply_command, del_reply_command, language_command
+    add_reply_command, del_reply_command, language_command, perfstats_command,
+    backfill_stats_command, reload_keywords_command, setflood_command
 )
 from .callbacks import (
     main_menu_callback, settings_menu_callback, set_language_callback, 
@@ -37,14 +38,15 @@ from .helpers import (
 )
 from .messages import (
     chat_handler, photo_handler, sticker_handler, spam_check_handler, 
-    message_filter_handler, my_chat_member_handler, error_handler
+    message_filter_handler, my_chat_member_handler, chat_member_handler, error_handler
 )
 
 # 【第二部分】定义 __all__ 列表，这是给 main.py 使用的
 __all__ = [
     # from admin
     'ban_command', 'unban_command', 'auto_chat_on_command', 'auto_chat_off_command',
-    'add_reply_command', 'del_reply_command', 'language_command',
+    'add_reply_command', 'del_reply_command', 'language_command', 'perfstats_command',
+    'backfill_stats_command', 'reload_keywords_command', 'setflood_command',
     # from callbacks
     'main_menu_callback', 'settings_menu_callback', 'set_language_callback',
     'set_group_language_callback', 'search_page_callback', 'handle_category_menu_button',
@@ -74,5 +76,5 @@ __all__ = [
     'send_or_reply_with_or_without_buttons',
     # from messages
     'chat_handler', 'photo_handler', 'sticker_handler', 'spam_check_handler',
-    'message_filter_handler', 'my_chat_member_handler', 'error_handler',
+    'message_filter_handler', 'my_chat_member_handler', 'chat_member_handler', 'error_handler',
 ]
\ No newline at end of file
@@ -1,6 +1,8 @@
 # bot/handlers/admin.py
 
+import asyncio
 import logging
+import time
 from datetime import datetime, timedelta, timezone # <--- 新增导入
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode, ChatType
@@ -9,11 +11,19 @@ from telegram.error import TelegramError
 from telegram import ChatPermissions
 
 from . import helpers
-# 【修改】不再导入 blacklist_manager，直接使用 statistics
-from .. import faq_manager, user_manager, statistics
+from .. import faq_manager, user_manager, statistics, ad_blocker
 from ..localization import get_text
 from ..config import DEVELOPER_IDS
-from ..statistics import get_user_id_by_username
+from ..async_db import adb
+from ..blacklist_manager import blacklist_index
+from ..key_manager import api_key_manager
+from ..ai_dispatcher import ai_dispatcher
+from ..ai_cache import ai_response_cache
+from ..flood_detector import flood_detector
+from ..admin_cache import admin_cache
+from ..message_ingest import ingest_queue
+from ..rank_service import rank_service
+from ..topic_engine import topic_engine
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +35,7 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         username_to_ban = context.args[0]
-        user_id_to_ban = get_user_id_by_username(username_to_ban) or int(username_to_ban)
+        user_id_to_ban = await adb.get_user_id_by_username(username_to_ban) or int(username_to_ban)
     except (IndexError, ValueError):
         await update.message.reply_text("用法: /ban <@username 或 user_id>")
         return
@@ -35,11 +45,112 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     duration_seconds = 86400
     expiration_time = datetime.now(timezone.utc) + timedelta(seconds=duration_seconds)
     # 调用数据库函数写入黑名单
-    statistics.db_add_to_blacklist(user_id_to_ban, expiration_time.isoformat())
+    blacklist_index.add(user_id_to_ban, expiration_time)
     # <--- 修改结束 --->
     
     await update.message.reply_text(f"用户 {user_id_to_ban} 已被封禁24小时。")
 
+async def perfstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """开发者命令：查看各缓存和队列的运行统计。"""
+    user = update.effective_user
+    if user.id not in DEVELOPER_IDS:
+        await update.message.reply_text("抱歉，此命令仅限开发者使用。")
+        return
+
+    settings_stats = user_manager.get_settings_cache_stats()
+    lookups = settings_stats['hits'] + settings_stats['misses']
+    hit_rate = settings_stats['hits'] / lookups * 100 if lookups else 0.0
+    faq_stats = faq_manager.get_prefilter_stats()
+    faq_rejected = faq_stats['rejected_no_faq'] + faq_stats['rejected_bounds']
+    faq_reject_rate = faq_rejected / faq_stats['checked'] * 100 if faq_stats['checked'] else 0.0
+    lines = [
+        "【设置缓存】",
+        f"命中: {settings_stats['hits']}  未命中: {settings_stats['misses']}  命中率: {hit_rate:.1f}%",
+        f"缓存条目: 用户 {settings_stats['user_entries']} / 群组 {settings_stats['group_entries']}",
+        "【消息写入队列】",
+        f"待写入: {ingest_queue.pending}  已写入: {ingest_queue.total_flushed}  已丢弃: {ingest_queue.total_dropped}",
+        "【排名服务】",
+        f"已加载排行榜: {rank_service.board_count}",
+        "【话题统计】",
+        f"已分词消息: {topic_engine.total_messages}  失败批次: {topic_engine.total_failures}",
+        "【FAQ 预筛选】",
+        f"检查: {faq_stats['checked']}  无FAQ跳过: {faq_stats['rejected_no_faq']}  上界跳过: {faq_stats['rejected_bounds']}  跳过率: {faq_reject_rate:.1f}%",
+    ]
+    ai_stats = ai_dispatcher.get_stats()
+    lines.extend([
+        "【AI 调度】",
+        f"执行中: {ai_stats['running']}  排队: {ai_stats['pending']} ({ai_stats['queued_chats']} 个聊天)",
+        f"提交: {ai_stats['submitted']}  完成: {ai_stats['completed']}  失败: {ai_stats['failed']}  "
+        f"被取代: {ai_stats['superseded']}  拒绝: {ai_stats['rejected']}  后台任务: {ai_stats['background']}",
+        f"等待: 平均 {ai_stats['avg_wait_seconds']:.2f}s / 最长 {ai_stats['max_wait_seconds']:.2f}s  "
+        f"执行: 平均 {ai_stats['avg_service_seconds']:.2f}s / 最长 {ai_stats['max_service_seconds']:.2f}s",
+    ])
+    lines.append("【AI 回复缓存】")
+    for tier, tier_stats in ai_response_cache.get_stats().items():
+        lines.append(
+            f"{tier}: 命中 {tier_stats['hits']}  未命中 {tier_stats['misses']}  写入 {tier_stats['stores']}  "
+            f"命中率 {tier_stats['hit_rate'] * 100:.1f}%"
+        )
+    flood_stats = flood_detector.get_stats()
+    lines.extend([
+        "【刷屏检测】",
+        f"跟踪中: {flood_stats['tracked']}  已提示: {flood_stats['notified']}  "
+        f"检查: {flood_stats['checked']}  判定刷屏: {flood_stats['flagged']}  "
+        f"内存: {flood_stats['memory_bytes'] / 1024:.1f} KB",
+    ])
+    admin_stats = admin_cache.get_stats()
+    lines.extend([
+        "【群管理员缓存】",
+        f"已缓存群组: {admin_stats['chats']}  命中: {admin_stats['hits']}  未命中: {admin_stats['misses']}  "
+        f"命中率: {admin_stats['hit_rate'] * 100:.1f}%",
+        f"后台刷新: {admin_stats['refreshes']}  获取失败: {admin_stats['failures']}  退避跳过: {admin_stats['backed_off']}  成员变更: {admin_stats['member_updates']}",
+    ])
+    lines.append("【AI 密钥池】")
+    for key_stats in api_key_manager.get_stats():
+        status = f"冷却 {key_stats['cooldown_seconds']:.0f}s" if key_stats['cooldown_seconds'] else "可用"
+        lines.append(
+            f"#{key_stats['index']} {status}  进行中: {key_stats['in_flight']}  "
+            f"请求: {key_stats['requests']}  成功: {key_stats['successes']}  失败: {key_stats['failures']}  "
+            f"耗尽: {key_stats['exhausted']}  token: {key_stats['tokens']}  "
+            f"剩余 RPM/TPM: {key_stats['rpm_available']}/{key_stats['tpm_available']}"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+async def backfill_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """开发者命令：根据历史消息重建每日活跃度汇总表和最近一个月的话题词频。"""
+    user = update.effective_user
+    if user.id not in DEVELOPER_IDS:
+        await update.message.reply_text("抱歉，此命令仅限开发者使用。")
+        return
+
+    await update.message.reply_text("正在根据历史消息重建活跃度汇总表，请稍候...")
+    start = time.perf_counter()
+    try:
+        # 在独立线程中重建，不占用处理消息所需的数据库线程
+        row_count = await asyncio.to_thread(rank_service.rebuild_from_messages)
+        topic_message_count = await asyncio.to_thread(topic_engine.rebuild_recent)
+    except Exception as e:
+        logger.error(f"重建活跃度汇总表时出错: {e}", exc_info=True)
+        await update.message.reply_text(f"重建失败: {e}")
+        return
+    elapsed = time.perf_counter() - start
+    await update.message.reply_text(
+        f"重建完成，共 {row_count} 行汇总数据，重新统计了 {topic_message_count} 条消息的话题，耗时 {elapsed:.1f} 秒。"
+    )
+
+async def reload_keywords_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """开发者命令：立即重新加载广告关键词文件。"""
+    user = update.effective_user
+    if user.id not in DEVELOPER_IDS:
+        await update.message.reply_text("抱歉，此命令仅限开发者使用。")
+        return
+
+    reloaded, keyword_count, build_seconds = await asyncio.to_thread(ad_blocker.reload_blocked_keywords, True)
+    if not reloaded:
+        await update.message.reply_text(f"重新加载失败 (详见日志)，继续使用已加载的 {keyword_count} 个广告关键词。")
+        return
+    await update.message.reply_text(f"已重新加载 {keyword_count} 个广告关键词，构建耗时 {build_seconds * 1000:.1f} ms。")
+
 # bot/handlers/admin.py
 
 # ... (文件顶部的其他 import 保持不变)
@@ -51,7 +162,7 @@ from telegram import ChatPermissions # <--- 确保导入了 ChatPermissions
 async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     user = update.effective_user
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     # 1. 权限检查：必须是群聊且使用者是管理员
     if chat.type == ChatType.PRIVATE:
@@ -76,7 +187,7 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 方式二：使用 @username 或 user_id
         elif context.args:
             user_identifier = context.args[0]
-            target_user_id = get_user_id_by_username(user_identifier) or int(user_identifier)
+            target_user_id = await adb.get_user_id_by_username(user_identifier) or int(user_identifier)
             target_user_name = user_identifier # 显示用作标识符的文本
         else:
             await update.message.reply_text("用法: /unban <@username 或 user_id>，或回复某人的消息使用 /unban。")
@@ -109,7 +220,7 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         # 第二重：从机器人内部黑名单移除
-        statistics.db_remove_from_blacklist(target_user_id)
+        blacklist_index.remove(target_user_id)
         
         await update.message.reply_text(f"用户 {helpers.escape_markdown_v2(str(target_user_name))} ({target_user_id}) 已在本群成功解除禁言。")
 
@@ -123,7 +234,7 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ... (文件其余部分无需改动)
 async def auto_chat_on_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text(get_text('group_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
@@ -131,12 +242,12 @@ async def auto_chat_on_command(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(get_text('admin_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
     
-    user_manager.set_auto_chat_mode(chat.id, True)
+    await adb.run(user_manager.set_auto_chat_mode, chat.id, True)
     await update.message.reply_text("✅ 自由对话模式已 **开启**。", parse_mode=ParseMode.MARKDOWN)
 
 async def auto_chat_off_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text(get_text('group_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
@@ -144,12 +255,59 @@ async def auto_chat_off_command(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text(get_text('admin_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
         
-    user_manager.set_auto_chat_mode(chat.id, False)
+    await adb.run(user_manager.set_auto_chat_mode, chat.id, False)
     await update.message.reply_text("❌ 自由对话模式已 **关闭**。", parse_mode=ParseMode.MARKDOWN)
 
+async def setflood_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """群管理员命令：/setflood <条数> <秒数> 设置刷屏阈值，/setflood off 关闭，/setflood reset 恢复默认，不带参数时查看当前设置。"""
+    chat = update.effective_chat
+    lang_code = await helpers.get_display_lang(update)
+    if chat.type == ChatType.PRIVATE:
+        await update.message.reply_text(get_text('group_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+    if not await helpers._is_admin(update, context):
+        await update.message.reply_text(get_text('admin_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    args = context.args or []
+    if not args:
+        max_messages, window_seconds = await user_manager.get_setting(user_manager.get_flood_thresholds, chat.id)
+        if max_messages <= 0:
+            await update.message.reply_text(
+                "本群的刷屏检测当前已关闭。\n"
+                f"用法: /setflood <条数> <秒数> | off | reset (秒数不超过 {flood_detector.max_window_seconds:g})"
+            )
+        else:
+            await update.message.reply_text(
+                f"本群当前的刷屏阈值: {window_seconds:g} 秒内最多 {max_messages} 条消息。\n"
+                f"用法: /setflood <条数> <秒数> | off | reset (秒数不超过 {flood_detector.max_window_seconds:g})"
+            )
+        return
+
+    if args[0].lower() == 'off':
+        max_messages, window_seconds, reply = 0, None, "❌ 本群的刷屏检测已关闭。"
+    elif args[0].lower() == 'reset':
+        max_messages, window_seconds, reply = None, None, "✅ 本群的刷屏阈值已恢复为默认值。"
+    else:
+        try:
+            max_messages = int(args[0])
+            window_seconds = float(args[1])
+        except (IndexError, ValueError):
+            await update.message.reply_text("用法: /setflood <条数> <秒数> | off | reset\n例如: /setflood 5 10")
+            return
+        max_window_seconds = flood_detector.max_window_seconds
+        if not (2 <= max_messages <= 100 and 0 < window_seconds <= max_window_seconds):
+            await update.message.reply_text(f"条数需在 2 到 100 之间，秒数需在 0 到 {max_window_seconds:g} 之间。")
+            return
+        reply = f"✅ 刷屏阈值已更新: {window_seconds:g} 秒内最多 {max_messages} 条消息。"
+
+    await adb.run(user_manager.set_flood_thresholds, chat.id, max_messages, window_seconds)
+    flood_detector.invalidate_thresholds(chat.id)
+    await update.message.reply_text(reply)
+
 async def add_reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text(get_text('group_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
@@ -171,14 +329,14 @@ async def add_reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(get_text('reply_add_usage', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
 
-    if faq_manager.add_faq(chat.id, question, answer):
+    if await adb.run(faq_manager.add_faq, chat.id, question, answer):
         await update.message.reply_text(get_text('reply_add_success', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
     else:
         await update.message.reply_text(get_text('reply_add_exists', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
 
 async def del_reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text(get_text('group_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
@@ -195,7 +353,7 @@ async def del_reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(get_text('reply_del_usage', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
     
-    deleted_question = faq_manager.delete_faq(chat.id, index_to_delete)
+    deleted_question = await adb.run(faq_manager.delete_faq, chat.id, index_to_delete)
     
     if deleted_question:
         text = get_text('reply_del_success', lang_code, index=index_to_delete + 1, question=helpers.escape_markdown_v2(deleted_question[:20]))
@@ -206,7 +364,7 @@ async def del_reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
 async def language_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text(
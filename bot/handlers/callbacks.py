@@ -7,10 +7,12 @@ from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import TelegramError
 
 # 【修改】从 .. (bot/) 导入外部模块
-from .. import memory, user_manager, chart_generator, ai_helper, statistics, faq_manager
+from .. import memory, user_manager, chart_generator, ai_helper, statistics, faq_manager, topic_engine
 # 【修改】从 . (handlers/) 导入内部模块
 from . import helpers 
 from ..localization import get_text
+from ..async_db import adb
+from ..rank_service import rank_service
 from ..statistics import (
     get_top_users_by_period, get_top_topics_by_period, get_global_top_users_by_period,
     get_global_top_topics_by_period, get_global_top_groups_by_period
@@ -42,10 +44,10 @@ async def _send_single_group_stats_pm(user: User, chat_id: int, chat_title: str,
             (rank_week, count_week),
             (rank_month, count_month),
         ) = await asyncio.gather(
-            asyncio.to_thread(statistics.get_user_stats_in_chat, user.id, chat_id),
-            asyncio.to_thread(statistics.get_user_rank_in_chat, user.id, chat_id, 'today'),
-            asyncio.to_thread(statistics.get_user_rank_in_chat, user.id, chat_id, 'week'),
-            asyncio.to_thread(statistics.get_user_rank_in_chat, user.id, chat_id, 'month'),
+            adb.get_user_stats_in_chat(user.id, chat_id),
+            adb.run(rank_service.get_user_rank_in_chat, user.id, chat_id, 'today'),
+            adb.run(rank_service.get_user_rank_in_chat, user.id, chat_id, 'week'),
+            adb.run(rank_service.get_user_rank_in_chat, user.id, chat_id, 'month'),
         )
         # --- 【修正结束】 ---
     except Exception as e:
@@ -91,13 +93,13 @@ async def generate_ranking_text(scope: str, rank_type: str, period: str, chat_id
     # --- 【核心修正】在所有 get_text 之后，但在 format 之前，对动态内容进行转义 ---
     if rank_type == 'users':
         title = get_text('rank_header_users', lang_code).format(scope=scope_str, period=period_str)
-        data = await asyncio.to_thread(get_top_users_by_period, chat_id, period) if scope == 'local' else await asyncio.to_thread(get_global_top_users_by_period, period)
+        data = await adb.run(get_top_users_by_period, chat_id, period) if scope == 'local' else await adb.run(get_global_top_users_by_period, period)
     elif rank_type == 'topics':
         title = get_text('rank_header_topics', lang_code).format(scope=scope_str, period=period_str)
-        data = await asyncio.to_thread(get_top_topics_by_period, chat_id, period) if scope == 'local' else await asyncio.to_thread(get_global_top_topics_by_period, period)
+        data = await adb.run(get_top_topics_by_period, chat_id, period) if scope == 'local' else await adb.run(get_global_top_topics_by_period, period)
     elif rank_type == 'groups':
         title = get_text('rank_header_groups', lang_code).format(period=period_str)
-        data = await asyncio.to_thread(get_global_top_groups_by_period, period)
+        data = await adb.run(get_global_top_groups_by_period, period)
 
     text_parts = [title]
     if not data:
@@ -130,6 +132,10 @@ async def generate_ranking_text(scope: str, rank_type: str, period: str, chat_id
                 escaped_topic = escape_markdown_v2(topic[:30])
                 text_parts.append(get_text('rank_line_item_topic', lang_code, rank_icon=rank_icon, topic=escaped_topic, count=count))
 
+    if rank_type == 'topics' and not topic_engine.is_ready():
+        # 分词词典仍在加载中：照常展示已统计的结果，并提示最新消息稍后计入
+        text_parts.append(get_text('topics_warming_up', lang_code))
+
     return "\n".join(text_parts)
 
 async def _send_group_admin_menu(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
@@ -138,7 +144,7 @@ async def _send_group_admin_menu(query: CallbackQuery, context: ContextTypes.DEF
     发送单个群组的管理面板。
     “返回”按钮的回调数据被修正为 'menu_action_admin_groups'，以便能返回到群组选择列表。
     """
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     try:
         chat = await context.bot.get_chat(chat_id)
         group_name = escape_markdown_v2(chat.title)
@@ -146,8 +152,8 @@ async def _send_group_admin_menu(query: CallbackQuery, context: ContextTypes.DEF
         group_name = "Unknown Group"
 
     text = get_text('admin_group_panel_title', lang_code, group_name=group_name)
-    autochat_status_icon = "✅" if user_manager.is_auto_chat_on(chat_id) else "❌"
-    spam_filter_status_icon = "✅" if user_manager.is_spam_filter_on(chat_id) else "❌"
+    autochat_status_icon = "✅" if await user_manager.get_setting(user_manager.is_auto_chat_on, chat_id) else "❌"
+    spam_filter_status_icon = "✅" if await user_manager.get_setting(user_manager.is_spam_filter_on, chat_id) else "❌"
 
     # --- 【核心修改】重构键盘布局为 2*2 + 1 + 1 ---
     keyboard = [
@@ -198,7 +204,7 @@ async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     action = query.data.replace('menu_action_', '')
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     
     if action == 'back':
         await send_main_menu(update, context)
@@ -209,7 +215,7 @@ async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # <--- 修改开始：优化获取群组列表的逻辑 --->
         # 不再获取所有群组，而是只获取用户发言过的群组
-        potential_groups = await asyncio.to_thread(statistics.db_get_groups_for_user, user.id)
+        potential_groups = await adb.db_get_groups_for_user(user.id)
         # <--- 修改结束 --->
 
         text = get_text('admin_groups_menu_title', lang_code)
@@ -283,11 +289,11 @@ async def settings_menu_callback(update: Update, context: ContextTypes.DEFAULT_T
     if action != 'settings_main':
         await query.answer()
 
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
 
     # 处理切换排名的逻辑
     if action == 'settings_toggle_ranking':
-        new_status = user_manager.toggle_user_ranking_participation(user.id)
+        new_status = await adb.run(user_manager.toggle_user_ranking_participation, user.id)
         status_text = get_text('settings_ranking_status_on', lang_code) if new_status else get_text('settings_ranking_status_off', lang_code)
         await query.answer(text=status_text, show_alert=False)
         # 更新后，重新显示主设置菜单
@@ -296,7 +302,7 @@ async def settings_menu_callback(update: Update, context: ContextTypes.DEFAULT_T
     # 显示主设置菜单
     if action == 'settings_main':
         text = get_text('settings_menu_title', lang_code)
-        is_ranking_enabled = user_manager.is_user_ranking_enabled(user.id)
+        is_ranking_enabled = await user_manager.get_setting(user_manager.is_user_ranking_enabled, user.id)
         ranking_button_text = get_text('settings_button_ranking_on', lang_code) if is_ranking_enabled else get_text('settings_button_ranking_off', lang_code)
         
         # 【最终版本】这里不再有“我的群组管理”按钮
@@ -330,7 +336,7 @@ async def set_language_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     new_lang_code = query.data.split('_')[-1]
     await query.answer(get_text('language_switched', new_lang_code))
-    user_manager.set_user_language(query.from_user.id, new_lang_code)
+    await adb.run(user_manager.set_user_language, query.from_user.id, new_lang_code)
     menu_title = get_text('language_menu_title_settings', new_lang_code)
     keyboard = [
         [InlineKeyboardButton("English", callback_data="set_lang_en"),
@@ -344,10 +350,10 @@ async def set_language_callback(update: Update, context: ContextTypes.DEFAULT_TY
 async def set_group_language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if not await _is_admin(query, context):
-        await query.answer(get_text('admin_only_alert', get_display_lang(query)), show_alert=True)
+        await query.answer(get_text('admin_only_alert', await get_display_lang(query)), show_alert=True)
         return
     new_lang = query.data.split('_')[-1]
-    user_manager.set_group_language(query.message.chat.id, new_lang)
+    await adb.run(user_manager.set_group_language, query.message.chat.id, new_lang)
     lang_name_map = {'en': 'English', 'zh': '简体中文'}
     success_text = get_text('language_set_success', new_lang, lang_name=lang_name_map.get(new_lang, new_lang))
     await send_or_reply_with_or_without_buttons(query, success_text, context)
@@ -366,7 +372,7 @@ async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     except (ValueError, IndexError):
         await send_or_reply_with_or_without_buttons(query, "无效的分页请求。", context)
         return
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     original_query_text = memory.get_search_query(search_id)
     items = context.bot_data.get(search_id)
     if not original_query_text or not items:
@@ -443,7 +449,7 @@ async def mystats_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
     from .commands import mystats_command
     query = update.callback_query
     user = query.from_user
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     action = query.data.split('_', 1)[1]
 
     if action == 'back_to_main':
@@ -454,14 +460,14 @@ async def mystats_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     if action == 'global':
         try:
-            global_rank, global_count = await asyncio.to_thread(statistics.get_user_global_stats, user.id)
+            global_rank, global_count = await adb.run(rank_service.get_user_global_stats, user.id)
         except Exception as e:
             logger.error(f"获取用户 {user.id} 的全服数据时出错: {e}", exc_info=True)
             await send_or_reply_with_or_without_buttons(query, get_text('internal_error', lang_code), context)
             return
         
         text_parts = [get_text('mystats_title_global', lang_code)]
-        is_ranking_enabled = user_manager.is_user_ranking_enabled(user.id)
+        is_ranking_enabled = await user_manager.get_setting(user_manager.is_user_ranking_enabled, user.id)
         if is_ranking_enabled:
             if global_rank > 0:
                  rank_text = get_text('mystats_global_rank', lang_code, rank=global_rank, count=global_count)
@@ -478,7 +484,7 @@ async def mystats_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
         )
         
     elif action == 'select_group':
-        user_groups = await asyncio.to_thread(statistics.db_get_groups_for_user, user.id)
+        user_groups = await adb.db_get_groups_for_user(user.id)
         if not user_groups:
             keyboard = [[InlineKeyboardButton(get_text('button_back', lang_code), callback_data='mystats_back_to_main')]]
             await send_or_reply_with_or_without_buttons(
@@ -503,7 +509,7 @@ async def mystats_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
 async def mystats_group_selection_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user = query.from_user
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     
     try:
         chat_id = int(query.data.split('_')[-1])
@@ -536,21 +542,19 @@ async def mystats_group_selection_callback(update: Update, context: ContextTypes
 async def mystats_all_groups_rank_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user = query.from_user
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     await query.answer()
 
     # 这个函数调用的是 statistics.db_get_user_activity_across_groups
     # 我需要确认这个函数是否存在
     # 是的，它在之前的步骤中被添加了。
 
-    user_groups_activity = await asyncio.to_thread(
-        statistics.db_get_user_activity_across_groups, user.id
-    )
+    user_groups_activity = await adb.db_get_user_activity_across_groups(user.id)
 
     text_parts = [get_text('mystats_title_all_groups_rank', lang_code)]
     
     if not user_groups_activity:
-        bot_username = (await context.bot.get_me()).username
+        bot_username = helpers.get_bot_username(context)
         add_to_group_url = f"https://t.me/{bot_username}?startgroup=true"
         text_parts.append(f"\n_{get_text('mystats_no_shared_groups_rank', lang_code)}_")
         keyboard = [
@@ -591,7 +595,7 @@ async def mystats_all_groups_rank_callback(update: Update, context: ContextTypes
 
 async def handle_category_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     
     menu_type = query.data
     chat_type = query.message.chat.type
@@ -670,7 +674,7 @@ async def handle_category_menu_button(update: Update, context: ContextTypes.DEFA
 
 async def handle_statistics_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     chat_id = query.message.chat.id
     chat_type = query.message.chat.type
 
@@ -707,7 +711,7 @@ async def handle_statistics_button(update: Update, context: ContextTypes.DEFAULT
 async def handle_activity_chart_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     keyboard = [
         [InlineKeyboardButton(get_text('chart_button_7_days', lang_code), callback_data='chart_generate_7'),
          InlineKeyboardButton(get_text('chart_button_30_days', lang_code), callback_data='chart_generate_30')],
@@ -722,7 +726,7 @@ async def handle_activity_chart_button(update: Update, context: ContextTypes.DEF
 async def handle_activity_chart_generate_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     chat_id = query.message.chat.id
     placeholder_text = get_text('chart_generating', lang_code)
     await send_or_reply_with_or_without_buttons(query, placeholder_text, context)
@@ -771,7 +775,7 @@ async def group_admin_action_callback(update: Update, context: ContextTypes.DEFA
         logger.warning(f"无法从回调数据 {query.data} 中解析 action 或 chat_id")
         return
 
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
 
     # --- 分支一：显示语言设置菜单 ---
     if action == 'lang':
@@ -789,8 +793,8 @@ async def group_admin_action_callback(update: Update, context: ContextTypes.DEFA
 
     # --- 分支二：切换自由对话开关 ---
     elif action == 'autochat':
-        new_status = not user_manager.is_auto_chat_on(chat_id)
-        user_manager.set_auto_chat_mode(chat_id, new_status)
+        new_status = not await user_manager.get_setting(user_manager.is_auto_chat_on, chat_id)
+        await adb.run(user_manager.set_auto_chat_mode, chat_id, new_status)
         status_text = "已开启" if new_status else "已关闭"
         await query.answer(f"自由对话模式已 {status_text}", show_alert=False)
         await _send_group_admin_menu(query, context, chat_id)
@@ -798,8 +802,8 @@ async def group_admin_action_callback(update: Update, context: ContextTypes.DEFA
 
     # --- 分支三：切换垃圾拦截开关 ---
     elif action == 'spamfilter':
-        new_status = not user_manager.is_spam_filter_on(chat_id)
-        user_manager.set_spam_filter_mode(chat_id, new_status)
+        new_status = not await user_manager.get_setting(user_manager.is_spam_filter_on, chat_id)
+        await adb.run(user_manager.set_spam_filter_mode, chat_id, new_status)
         status_text = get_text('status_on' if new_status else 'status_off', lang_code)
         alert_text = get_text('spam_filter_status_alert', lang_code, status=status_text)
         await query.answer(alert_text, show_alert=False)
@@ -809,7 +813,7 @@ async def group_admin_action_callback(update: Update, context: ContextTypes.DEFA
     # --- 分支四：显示关键词回复管理菜单 ---
     elif action == 'replies':
         await query.answer()
-        faqs = faq_manager.get_faqs_for_chat(chat_id)
+        faqs = await adb.run(faq_manager.get_faqs_for_chat, chat_id)
         text_parts = [get_text('reply_list_title', lang_code)]
         if not faqs:
             text_parts.append(f"\n_{get_text('reply_list_empty', lang_code)}_")
@@ -845,7 +849,7 @@ async def remote_add_reply_start(update: Update, context: ContextTypes.DEFAULT_T
         chat_id = int(query.data.split('_')[-1])
         context.user_data['admin_reply_chat_id'] = chat_id
     except (ValueError, IndexError): return ConversationHandler.END
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     await send_or_reply_with_or_without_buttons(
         query, text=get_text('remote_add_reply_start', lang_code), context=context
     )
@@ -854,7 +858,7 @@ async def remote_add_reply_start(update: Update, context: ContextTypes.DEFAULT_T
 async def remote_add_reply_question_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     question = update.message.text
     context.user_data['admin_reply_question'] = question
-    lang_code = get_display_lang(update)
+    lang_code = await get_display_lang(update)
     # 这是一个普通的回复，不应该自动删除，所以保留原始发送方式
     await update.message.reply_text(text=get_text('remote_add_reply_ask_answer', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
     return ASK_REPLY_ANSWER
@@ -863,9 +867,9 @@ async def remote_add_reply_answer_received(update: Update, context: ContextTypes
     answer = update.message.text
     question = context.user_data.get('admin_reply_question')
     chat_id = context.user_data.get('admin_reply_chat_id')
-    lang_code = get_display_lang(update)
+    lang_code = await get_display_lang(update)
     if question and chat_id:
-        if faq_manager.add_faq(chat_id, question, answer):
+        if await adb.run(faq_manager.add_faq, chat_id, question, answer):
             await update.message.reply_text(get_text('remote_add_reply_success', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         else:
             await update.message.reply_text(get_text('reply_add_exists', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
@@ -874,7 +878,7 @@ async def remote_add_reply_answer_received(update: Update, context: ContextTypes
     return ConversationHandler.END
 
 async def remote_add_reply_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    lang_code = get_display_lang(update)
+    lang_code = await get_display_lang(update)
     await update.message.reply_text(get_text('remote_add_reply_cancel', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
     context.user_data.pop('admin_reply_question', None)
     context.user_data.pop('admin_reply_chat_id', None)
@@ -884,14 +888,14 @@ async def toggle_checkin_callback(update: Update, context: ContextTypes.DEFAULT_
     """处理开启/关闭群组签到功能的回调，并提供清晰的UI反馈。"""
     query = update.callback_query
     chat = query.message.chat
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
 
     if not await helpers._is_admin(query, context):
         await query.answer(get_text('admin_only_alert', lang_code), show_alert=True)
         return
     
     # 1. 切换数据库中的状态
-    new_status = user_manager.toggle_group_checkin(chat.id)
+    new_status = await adb.run(user_manager.toggle_group_checkin, chat.id)
     
     # 2. 根据新状态，准备新的消息文本和按钮文本
     base_welcome_text = get_text('group_welcome', lang_code)
@@ -934,13 +938,13 @@ async def remote_del_reply_menu_callback(update: Update, context: ContextTypes.D
     """显示一个带有删除按钮的FAQ列表，用于远程删除。"""
     query = update.callback_query
     await query.answer()
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     try:
         chat_id = int(query.data.split('_')[-1])
     except (ValueError, IndexError):
         return
 
-    faqs = faq_manager.get_faqs_for_chat(chat_id)
+    faqs = await adb.run(faq_manager.get_faqs_for_chat, chat_id)
     text = get_text('admin_del_reply_menu_title', lang_code)
     
     keyboard = []
@@ -963,7 +967,7 @@ async def remote_del_reply_menu_callback(update: Update, context: ContextTypes.D
 async def remote_del_reply_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理具体的FAQ删除动作。"""
     query = update.callback_query
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     try:
         _, _, _, faq_id_str, chat_id_str = query.data.split('_')
         faq_id = int(faq_id_str)
@@ -973,15 +977,13 @@ async def remote_del_reply_action_callback(update: Update, context: ContextTypes
         return
 
     # 从数据库删除，需要先获取内容以便提示用户
-    all_faqs = faq_manager.get_faqs_for_chat(chat_id)
+    all_faqs = await adb.run(faq_manager.get_faqs_for_chat, chat_id)
     faq_to_delete = next((faq for faq in all_faqs if faq['id'] == faq_id), None)
 
     if faq_to_delete:
         # 在数据库中删除该条目
-        # delete_faq 需要的是列表索引，但我们直接用ID删除更可靠
-        # 我们需要一个通过ID删除的函数，或者修改现有函数
-        # 让我们直接调用 db_delete_faq
-        if statistics.db_delete_faq(faq_id):
+        # delete_faq 需要的是列表索引，但我们直接用ID删除更可靠，同时会使该群的匹配索引失效
+        if await adb.run(faq_manager.delete_faq_by_id, chat_id, faq_id):
             alert_text = get_text('admin_del_reply_success_alert', lang_code, question=faq_to_delete['question'][:20])
             await query.answer(alert_text, show_alert=False)
             # 刷新删除菜单
@@ -994,7 +996,7 @@ async def remote_del_reply_action_callback(update: Update, context: ContextTypes
 async def remote_shop_management_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """显示商店管理菜单，列出当前商品并提供管理选项。"""
     query = update.callback_query
-    lang_code = get_display_lang(query)
+    lang_code = await get_display_lang(query)
     
     try:
         # 从回调数据中解析 chat_id
@@ -1008,7 +1010,7 @@ async def remote_shop_management_menu(update: Update, context: ContextTypes.DEFA
         return
 
     # 获取所有商店商品（当前为全局）
-    items = statistics.db_get_shop_items()
+    items = await adb.db_get_shop_items()
     
     # 构建消息文本
     text_parts = [get_text('admin_shop_menu_title', lang_code, group_name=group_name)]
@@ -1099,7 +1101,7 @@ async def remote_shop_add_stock(update: Update, context: ContextTypes.DEFAULT_TY
         desc = context.user_data['admin_shop_item_desc']
         cost = context.user_data['admin_shop_item_cost']
         
-        success = await asyncio.to_thread(statistics.db_add_shop_item, name, desc, cost, stock)
+        success = await adb.db_add_shop_item(name, desc, cost, stock)
         
         if success:
             await update.message.reply_text(f"✅ *添加成功！* 奖品“{escape_markdown_v2(name)}”已上架。", parse_mode=ParseMode.MARKDOWN_V2)
@@ -14,6 +14,7 @@ from telegram.error import TelegramError
 from . import helpers
 from .. import memory, ai_helper, faq_manager, user_manager, statistics
 from ..localization import get_text
+from ..async_db import adb
 
 
 logger = logging.getLogger(__name__)
@@ -22,7 +23,7 @@ logger = logging.getLogger(__name__)
 async def send_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     user_name = helpers.escape_markdown_v2(user.first_name)
     
     keyboard = [
@@ -67,11 +68,11 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat.type == ChatType.PRIVATE:
         await send_main_menu(update, context)
     else:
-        lang_code = helpers.get_display_lang(update)
+        lang_code = await helpers.get_display_lang(update)
         welcome_text = get_text('group_welcome', lang_code)
         
         # --- 【核心修改】使用新的、更清晰的按钮文本 ---
-        is_checkin_on = user_manager.is_group_checkin_on(chat.id)
+        is_checkin_on = await user_manager.get_setting(user_manager.is_group_checkin_on, chat.id)
         checkin_button_text = get_text('checkin_status_button_on', lang_code) if is_checkin_on else get_text('checkin_status_button_off', lang_code)
         # --- 【修改结束】 ---
 
@@ -96,12 +97,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type == ChatType.PRIVATE:
         await send_main_menu(update, context)
     else:
-        bot_username = (await context.bot.get_me()).username
+        bot_username = helpers.get_bot_username(context)
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("前往私聊", url=f"https://t.me/{bot_username}?start=menu")]
         ])
@@ -116,7 +117,7 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     back_button = InlineKeyboardButton(get_text('menu_button_back', lang_code), callback_data='menu_action_back')
     if update.effective_chat.type == ChatType.PRIVATE:
         await update.message.reply_text(get_text('help_text', lang_code), parse_mode=ParseMode.MARKDOWN_V2, reply_markup=InlineKeyboardMarkup([[back_button]]))
@@ -125,12 +126,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def new_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     memory.clear_chat_history(update.effective_chat.id)
     await update.message.reply_text(get_text('new_conversation', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     query = " ".join(context.args)
 
     if not query:
@@ -179,14 +180,14 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def privacy_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     privacy_policy_url = "https://telegra.ph/Stardust-Assistant-Privacy-Policy-08-15"
     text = get_text('privacy_policy_text', lang_code)
     keyboard = [[InlineKeyboardButton(get_text('privacy_button', lang_code), url=privacy_policy_url)]]
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True)
 
 async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     rules_url = "https://telegra.ph/Stardust-Assistant-Terms-of-Service-08-15"
     text = get_text('rules_text', lang_code)
     keyboard = [[InlineKeyboardButton(get_text('rules_button', lang_code), url=rules_url)]]
@@ -194,11 +195,11 @@ async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def listreply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text(get_text('group_only_command', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
-    faqs = faq_manager.get_faqs_for_chat(chat.id)
+    faqs = await adb.run(faq_manager.get_faqs_for_chat, chat.id)
     if not faqs:
         await update.message.reply_text(get_text('reply_list_empty', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
@@ -211,7 +212,7 @@ async def listreply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     user = update.effective_user
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type != ChatType.PRIVATE:
         await helpers.send_or_reply_with_or_without_buttons(
@@ -228,7 +229,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
     text = get_text('settings_menu_title', lang_code)
-    is_ranking_enabled = user_manager.is_user_ranking_enabled(user.id)
+    is_ranking_enabled = await user_manager.get_setting(user_manager.is_user_ranking_enabled, user.id)
     ranking_button_text = get_text('settings_button_ranking_on', lang_code) if is_ranking_enabled else get_text('settings_button_ranking_off', lang_code)
     keyboard = [
         [InlineKeyboardButton(get_text('settings_button_language', lang_code), callback_data='settings_language')],
@@ -240,7 +241,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.chat_data['last_menu_id'] = sent_message.message_id
     
 async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     chat = update.effective_chat
     
     if chat.type == ChatType.PRIVATE:
@@ -291,7 +292,7 @@ async def mystats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     chat = update.effective_chat
     user = update.effective_user
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
         await _send_single_group_stats_pm(user, chat.id, chat.title, context, lang_code)
@@ -329,21 +330,21 @@ async def mystats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def checkin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text("请在群组中进行签到哦！")
         return
 
     text_to_send = ""
-    if not user_manager.is_group_checkin_on(chat.id):
+    if not await user_manager.get_setting(user_manager.is_group_checkin_on, chat.id):
         text_to_send = "本群的签到功能尚未开启哦，请联系管理员开启。"
-    elif statistics.db_check_if_user_checked_in_today(user.id, chat.id):
+    elif await adb.db_check_if_user_checked_in_today(user.id, chat.id):
         text_to_send = get_text('points_checkin_already', lang_code)
     else:
-        statistics.db_record_checkin(user.id, chat.id)
+        await adb.db_record_checkin(user.id, chat.id)
         # 【修正】db_add_points 返回一个元组 (success, new_total)
-        _, new_total = statistics.db_add_points(user.id, chat.id, 10, cooldown_seconds=0) # 签到不应该有冷却
+        _, new_total = await adb.db_add_points(user.id, chat.id, 10, cooldown_seconds=0) # 签到不应该有冷却
         text_to_send = get_text('points_checkin_success', lang_code, points=10, total_points=new_total)
 
     try:
@@ -366,13 +367,13 @@ async def checkin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def points_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text("请在群组中查询您的积分。")
         return
 
-    current_points = statistics.db_get_user_points(user.id, chat.id)
+    current_points = await adb.db_get_user_points(user.id, chat.id)
     text_to_send = get_text('points_current_balance', lang_code, points=current_points)
     
     try:
@@ -393,15 +394,15 @@ async def points_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
 
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text("请在群组中使用商店功能。")
         return
 
-    user_points = statistics.db_get_user_points(user.id, chat.id)
+    user_points = await adb.db_get_user_points(user.id, chat.id)
     
-    items = statistics.db_get_shop_items()
+    items = await adb.db_get_shop_items()
     text_parts = [get_text('shop_menu_title', lang_code, points=user_points)]
     if not items:
         text_parts.append(get_text('shop_list_empty', lang_code))
@@ -426,7 +427,7 @@ async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def redeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     
     if chat.type == ChatType.PRIVATE:
         await update.message.reply_text("请在群组中兑换奖品。")
@@ -438,12 +439,12 @@ async def redeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(get_text('redeem_usage', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
         return
         
-    item = statistics.db_get_shop_item_by_id(item_id)
+    item = await adb.db_get_shop_item_by_id(item_id)
     if not item:
         await update.message.reply_text(get_text('redeem_item_not_found', lang_code, item_id=item_id), parse_mode=ParseMode.MARKDOWN_V2)
         return
 
-    user_points = statistics.db_get_user_points(user.id, chat.id)
+    user_points = await adb.db_get_user_points(user.id, chat.id)
     if user_points < item['cost']:
         await update.message.reply_text(get_text('redeem_not_enough_points', lang_code, item_name=helpers.escape_markdown_v2(item['name']), cost=item['cost'], user_points=user_points), parse_mode=ParseMode.MARKDOWN_V2)
         return
@@ -452,7 +453,7 @@ async def redeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(get_text('redeem_out_of_stock', lang_code, item_name=helpers.escape_markdown_v2(item['name'])), parse_mode=ParseMode.MARKDOWN_V2)
         return
         
-    if statistics.db_redeem_item(user.id, chat.id, item):
+    if await adb.db_redeem_item(user.id, chat.id, item):
         await update.message.reply_text(get_text('redeem_success', lang_code, item_name=helpers.escape_markdown_v2(item['name'])), parse_mode=ParseMode.MARKDOWN_V2)
     else:
         await update.message.reply_text(get_text('redeem_error', lang_code), parse_mode=ParseMode.MARKDOWN_V2)
\ No newline at end of file
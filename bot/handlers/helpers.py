@@ -14,6 +14,9 @@ from typing import Union, Optional
 from .. import user_manager, statistics
 from ..config import DEFAULT_LANGUAGE, SUPPORTED_LANGUAGES
 from ..localization import get_text
+from ..message_ingest import ingest_queue
+from ..async_db import adb
+from ..admin_cache import admin_cache
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +25,7 @@ SEARCH_RESULTS_PER_PAGE = 5
 
 # --- 基础辅助函数 ---
 
-def get_display_lang(update: Union[Update, CallbackQuery]) -> str:
+async def get_display_lang(update: Union[Update, CallbackQuery]) -> str:
     chat = None
     user = None
 
@@ -34,12 +37,12 @@ def get_display_lang(update: Union[Update, CallbackQuery]) -> str:
         user = update.from_user
 
     if chat and chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        group_lang = user_manager.get_group_language(chat.id)
+        group_lang = await user_manager.get_setting(user_manager.get_group_language, chat.id)
         if group_lang:
             return group_lang
 
     if user:
-        user_lang = user_manager.get_user_language(user.id)
+        user_lang = await user_manager.get_setting(user_manager.get_user_language, user.id)
         if user_lang:
             return user_lang
 
@@ -55,6 +58,32 @@ def escape_markdown_v2(text: str) -> str:
     escape_chars = r'_*[]()~`>#+-=|{}.!'
     return "".join(f'\\{char}' if char in escape_chars else char for char in text)
 
+def strip_markdown_v2(text: str) -> str:
+    """移除所有可能的MarkdownV2格式化符号，用于解析失败时降级为纯文本。"""
+    return re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', '', text)
+
+def unescape_markdown_v2(text: str) -> str:
+    """去掉MarkdownV2的转义反斜杠，用于以纯文本展示尚未完整的AI回复。"""
+    return re.sub(r'\\([_*\[\]()~`>#+\-=|{}.!\\])', r'\1', text)
+
+async def refresh_bot_identity(application) -> None:
+    """调用一次 get_me()，把机器人的 id 和用户名缓存到 bot_data 中。启动时和定时任务中调用。"""
+    me = await application.bot.get_me()
+    application.bot_data['bot_id'] = me.id
+    application.bot_data['bot_username'] = me.username
+    logger.info(f"已缓存机器人身份: @{me.username} ({me.id})")
+
+async def refresh_bot_identity_job(context: ContextTypes.DEFAULT_TYPE):
+    """定时任务：刷新缓存的机器人身份 (用户名可能被修改)。失败时保留旧值。"""
+    try:
+        await refresh_bot_identity(context.application)
+    except TelegramError as e:
+        logger.warning(f"刷新机器人身份失败，继续使用缓存值: {e}")
+
+def get_bot_username(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """返回缓存的机器人用户名，不发起网络请求。缓存尚未建立时使用 Bot 初始化时获取的值。"""
+    return context.bot_data.get('bot_username') or context.bot.username
+
 def _format_time_delta(delta: timedelta) -> str:
     total_seconds = int(delta.total_seconds())
     minutes, seconds = divmod(total_seconds, 60)
@@ -93,23 +122,13 @@ async def _is_admin(update_or_query: Union[Update, CallbackQuery], context: Cont
         
     if not chat or not user: return False
     if chat.type == ChatType.PRIVATE: return True
-    
-    cache_key = f"is_admin_{chat.id}_{user.id}"
-    if context.chat_data.get(cache_key, False):
-        return True
-        
-    try:
-        admins = await context.bot.get_chat_administrators(chat.id)
-        if user.id in {admin.user.id for admin in admins}:
-            context.chat_data[cache_key] = True
-            return True
-    except TelegramError as e:
-        logger.warning(f"无法获取管理员列表: {e}")
-    return False
+
+    # 按群组缓存完整的管理员集合，命中时不访问 Telegram API
+    return await admin_cache.is_admin(context.bot, chat.id, user.id)
 
 async def handle_private_summary_back(update: Union[Update, CallbackQuery], context: ContextTypes.DEFAULT_TYPE, is_command: bool = False):
     target = update if is_command else update.callback_query
-    lang_code = get_display_lang(target)
+    lang_code = await get_display_lang(target)
     text = get_text('summary_private_intro', lang_code)
     keyboard = [[InlineKeyboardButton(get_text('button_global_user_rank', lang_code), callback_data='menu_rank_global_users')],
         [InlineKeyboardButton(get_text('button_global_topic_rank', lang_code), callback_data='menu_rank_global_topics')],
@@ -126,7 +145,8 @@ async def proactive_chat_recorder(update: Update, context: ContextTypes.DEFAULT_
     """一个前置处理器，用于主动记录机器人遇到的每一个群组信息。"""
     chat = update.effective_chat
     if chat and chat.title and str(chat.id).startswith('-100'):
-        statistics.update_known_chat(chat.id, chat.title)
+        # 标题未变化时不写库，变化时随下一批消息一起写入
+        ingest_queue.note_known_chat(chat.id, chat.title)
 
 # --- 【核心】统一的消息发送与自动删除模块 ---
 
@@ -157,6 +177,17 @@ async def delete_message_job(context: ContextTypes.DEFAULT_TYPE):
     
     # 【修复】移除了此处重复的代码块。
 
+async def edit_with_markdown_fallback(message: telegram.Message, text: str, reply_markup: InlineKeyboardMarkup = None):
+    """用MarkdownV2编辑消息，解析失败时与 send_or_reply_with_or_without_buttons 一样降级为纯文本。"""
+    try:
+        await message.edit_text(text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup, disable_web_page_preview=True)
+    except telegram.error.BadRequest as e:
+        if "Can't parse entities" in str(e):
+            logger.warning(f"MarkdownV2 解析失败: {e}. 将自动降级为纯文本模式重试。")
+            await message.edit_text(strip_markdown_v2(text), parse_mode=None, reply_markup=reply_markup, disable_web_page_preview=True)
+        elif "not modified" not in str(e).lower():
+            raise
+
 async def send_or_reply_with_or_without_buttons(
     update_or_query: Union[Update, CallbackQuery],
     text: str,
@@ -218,7 +249,7 @@ async def send_or_reply_with_or_without_buttons(
             logger.warning(f"MarkdownV2 解析失败: {e}. 将自动降级为纯文本模式重试。")
             try:
                 # 移除所有可能的MarkdownV2格式化符号
-                plain_text = re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', '', text)
+                plain_text = strip_markdown_v2(text)
                 if is_query:
                     sent_message = await update_or_query.edit_message_text(
                         text=plain_text, reply_markup=reply_markup, parse_mode=None,
@@ -4,7 +4,6 @@ import logging
 import re
 import asyncio
 from datetime import datetime, timezone, timedelta
-from collections import defaultdict, deque
 from telegram import Update, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton, ChatMember
 from telegram.constants import ChatAction, ChatType, ParseMode
 from telegram.ext import ContextTypes, ApplicationHandlerStop
@@ -13,6 +12,13 @@ from telegram.error import TelegramError
 from . import helpers
 from .. import ai_helper, memory, faq_manager, ad_blocker, statistics, user_manager
 from ..keyboards import get_copy_code_keyboard
+from ..message_ingest import ingest_queue
+from ..async_db import adb
+from ..blacklist_manager import blacklist_index
+from ..flood_detector import flood_detector
+from ..admin_cache import admin_cache
+from ..config import AI_STREAM_EDIT_INTERVAL_SECONDS
+from ..ai_dispatcher import ai_dispatcher, AiQueueFull, AiRequestSuperseded
 
 # --- 【核心修正】从 commands.py 导入所需的命令函数 ---
 from .commands import checkin_command, points_command, shop_command
@@ -20,11 +26,10 @@ from .commands import checkin_command, points_command, shop_command
 logger = logging.getLogger(__name__)
 
 # --- 防刷屏与黑名单 ---
-SPAM_MESSAGE_COUNT = 3
-SPAM_TIME_WINDOW_SECONDS = 3
 BLACKLIST_DURATION_SECONDS = 3600
-user_message_timestamps = defaultdict(lambda: deque(maxlen=SPAM_MESSAGE_COUNT))
-already_notified_users = set()
+
+# 后台摘要任务的引用，避免任务在完成前被垃圾回收
+_background_tasks: set = set()
 
 
 async def spam_check_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -34,86 +39,69 @@ async def spam_check_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = update.effective_user
     chat = update.effective_chat
     
-    blacklist_entry = statistics.db_get_blacklist_entry(user.id)
-    if blacklist_entry:
-        try:
-            expiration_time = datetime.fromisoformat(blacklist_entry['expiration_timestamp'])
-            now = datetime.now(timezone.utc)
-
-            if expiration_time > now:
-                remaining_time = expiration_time - now
-                time_str = helpers._format_time_delta(remaining_time)
-                notification_key = (chat.id, user.id)
-
-                if chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-                    if notification_key not in already_notified_users:
-                        await update.message.reply_text(f"用户 {helpers.escape_markdown_v2(user.full_name)} 已被禁言。剩余时间: *{time_str}*\\.", parse_mode=ParseMode.MARKDOWN_V2)
-                        already_notified_users.add(notification_key)
-                else:
-                    await update.message.reply_text(f"您当前已被禁言。剩余时间: *{time_str}*\\.", parse_mode=ParseMode.MARKDOWN_V2)
-                raise ApplicationHandlerStop
-            else:
-                statistics.db_remove_from_blacklist(user.id)
-                for key in list(already_notified_users):
-                    if key[1] == user.id:
-                        already_notified_users.remove(key)
+    # 内存索引查询，不访问数据库；已过期的条目会被顺便移除
+    expiration_time = blacklist_index.get_expiration(user.id)
+    if expiration_time:
+        remaining_time = expiration_time - datetime.now(timezone.utc)
+        time_str = helpers._format_time_delta(remaining_time)
 
-        except (ValueError, TypeError):
-            statistics.db_remove_from_blacklist(user.id)
+        if chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
+            # 按解封时间区分，用户被重新拉黑后会再提示一次
+            if flood_detector.should_notify(chat.id, user.id, expiration_time):
+                await update.message.reply_text(f"用户 {helpers.escape_markdown_v2(user.full_name)} 已被禁言。剩余时间: *{time_str}*\\.", parse_mode=ParseMode.MARKDOWN_V2)
+        else:
+            await update.message.reply_text(f"您当前已被禁言。剩余时间: *{time_str}*\\.", parse_mode=ParseMode.MARKDOWN_V2)
+        raise ApplicationHandlerStop
 
-    message_time = update.message.date
-    user_message_timestamps[user.id].append(message_time)
-    
-    if len(user_message_timestamps[user.id]) == SPAM_MESSAGE_COUNT:
-        time_diff = (message_time - user_message_timestamps[user.id][0]).total_seconds()
+    # 按 (群组, 用户) 滑动窗口检测刷屏，阈值可按群组设置
+    is_group = chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]
+    if await flood_detector.check(chat.id, user.id, is_group, now=update.message.date.timestamp()):
+        expiration_time = datetime.now(timezone.utc) + timedelta(seconds=BLACKLIST_DURATION_SECONDS)
+        blacklist_index.add(user.id, expiration_time)
         
-        if time_diff < SPAM_TIME_WINDOW_SECONDS:
-            expiration_time = datetime.now(timezone.utc) + timedelta(seconds=BLACKLIST_DURATION_SECONDS)
-            statistics.db_add_to_blacklist(user.id, expiration_time.isoformat())
-            
-            user_message_timestamps[user.id].clear()
-            
-            user_full_name_escaped = helpers.escape_markdown_v2(user.full_name)
-            user_mention = f"用户 *{user_full_name_escaped}* (@{helpers.escape_markdown_v2(user.username)})" if user.username else f"用户 *{user_full_name_escaped}*"
+        user_full_name_escaped = helpers.escape_markdown_v2(user.full_name)
+        user_mention = f"用户 *{user_full_name_escaped}* (@{helpers.escape_markdown_v2(user.username)})" if user.username else f"用户 *{user_full_name_escaped}*"
+        
+        if chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
+            try:
+                bot_member = await context.bot.get_chat_member(chat.id, context.bot.id)
+                if bot_member.can_restrict_members:
+                    mute_duration_tg = datetime.now() + timedelta(seconds=BLACKLIST_DURATION_SECONDS)
+                    await context.bot.restrict_chat_member(
+                        chat_id=chat.id,
+                        user_id=user.id,
+                        permissions=ChatPermissions(can_send_messages=False),
+                        until_date=mute_duration_tg
+                    )
+                    await update.message.reply_text(f"{user_mention} 因刷屏已被禁言1小时。", parse_mode=ParseMode.MARKDOWN_V2)
+                else:
+                    await update.message.reply_text(f"检测到来自 {user_mention} 的刷屏行为。请授予我管理员权限以执行禁言。", parse_mode=ParseMode.MARKDOWN_V2)
+            except Exception:
+                await update.message.reply_text(f"{user_mention} 因刷屏行为已被临时限制。", parse_mode=ParseMode.MARKDOWN_V2)
+        else:
+            await update.message.reply_text("您因刷屏已被禁言1小时。")
             
-            if chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-                try:
-                    bot_member = await context.bot.get_chat_member(chat.id, context.bot.id)
-                    if bot_member.can_restrict_members:
-                        mute_duration_tg = datetime.now() + timedelta(seconds=BLACKLIST_DURATION_SECONDS)
-                        await context.bot.restrict_chat_member(
-                            chat_id=chat.id,
-                            user_id=user.id,
-                            permissions=ChatPermissions(can_send_messages=False),
-                            until_date=mute_duration_tg
-                        )
-                        await update.message.reply_text(f"{user_mention} 因刷屏已被禁言1小时。", parse_mode=ParseMode.MARKDOWN_V2)
-                    else:
-                        await update.message.reply_text(f"检测到来自 {user_mention} 的刷屏行为。请授予我管理员权限以执行禁言。", parse_mode=ParseMode.MARKDOWN_V2)
-                except Exception:
-                    await update.message.reply_text(f"{user_mention} 因刷屏行为已被临时限制。", parse_mode=ParseMode.MARKDOWN_V2)
-            else:
-                await update.message.reply_text("您因刷屏已被禁言1小时。")
-                
-            raise ApplicationHandlerStop
+        raise ApplicationHandlerStop
 
 async def message_filter_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.effective_message
     chat = update.effective_chat
     user = update.effective_user
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     if not message or not message.text or chat.type not in [ChatType.GROUP, ChatType.SUPERGROUP]:
         return
-    if not user_manager.is_spam_filter_on(chat.id):
+    if not await user_manager.get_setting(user_manager.is_spam_filter_on, chat.id):
         return
     if await helpers._is_admin(update, context):
         return
-    is_ad = ad_blocker.is_spam(message.text) or re.search(r'https?://\S+', message.text)
+    matched_keyword = ad_blocker.find_spam_keyword(message.text)
+    is_ad = matched_keyword or re.search(r'https?://\S+', message.text)
     if is_ad:
         try:
             await message.delete()
-            logger.info(f"在群组 {chat.id} 中删除了来自用户 {user.id} 的潜在广告消息。")
-            warning_level = memory.record_and_get_warning_level(chat.id, user.id)
+            reason = f"关键词 '{matched_keyword}'" if matched_keyword else "链接"
+            logger.info(f"在群组 {chat.id} 中删除了来自用户 {user.id} 的潜在广告消息 (命中{reason})。")
+            warning_level = await adb.run(memory.record_and_get_warning_level, chat.id, user.id)
             user_name = helpers.escape_markdown_v2(user.first_name)
             if warning_level == 1:
                 warn_text = helpers.get_text('spam_warning_first', lang_code, user_name=user_name)
@@ -134,7 +122,7 @@ async def message_filter_handler(update: Update, context: ContextTypes.DEFAULT_T
                             permissions=ChatPermissions(can_send_messages=False),
                             until_date=mute_until
                         )
-                        statistics.db_add_to_blacklist(user.id, mute_until.isoformat())
+                        blacklist_index.add(user.id, mute_until)
                         await helpers.send_or_reply_with_or_without_buttons(update, warn_text, context)
                     else:
                         logger.warning(f"尝试禁言用户 {user.id} 失败，没有禁言权限。")
@@ -144,10 +132,21 @@ async def message_filter_handler(update: Update, context: ContextTypes.DEFAULT_T
             logger.warning(f"处理广告消息时出错 (可能没有删除权限): {e}")
         raise ApplicationHandlerStop
 
+async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """群成员身份变化 (提升/撤销管理员、退群等) 时同步更新管理员缓存。"""
+    member_update = update.chat_member
+    if not member_update:
+        return
+    new_member = member_update.new_chat_member
+    is_admin = new_member.status in [ChatMember.OWNER, ChatMember.ADMINISTRATOR]
+    admin_cache.apply_member_update(member_update.chat.id, new_member.user.id, is_admin)
+
 async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.my_chat_member:
         return
     chat = update.my_chat_member.chat
+    # 机器人自身的身份变化也会影响管理员列表，下次查询时重新加载
+    admin_cache.invalidate(chat.id)
     inviter = update.my_chat_member.from_user
     old_status = update.my_chat_member.old_chat_member.status
     new_status = update.my_chat_member.new_chat_member.status
@@ -157,14 +156,14 @@ async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_T
     )
     is_newly_added = new_status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR] and old_status in [ChatMember.LEFT, ChatMember.BANNED]
     if is_newly_added:
-        statistics.update_known_chat(chat.id, chat.title, added_by_user_id=inviter.id)
+        await adb.update_known_chat(chat.id, chat.title, added_by_user_id=inviter.id)
         logger.info(f"成功记录新群组 {chat.title}，由用户 {inviter.full_name} 添加。")
-        lang_code = helpers.get_display_lang(update)
+        lang_code = await helpers.get_display_lang(update)
         
         # --- 【核心修正】在所有 get_text 调用前添加 helpers. 前缀 ---
         welcome_text = helpers.get_text('group_welcome', lang_code)
         
-        is_checkin_on = user_manager.is_group_checkin_on(chat.id)
+        is_checkin_on = await user_manager.get_setting(user_manager.is_group_checkin_on, chat.id)
         checkin_button_text = helpers.get_text('checkin_status_button_on', lang_code) if is_checkin_on else helpers.get_text('checkin_status_button_off', lang_code)
         # --- 【修正结束】 ---
 
@@ -204,12 +203,12 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user = update.effective_user
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     original_user_message = message.text.strip()
     chat_id = chat.id
     user_message_id = message.message_id
 
-    statistics.save_message(
+    await ingest_queue.put(
         chat_id=chat_id, chat_title=chat.title if chat.type != ChatType.PRIVATE else "Private Chat",
         chat_username=chat.username, user_id=user.id if user else chat_id,
         user_name=user.full_name if user else chat.title,
@@ -260,17 +259,20 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # --- 发言获取积分逻辑 (最终版，1秒冷却) ---
     if len(original_user_message) > 5 and user and chat.type != ChatType.PRIVATE:
-        statistics.db_add_points(user.id, chat.id, 1, cooldown_seconds=1)
+        await adb.db_add_points(user.id, chat.id, 1, cooldown_seconds=1)
 
     # --- AI 对话 / FAQ 逻辑 ---
-    bot_username = (await context.bot.get_me()).username
+    bot_username = helpers.get_bot_username(context)
     is_private_chat = chat.type == ChatType.PRIVATE
     is_mention = f"@{bot_username}" in original_user_message
     is_reply_to_bot = message.reply_to_message and message.reply_to_message.from_user.id == context.bot.id
-    is_auto_mode = user_manager.is_auto_chat_on(chat_id)
+    is_auto_mode = await user_manager.get_setting(user_manager.is_auto_chat_on, chat_id)
 
     if not (is_private_chat or is_mention or is_reply_to_bot or is_auto_mode):
-        answer = faq_manager.find_similar_question(chat_id, original_user_message)
+        # 先用内存中的上界快速排除不可能命中的消息，避免访问数据库
+        if not faq_manager.should_try_match(chat_id, original_user_message):
+            return
+        answer = await adb.run(faq_manager.find_similar_question, chat_id, original_user_message)
         if answer:
             prefix = helpers.get_text('reply_auto_reply_prefix', lang_code)
             escaped_answer = helpers.escape_markdown_v2(answer)
@@ -283,41 +285,136 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
     prompt_text = original_user_message.replace(f"@{bot_username}", "").strip()
     if not prompt_text: return
-    history = memory.get_chat_history(chat_id)
-    history.append({"role": "user", "content": prompt_text, "timestamp": datetime.now(timezone.utc).isoformat()})
+    await memory.append_message(chat_id, "user", prompt_text)
     try:
         user_full_name = user.full_name if user else chat.title
-        ai_response = await asyncio.to_thread(
-            ai_helper.generate_ai_response,
-            chat_history=list(history), new_prompt=prompt_text,
-            user_name=user_full_name, lang_code=lang_code
+        # 自动聊天模式下被动触发的请求可以被同一聊天的新消息取代
+        ai_response, placeholder = await _stream_ai_reply(
+            message, context, coalesce=not (is_private_chat or is_mention or is_reply_to_bot),
+            chat_history=memory.get_prompt_history(chat_id), new_prompt=prompt_text,
+            user_name=user_full_name, lang_code=lang_code, chat_id=chat_id
         )
-        history.append({"role": "model", "content": ai_response, "timestamp": datetime.now(timezone.utc).isoformat()})
-
-        reply_markup = None
-        code_match = re.search(r"```(?:\w+\n)?(.*?)```", ai_response, re.DOTALL)
-        if code_match:
-            code_to_copy = code_match.group(1).strip()
-            if code_to_copy:
-                keyboard, code_id = get_copy_code_keyboard()
-                context.bot_data[code_id] = code_to_copy
-                reply_markup = keyboard
-
-        await message.reply_text(ai_response, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+        await memory.append_message(chat_id, "model", ai_response)
+        await _finish_ai_reply(placeholder, ai_response, context)
+        _schedule_history_compaction(chat_id, lang_code)
+    except AiRequestSuperseded:
+        logger.debug(f"群组 {chat_id} 中有更新的消息，跳过较早的自动聊天请求。")
+    except AiQueueFull:
+        logger.warning(f"AI 请求队列已满，拒绝了来自 {chat_id} 的请求。")
+        if is_private_chat or is_mention or is_reply_to_bot:
+            await message.reply_text(helpers.get_text('ai_busy', lang_code))
     except Exception as e:
         logger.error(f"chat_handler 调用AI时出错: {e}", exc_info=True)
         await message.reply_text(helpers.get_text('internal_error', lang_code))
 
+async def _stream_ai_reply(message, context: ContextTypes.DEFAULT_TYPE, coalesce: bool = False, **ai_kwargs):
+    """
+    通过 AI 调度器在专用线程中迭代 ai_helper.stream_ai_response，收到第一段内容时回复一条占位消息，
+    之后按 AI_STREAM_EDIT_INTERVAL_SECONDS 的节奏用已收到的文本编辑它。
+    返回 (完整回复, 占位消息)，最终编辑由 _finish_ai_reply 完成。
+    请求被拒绝或被同一聊天的新消息取代时抛出 AiQueueFull / AiRequestSuperseded。
+    """
+    lang_code = ai_kwargs['lang_code']
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def pump():
+        try:
+            for chunk in ai_helper.stream_ai_response(**ai_kwargs):
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        except Exception as e:
+            loop.call_soon_threadsafe(chunks.put_nowait, e)
+
+    async def produce():
+        try:
+            await ai_dispatcher.submit(message.chat_id, pump, coalesce=coalesce)
+        finally:
+            chunks.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    placeholder = None
+    parts = []
+    error = None
+    shown_text = ""
+    last_edit = loop.time()
+    while True:
+        item = await chunks.get()
+        if item is None:
+            break
+        if placeholder is None:
+            placeholder = await message.reply_text(helpers.get_text('ai_stream_placeholder', lang_code))
+            last_edit = loop.time()
+        if isinstance(item, Exception):
+            error = item
+            continue
+        parts.append(item)
+        # 中间结果以纯文本展示 (不完整的 MarkdownV2 无法解析)，并限制编辑频率
+        if loop.time() - last_edit < AI_STREAM_EDIT_INTERVAL_SECONDS:
+            continue
+        preview = helpers.unescape_markdown_v2("".join(parts))[:4096]
+        if preview.strip() and preview != shown_text:
+            try:
+                await placeholder.edit_text(preview)
+                shown_text = preview
+            except TelegramError as e:
+                logger.debug(f"更新流式回复时出错: {e}")
+            last_edit = loop.time()
+    # 排队被拒绝或被取代时在这里抛出
+    await producer
+    if error is not None or not parts:
+        if error is not None:
+            logger.error(f"流式生成AI回复时中断: {error}", exc_info=error)
+        parts = [helpers.get_text('internal_error', lang_code)]
+    if placeholder is None:
+        placeholder = await message.reply_text(helpers.get_text('ai_stream_placeholder', lang_code))
+    return "".join(parts), placeholder
+
+def _schedule_history_compaction(chat_id: int, lang_code: str):
+    """窗口外的旧消息足够多时，在后台把它们压缩进滚动摘要，不阻塞本次回复。"""
+    overflow = memory.take_overflow(chat_id)
+    if overflow is None:
+        return
+    previous_summary, compacted = overflow
+
+    async def compact():
+        new_summary = None
+        try:
+            new_summary = await ai_dispatcher.run_background(
+                ai_helper.summarize_history, previous_summary, compacted, lang_code
+            )
+        except Exception as e:
+            logger.error(f"压缩聊天 {chat_id} 的历史记录时出错: {e}", exc_info=True)
+        finally:
+            memory.apply_summary(chat_id, new_summary, compacted)
+        if new_summary:
+            logger.info(f"已将聊天 {chat_id} 的 {len(compacted)} 条旧消息压缩进摘要。")
+
+    task = asyncio.create_task(compact())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _finish_ai_reply(placeholder, ai_response: str, context: ContextTypes.DEFAULT_TYPE):
+    """用完整回复做最后一次编辑 (MarkdownV2，失败时降级为纯文本)，代码块附带复制按钮。"""
+    reply_markup = None
+    code_match = re.search(r"```(?:\w+\n)?(.*?)```", ai_response, re.DOTALL)
+    if code_match:
+        code_to_copy = code_match.group(1).strip()
+        if code_to_copy:
+            keyboard, code_id = get_copy_code_keyboard()
+            context.bot_data[code_id] = code_to_copy
+            reply_markup = keyboard
+    await helpers.edit_with_markdown_fallback(placeholder, ai_response, reply_markup=reply_markup)
+
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     user = update.effective_user
-    lang_code = helpers.get_display_lang(update)
+    lang_code = await helpers.get_display_lang(update)
     chat_id = chat.id
-    bot_username = (await context.bot.get_me()).username
+    bot_username = helpers.get_bot_username(context)
     is_private_chat = chat.type == ChatType.PRIVATE
     is_mention = update.message.caption and f"@{bot_username}" in update.message.caption
     is_reply_to_bot = update.message.reply_to_message and update.message.reply_to_message.from_user.id == context.bot.id
-    is_auto_mode = user_manager.is_auto_chat_on(chat_id)
+    is_auto_mode = await user_manager.get_setting(user_manager.is_auto_chat_on, chat_id)
     if not (is_private_chat or is_mention or is_reply_to_bot or is_auto_mode):
         return
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
@@ -329,25 +426,23 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"下载图片失败: {e}")
         await update.message.reply_text(helpers.get_text('internal_error', lang_code))
         return
-    history = memory.get_chat_history(chat_id)
-    history.append({"role": "user", "content": prompt_text, "timestamp": datetime.now(timezone.utc).isoformat()})
+    await memory.append_message(chat_id, "user", prompt_text)
     try:
-        ai_response = await asyncio.to_thread(
-            ai_helper.generate_ai_response,
-            chat_history=list(history), new_prompt=prompt_text,
+        ai_response, placeholder = await _stream_ai_reply(
+            update.message, context, coalesce=not (is_private_chat or is_mention or is_reply_to_bot),
+            chat_history=memory.get_prompt_history(chat_id), new_prompt=prompt_text,
             user_name=user.full_name, lang_code=lang_code,
-            image_bytes=bytes(photo_bytes)
+            image_bytes=bytes(photo_bytes), chat_id=chat_id
         )
-        history.append({"role": "model", "content": ai_response, "timestamp": datetime.now(timezone.utc).isoformat()})
-        reply_markup = None
-        code_match = re.search(r"```(?:\w+\n)?(.*?)```", ai_response, re.DOTALL)
-        if code_match:
-            code_to_copy = code_match.group(1).strip()
-            if code_to_copy:
-                keyboard, code_id = get_copy_code_keyboard()
-                context.bot_data[code_id] = code_to_copy
-                reply_markup = keyboard
-        await update.message.reply_text(ai_response, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+        await memory.append_message(chat_id, "model", ai_response)
+        await _finish_ai_reply(placeholder, ai_response, context)
+        _schedule_history_compaction(chat_id, lang_code)
+    except AiRequestSuperseded:
+        logger.debug(f"群组 {chat_id} 中有更新的消息，跳过较早的自动聊天请求。")
+    except AiQueueFull:
+        logger.warning(f"AI 请求队列已满，拒绝了来自 {chat_id} 的请求。")
+        if is_private_chat or is_mention or is_reply_to_bot:
+            await update.message.reply_text(helpers.get_text('ai_busy', lang_code))
     except Exception as e:
         logger.error(f"photo_handler 调用AI时出错: {e}", exc_info=True)
         await update.message.reply_text(helpers.get_text('internal_error', lang_code))
@@ -362,7 +457,7 @@ async def sticker_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         is_reply_to_bot = message.reply_to_message.from_user.id == context.bot.id
     is_auto_mode = False
     if chat.type != ChatType.PRIVATE:
-        is_auto_mode = user_manager.is_auto_chat_on(chat.id)
+        is_auto_mode = await user_manager.get_setting(user_manager.is_auto_chat_on, chat.id)
 
     if not (is_private_chat or is_reply_to_bot or is_auto_mode):
         return
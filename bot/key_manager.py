@@ -2,14 +2,73 @@
 from __future__ import annotations
 
 import logging
-from typing import Optional
-from .config import GOOGLE_API_KEYS
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from .config import (
+    GOOGLE_API_KEYS, GOOGLE_API_KEY_RPM, GOOGLE_API_KEY_TPM, GOOGLE_API_KEY_COOLDOWN_SECONDS,
+    GOOGLE_API_KEY_MAX_COOLDOWN_SECONDS, GOOGLE_API_KEY_ACQUIRE_TIMEOUT_SECONDS
+)
 
 logger = logging.getLogger(__name__)
 
+
+class _TokenBucket:
+    """令牌桶：容量为每分钟配额，按秒匀速补充。"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(1, per_minute))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """补充到 amount 个令牌还需要的秒数 (调用前应先 refill)。超过容量的请求按装满计算。"""
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+
+class _KeyState:
+    """单个密钥的限流桶、冷却状态和使用统计。"""
+
+    def __init__(self, index: int, key: str):
+        self.index = index
+        self.key = key
+        self.requests = _TokenBucket(GOOGLE_API_KEY_RPM)
+        self.tokens = _TokenBucket(GOOGLE_API_KEY_TPM)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_exhausted = 0
+        # 统计
+        self.total_requests = 0
+        self.total_successes = 0
+        self.total_failures = 0
+        self.total_exhausted = 0
+        self.total_tokens = 0
+
+    def wait_seconds(self, now: float, estimated_tokens: int) -> float:
+        """该密钥还需要多久才能承接一次请求，0 表示立即可用。"""
+        if now < self.cooldown_until:
+            return self.cooldown_until - now
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.seconds_until(1), self.tokens.seconds_until(estimated_tokens))
+
+
 class ApiKeyManager:
-    """负责管理和轮换Google AI API密钥的单例类。"""
-    
+    """
+    Google AI API 密钥池 (单例)。
+
+    - 每个密钥有独立的 RPM/TPM 令牌桶，请求优先分配给进行中请求最少、剩余配额最多的密钥，
+      并发请求会分散到所有密钥上。
+    - 密钥配额耗尽 (ResourceExhausted) 后进入冷却，连续耗尽时冷却时间翻倍，冷却结束自动恢复使用。
+    - 所有密钥都暂时受限时，acquire 会等待最先恢复的密钥，超时后返回 None。
+    """
+
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -19,31 +78,114 @@ class ApiKeyManager:
 
     def __init__(self):
         if not hasattr(self, 'initialized'):  # 防止重复初始化
-            self.keys = GOOGLE_API_KEYS
-            self.current_key_index = 0
+            self.keys = [key for key in GOOGLE_API_KEYS if key]
+            self._states: Dict[str, _KeyState] = {key: _KeyState(i, key) for i, key in enumerate(self.keys)}
+            self._condition = threading.Condition()
             self.initialized = True
             if not self.keys:
                 logger.warning("警告：Google AI的API密钥列表为空！AI对话功能将无法使用。")
             else:
                 logger.info(f"成功加载 {len(self.keys)} 个Google AI API密钥。")
 
-    def get_current_key(self) -> Optional[str]:
-        """获取当前正在使用的密钥。"""
-        if self.current_key_index < len(self.keys):
-            return self.keys[self.current_key_index]
-        return None
-
-    def switch_to_next_key(self) -> Optional[str]:
-        """切换到下一个可用的密钥。"""
-        self.current_key_index += 1
-        new_key = self.get_current_key()
-        
-        if new_key:
-            logger.warning(f"密钥用量耗尽，已自动切换到下一个密钥 (索引: {self.current_key_index})。")
-        else:
-            logger.error("所有Google AI API密钥均已耗尽！")
-            
-        return new_key
+    def acquire(self, estimated_tokens: int = 0, exclude: Iterable[str] = (),
+                timeout: float = GOOGLE_API_KEY_ACQUIRE_TIMEOUT_SECONDS) -> Optional[str]:
+        """
+        为一次请求分配密钥并预扣配额，exclude 中的密钥不参与分配。
+        没有可用密钥且等待超时时返回 None。拿到密钥后必须调用 report_* 之一归还。
+        """
+        exclude = set(exclude)
+        candidates = [state for key, state in self._states.items() if key not in exclude]
+        if not candidates:
+            return None
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                best = None
+                shortest_wait = None
+                for state in candidates:
+                    wait = state.wait_seconds(now, estimated_tokens)
+                    if wait > 0:
+                        shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                        continue
+                    if best is None or (state.in_flight, -state.requests.tokens, -state.tokens.tokens) < \
+                            (best.in_flight, -best.requests.tokens, -best.tokens.tokens):
+                        best = state
+                if best is not None:
+                    best.requests.tokens -= 1
+                    best.tokens.tokens -= min(estimated_tokens, best.tokens.capacity)
+                    best.in_flight += 1
+                    best.total_requests += 1
+                    return best.key
+                remaining = deadline - now
+                if remaining <= 0:
+                    logger.warning(f"{len(candidates)} 个候选密钥均处于限流或冷却中，等待 {timeout:.0f} 秒后仍无可用密钥。")
+                    return None
+                # 等待最先恢复的密钥，或其他请求归还密钥时被唤醒
+                self._condition.wait(min(remaining, shortest_wait))
+
+    def report_success(self, key: str, tokens_used: Optional[int] = None, estimated_tokens: int = 0):
+        """请求成功：归还密钥，并用实际 token 用量修正预扣的配额。"""
+        with self._condition:
+            state = self._states.get(key)
+            if state is None:
+                return
+            state.in_flight -= 1
+            state.total_successes += 1
+            state.consecutive_exhausted = 0
+            if tokens_used is not None:
+                state.total_tokens += tokens_used
+                state.tokens.tokens -= tokens_used - min(estimated_tokens, state.tokens.capacity)
+            self._condition.notify()
+
+    def report_failure(self, key: str):
+        """请求因配额以外的原因失败：只归还密钥，不影响其可用性。"""
+        with self._condition:
+            state = self._states.get(key)
+            if state is None:
+                return
+            state.in_flight -= 1
+            state.total_failures += 1
+            self._condition.notify()
+
+    def report_exhausted(self, key: str):
+        """密钥配额耗尽：归还密钥并让其进入冷却，连续耗尽时冷却时间翻倍。"""
+        with self._condition:
+            state = self._states.get(key)
+            if state is None:
+                return
+            state.in_flight -= 1
+            state.total_exhausted += 1
+            state.consecutive_exhausted += 1
+            cooldown = min(GOOGLE_API_KEY_MAX_COOLDOWN_SECONDS,
+                           GOOGLE_API_KEY_COOLDOWN_SECONDS * 2 ** (state.consecutive_exhausted - 1))
+            state.cooldown_until = time.monotonic() + cooldown
+            # 清空本分钟剩余的配额，恢复后从空桶开始补充
+            state.requests.tokens = min(state.requests.tokens, 0.0)
+            logger.warning(f"密钥 (索引: {state.index}) 用量耗尽，冷却 {cooldown:.0f} 秒后恢复使用。")
+            self._condition.notify_all()
+
+    def get_stats(self) -> List[dict]:
+        """返回每个密钥的使用统计 (不包含密钥本身)。"""
+        now = time.monotonic()
+        stats = []
+        with self._condition:
+            for state in self._states.values():
+                state.requests.refill(now)
+                state.tokens.refill(now)
+                stats.append({
+                    'index': state.index,
+                    'in_flight': state.in_flight,
+                    'cooldown_seconds': max(0.0, state.cooldown_until - now),
+                    'rpm_available': int(state.requests.tokens),
+                    'tpm_available': int(state.tokens.tokens),
+                    'requests': state.total_requests,
+                    'successes': state.total_successes,
+                    'failures': state.total_failures,
+                    'exhausted': state.total_exhausted,
+                    'tokens': state.total_tokens,
+                })
+        return stats
 
 # 创建一个全局唯一的密钥管理器实例，供其他模块导入和使用
-api_key_manager = ApiKeyManager()
\ No newline at end of file
+api_key_manager = ApiKeyManager()
@@ -9,6 +9,8 @@ translations = {
         'group_only_command': r"Sorry, this feature is for groups only\.",
         'too_fast_error': r"You're operating too fast\! Please try again later\.",
         'internal_error': r"Sorry, I encountered an internal error\. 😔",
+        'ai_stream_placeholder': r"💭 Thinking...",
+        'ai_busy': r"I'm handling too many requests right now, please try again in a moment 🙏",
         'language_switched': r"Language has been set to English\.",
         'admin_only_alert': r"Action Failed: Only group admins can change this setting\.",
         'language_menu_title': "⚙️ *Group Language Settings*\nSelect the language for this group:",
@@ -227,6 +229,7 @@ Use commands directly in your group, or go to my private chat \-> `/start` \-> "
         'rank_header_groups': r"🏢 *{period} Group Ranks* 🏢",
         'scope_local': r"This Group", 'scope_global': r"Global",
         'no_records': r"_No records yet\._",
+        'topics_warming_up': r"_Topic analysis is still warming up, the latest messages will be counted shortly\._",
         'rank_line_item_user': r"{rank_icon} {display_name}: `{count}` msgs",
         'rank_line_item_topic': r"{rank_icon} `{topic}` \({count} mentions\)",
         'rank_line_item_group': r"{rank_icon} {display_name}: `{count}` msgs",
@@ -255,6 +258,8 @@ We collect data for stats\. We do not share raw chat data\. Only aggregated resu
         'group_only_command': r"抱歉，此功能仅限群组使用。",
         'too_fast_error': r"操作太快啦，请稍后再试！",
         'internal_error': r"抱歉哈，这只是AI模型问题对其他功能没影响。试试其他功能吧，搜索全网或查看全服排名。",
+        'ai_stream_placeholder': r"💭 正在思考...",
+        'ai_busy': r"现在找我聊天的人太多啦，请稍后再试 🙏",
         'language_switched': r"语言已切换为简体中文。",
         'admin_only_alert': r"操作失败：仅群组管理员可以更改此设置。",
         'language_menu_title': "⚙️ *群组语言设置*\n请为本群组选择语言：",
@@ -454,6 +459,7 @@ We collect data for stats\. We do not share raw chat data\. Only aggregated resu
         'rank_header_groups': r"🏢 *{period}全服群排行榜* 🏢",
         'scope_local': r"本群", 'scope_global': r"全服",
         'no_records': r"_尚无记录，快来发言吧\!_",
+        'topics_warming_up': r"_话题分析正在预热，最新的消息稍后计入统计。_",
         'rank_line_item_user': r"{rank_icon} {display_name}: `{count}` 条",
         'rank_line_item_topic': r"{rank_icon} `{topic}` \(提及 `{count}` 次\)",
         'rank_line_item_group': r"{rank_icon} {display_name}: `{count}` 条",
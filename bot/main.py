@@ -3,19 +3,34 @@
 import logging
 import atexit
 import asyncio
-from telegram import BotCommand
+from telegram import BotCommand, Update
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler,
     InlineQueryHandler, ConversationHandler, ContextTypes, ChatMemberHandler
 )
 
-from . import persistence_manager, statistics as db
+from . import persistence_manager, faq_manager, statistics as db
+from .message_ingest import flush_messages_job
+from .topic_engine import topic_engine, prune_topic_terms_job, start_warmup as start_topic_warmup
+from .async_db import adb
+from .blacklist_manager import blacklist_index, blacklist_flush_job
 from .handlers import *
+from .handlers.helpers import refresh_bot_identity, refresh_bot_identity_job
 
-from .config import TELEGRAM_BOT_TOKEN
+from .ad_blocker import keyword_reload_job
+from .config import (
+    TELEGRAM_BOT_TOKEN, MESSAGE_FLUSH_INTERVAL_SECONDS, KEYWORD_RELOAD_INTERVAL_SECONDS, CHAT_HISTORY_SAVE_INTERVAL_SECONDS,
+    BLACKLIST_FLUSH_INTERVAL_SECONDS, BOT_IDENTITY_REFRESH_INTERVAL_SECONDS
+)
 
 async def post_init(application):
     """在机器人启动后设置命令菜单。"""
+    # 缓存机器人身份，之后识别 @提及 不再每条消息调用 get_me()
+    try:
+        await refresh_bot_identity(application)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"获取机器人身份时出错: {e}")
+
     commands = [
         BotCommand("start", "✨ 开始 / 显示主菜单"),
         BotCommand("menu", "📖 显示功能主菜单"),
@@ -32,6 +47,7 @@ async def post_init(application):
         BotCommand("addreply", "🔑 (管理员)添加关键词回复"),
         BotCommand("delreply", "🗑️ (管理员)删除关键词回复"),
         BotCommand("listreply", "📋 (管理员)查看关键词回复"),
+        BotCommand("setflood", "🚦 (管理员)设置刷屏检测阈值"),
     ]
     try:
         await application.bot.set_my_commands(commands + admin_commands)
@@ -39,14 +55,26 @@ async def post_init(application):
     except Exception as e:
         logging.getLogger(__name__).error(f"设置机器人命令时出错: {e}")
 
+    # 机器人已开始工作后，再在后台加载话题分词所需的 jieba 词典
+    start_topic_warmup()
+
+    # 加载黑名单内存索引 (并一次性迁移旧版 blacklist.json)，之后检查黑名单不再访问数据库
+    await adb.run(blacklist_index.load)
+
+    # 加载 FAQ 预筛选数据，之后没有 FAQ 或不可能命中的消息不再访问数据库
+    await adb.run(faq_manager.load_prefilter)
+
 
 async def discover_chats_job(context: ContextTypes.DEFAULT_TYPE):
     """定时扫描并更新已知群组信息。"""
-    await asyncio.to_thread(db.db_discover_and_update_known_chats)
+    await adb.db_discover_and_update_known_chats()
 
 async def clear_blacklist_job(context: ContextTypes.DEFAULT_TYPE):
-    """定时清理过期的黑名单条目。"""
-    await asyncio.to_thread(db.db_clear_expired_blacklist_entries)
+    """定时清理过期的黑名单条目：内存索引从最小堆顶弹出，数据库中的记录在数据库线程中删除。"""
+    blacklist_index.purge_expired()
+    # 先写入尚未落盘的变更，避免刚删除的过期记录又被旧的变更写回
+    await blacklist_index.flush_async()
+    await adb.db_clear_expired_blacklist_entries()
 
 
 def run():
@@ -62,10 +90,19 @@ def run():
     application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
     
     job_queue = application.job_queue
-    job_queue.run_repeating(persistence_manager.periodic_save_job, interval=300, first=10)
-    job_queue.run_repeating(clear_blacklist_job, interval=21600, first=60)
+    job_queue.run_repeating(persistence_manager.periodic_save_job, interval=CHAT_HISTORY_SAVE_INTERVAL_SECONDS, first=10)
+    job_queue.run_repeating(persistence_manager.prune_chat_histories_job, interval=3600, first=300)
+    job_queue.run_repeating(clear_blacklist_job, interval=600, first=60)
+    job_queue.run_repeating(blacklist_flush_job, interval=BLACKLIST_FLUSH_INTERVAL_SECONDS, first=BLACKLIST_FLUSH_INTERVAL_SECONDS)
     job_queue.run_repeating(discover_chats_job, interval=600, first=15)
+    job_queue.run_repeating(flush_messages_job, interval=MESSAGE_FLUSH_INTERVAL_SECONDS, first=MESSAGE_FLUSH_INTERVAL_SECONDS)
+    job_queue.run_repeating(prune_topic_terms_job, interval=86400, first=120)
+    job_queue.run_repeating(refresh_bot_identity_job, interval=BOT_IDENTITY_REFRESH_INTERVAL_SECONDS, first=BOT_IDENTITY_REFRESH_INTERVAL_SECONDS)
+    job_queue.run_repeating(keyword_reload_job, interval=KEYWORD_RELOAD_INTERVAL_SECONDS, first=KEYWORD_RELOAD_INTERVAL_SECONDS)
     
+    # atexit 按注册的逆序执行：先保存数据，再等待话题分词完成，最后关闭数据库长连接
+    atexit.register(db.close_all_connections)
+    atexit.register(topic_engine.shutdown)
     atexit.register(persistence_manager.save_all_data)
 
     add_reply_conv_handler = ConversationHandler(
@@ -109,8 +146,12 @@ def run():
     application.add_handler(CommandHandler("settings", settings_command))
     application.add_handler(CommandHandler("autochat_on", auto_chat_on_command))
     application.add_handler(CommandHandler("autochat_off", auto_chat_off_command))
+    application.add_handler(CommandHandler("setflood", setflood_command))
     application.add_handler(CommandHandler("ban", ban_command))
     application.add_handler(CommandHandler("unban", unban_command))
+    application.add_handler(CommandHandler("perfstats", perfstats_command))
+    application.add_handler(CommandHandler("backfill_stats", backfill_stats_command))
+    application.add_handler(CommandHandler("reload_keywords", reload_keywords_command))
     application.add_handler(CommandHandler("privacy", privacy_command))
     application.add_handler(CommandHandler("rules", rules_command))
     application.add_handler(CommandHandler("addreply", add_reply_command))
@@ -152,13 +193,18 @@ def run():
     application.add_handler(InlineQueryHandler(inline_query_handler))
     
     application.add_handler(ChatMemberHandler(my_chat_member_handler, ChatMemberHandler.MY_CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(chat_member_handler, ChatMemberHandler.CHAT_MEMBER))
 
-    application.add_handler(MessageHandler(filters.PHOTO & (~filters.UpdateType.CHANNEL_POST), photo_handler))
+    # AI 处理器不阻塞更新循环：等待 AI 回复时后续更新照常处理，
+    # 同一聊天的连续消息才能进入 ai_dispatcher 的排队、合并和繁忙拒绝逻辑。
+    # 刷屏检测和过滤处理器在更早的组中阻塞执行，拦截仍然先于这里生效。
+    application.add_handler(MessageHandler(filters.PHOTO & (~filters.UpdateType.CHANNEL_POST), photo_handler, block=False))
     application.add_handler(MessageHandler(filters.Sticker.ALL & (~filters.UpdateType.CHANNEL_POST), sticker_handler))
     chat_filter = filters.TEXT & (~filters.COMMAND) & (~filters.UpdateType.CHANNEL_POST)
-    application.add_handler(MessageHandler(chat_filter, chat_handler))
+    application.add_handler(MessageHandler(chat_filter, chat_handler, block=False))
 
     application.add_error_handler(error_handler)
     
     logger.info("机器人已启动，开始轮询...")
-    application.run_polling()
\ No newline at end of file
+    # chat_member 更新默认不会推送，需要显式订阅，管理员缓存依赖它及时更新
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
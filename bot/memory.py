@@ -1,18 +1,23 @@
 # bot/memory.py (修正后，包含所有函数的最终完整版)
 from __future__ import annotations
 
+import asyncio
 import json
 import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import uuid
 import logging
 from collections import deque
 from datetime import datetime, timedelta, timezone
 from cachetools import LRUCache
-from typing import Optional
+from typing import List, Optional, Tuple
 import diskcache
 
 # 导入 statistics 模块作为数据库访问的唯一入口
 from . import statistics as db
+from .config import AI_HISTORY_TOKEN_BUDGET, AI_HISTORY_SUMMARY_TRIGGER_TOKENS
 
 logger = logging.getLogger(__name__)
 
@@ -26,24 +31,200 @@ os.makedirs(SEARCH_CACHE_DIR, exist_ok=True)
 
 
 # ==============================================================================
-# 聊天历史记录 (Chat History - Kept in Memory/JSON as cache)
+# 聊天历史记录 (Chat History - LRU 内存缓存 + SQLite 按聊天持久化)
 # ==============================================================================
 
-chat_histories = LRUCache(maxsize=500)
-MEMORY_DEPTH = 40
+# 被 LRU 淘汰、正在写回数据库的历史记录。写回完成前再次访问该聊天时直接复用，不读到旧数据
+_pending_writebacks = {}
+_writeback_lock = threading.Lock()
+# 上次保存后有变化的聊天，定时任务只保存这些聊天
+_dirty_chats = set()
+# 所有聊天记录的写入 (淘汰写回、定时保存、清空) 都交给这一个线程按提交顺序执行。
+# 数据库线程池有多个线程，如果分开提交，先拍的快照可能晚于后面的清空写入，把清空的对话写回来
+_history_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+
+
+def _submit_history_write(histories: list) -> Future:
+    """按顺序写入聊天记录，返回 Future。解释器退出阶段写入线程已停止，此时直接在当前线程写入。"""
+    try:
+        return _history_writer.submit(db.db_save_chat_histories, histories)
+    except RuntimeError:
+        future: Future = Future()
+        try:
+            future.set_result(db.db_save_chat_histories(histories))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class _WriteBackLRUCache(LRUCache):
+    """被淘汰的聊天记录交给数据库线程写回，而不是直接丢弃。"""
+
+    def popitem(self):
+        chat_id, history = super().popitem()
+        records = list(history)
+        _dirty_chats.discard(chat_id)
+        with _writeback_lock:
+            _pending_writebacks[chat_id] = history
+        future = _submit_history_write([(chat_id, records)])
+        future.add_done_callback(lambda f: _finish_writeback(chat_id, history, f))
+        return chat_id, history
+
+
+def _finish_writeback(chat_id: int, history: deque, future):
+    with _writeback_lock:
+        if _pending_writebacks.get(chat_id) is history:
+            del _pending_writebacks[chat_id]
+    _log_write_error(chat_id, future)
+
+
+def _log_write_error(chat_id: int, future):
+    if future.exception() is not None:
+        logger.error(f"写入聊天 {chat_id} 的历史记录时出错: {future.exception()}")
+
+
+chat_histories = _WriteBackLRUCache(maxsize=500)
+# 每次请求只携带 AI_HISTORY_TOKEN_BUDGET 以内的最近消息，更早的消息会被压缩进滚动摘要；
+# MEMORY_DEPTH 只是摘要来不及生成时的兜底上限
+MEMORY_DEPTH = 200
 HISTORY_TTL_HOURS = 24
+# 滚动摘要以一条特殊记录的形式保存在历史记录的最前面，随历史记录一起持久化
+SUMMARY_ROLE = 'summary'
+SUMMARY_PREFIX = "(Summary of the earlier conversation)"
+_summarizing_chats = set()
+
+def _load_chat_history(chat_id: int) -> deque:
+    """从数据库加载单个聊天的历史记录 (会访问数据库)。"""
+    with _writeback_lock:
+        pending = _pending_writebacks.get(chat_id)
+    if pending is not None:
+        return pending
+    records = db.db_get_chat_history(chat_id) or []
+    return deque(_filter_expired_history(records), maxlen=MEMORY_DEPTH)
 
 def get_chat_history(chat_id: int) -> deque:
-    if chat_id not in chat_histories:
-        _load_chat_histories()
-        if chat_id not in chat_histories:
-             chat_histories[chat_id] = deque(maxlen=MEMORY_DEPTH)
-    return chat_histories[chat_id]
+    """返回聊天的历史记录；不在内存中时只从数据库加载这一个聊天。"""
+    history = chat_histories.get(chat_id)
+    if history is None:
+        history = _load_chat_history(chat_id)
+        chat_histories[chat_id] = history
+    return history
+
+async def get_chat_history_async(chat_id: int) -> deque:
+    """与 get_chat_history 相同，但缓存未命中时在聊天记录写入线程中加载。"""
+    history = chat_histories.get(chat_id)
+    if history is not None:
+        return history
+    # 在写入线程中加载，排在已提交的写入 (如刚执行的清空) 之后，不会读到旧数据
+    loaded = await asyncio.wrap_future(_history_writer.submit(_load_chat_history, chat_id))
+    # 等待期间其他协程可能已经加载过，以先放入缓存的为准
+    history = chat_histories.get(chat_id)
+    if history is None:
+        history = loaded
+        chat_histories[chat_id] = history
+    return history
+
+async def append_message(chat_id: int, role: str, content: str):
+    """向聊天历史追加一条消息并标记该聊天待保存。该聊天已被淘汰时在写入线程中重新加载，不阻塞事件循环。"""
+    history = await get_chat_history_async(chat_id)
+    if len(history) == history.maxlen and history[0].get('role') == SUMMARY_ROLE:
+        # 摘要来不及生成、历史记录已满时，丢弃最早的一条普通消息，而不是让 deque 挤掉最前面的摘要
+        del history[1]
+    history.append({"role": role, "content": content, "timestamp": datetime.now(timezone.utc).isoformat()})
+    _dirty_chats.add(chat_id)
+
+def mark_dirty(chat_id: int):
+    """直接修改了历史记录 deque 后调用，使其在下次保存时写入数据库。"""
+    _dirty_chats.add(chat_id)
 
 def clear_chat_history(chat_id: int):
-    if chat_id in chat_histories:
-        chat_histories[chat_id].clear()
-        _save_chat_histories()
+    history = chat_histories.get(chat_id)
+    if history is not None:
+        history.clear()
+    _dirty_chats.discard(chat_id)
+    future = _submit_history_write([(chat_id, [])])
+    future.add_done_callback(lambda f: _log_write_error(chat_id, f))
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中日韩字符约 1 个 token，其他字符约 4 个 1 个 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+def _split_summary(records: list) -> Tuple[Optional[dict], list]:
+    if records and records[0].get('role') == SUMMARY_ROLE:
+        return records[0], records[1:]
+    return None, records
+
+def _select_window(messages: list, budget: int) -> int:
+    """从最新的消息往前选取，返回放得进 token 预算的第一条消息的下标 (至少保留最后一条)。"""
+    start = len(messages)
+    used = 0
+    while start > 0:
+        cost = estimate_tokens(messages[start - 1].get('content', ''))
+        if start < len(messages) and used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+def get_prompt_history(chat_id: int) -> list:
+    """
+    返回发送给 AI 的历史记录：滚动摘要 (如果有) + token 预算内的最近消息。
+    调用前应已把本次的用户消息追加到历史记录中。
+    """
+    summary, messages = _split_summary(list(get_chat_history(chat_id)))
+    budget = AI_HISTORY_TOKEN_BUDGET
+    prefix = []
+    if summary:
+        budget -= estimate_tokens(summary['content'])
+        prefix = [
+            {"role": "user", "content": f"{SUMMARY_PREFIX}\n{summary['content']}"},
+            {"role": "model", "content": "OK"},
+        ]
+    return prefix + messages[_select_window(messages, max(0, budget)):]
+
+def take_overflow(chat_id: int) -> Optional[Tuple[Optional[str], list]]:
+    """
+    窗口外的旧消息累计超过 AI_HISTORY_SUMMARY_TRIGGER_TOKENS 时，返回 (旧摘要, 待压缩的消息) 并标记该聊天正在压缩；
+    否则返回 None。调用方生成新摘要后必须调用 apply_summary (失败时传入 None)。
+    """
+    if chat_id in _summarizing_chats:
+        return None
+    history = chat_histories.get(chat_id)
+    if history is None:
+        # 已被淘汰的聊天不在事件循环中重新加载，下次追加消息时再检查
+        return None
+    summary, messages = _split_summary(list(history))
+    budget = AI_HISTORY_TOKEN_BUDGET - (estimate_tokens(summary['content']) if summary else 0)
+    overflow = messages[:_select_window(messages, max(0, budget))]
+    if sum(estimate_tokens(msg.get('content', '')) for msg in overflow) < AI_HISTORY_SUMMARY_TRIGGER_TOKENS:
+        return None
+    _summarizing_chats.add(chat_id)
+    return (summary['content'] if summary else None), overflow
+
+def apply_summary(chat_id: int, new_summary: Optional[str], compacted: list):
+    """用新摘要替换旧摘要，并从历史记录中移除已压缩的消息。new_summary 为 None 表示本次压缩失败。"""
+    _summarizing_chats.discard(chat_id)
+    if not new_summary:
+        return
+    history = chat_histories.get(chat_id)
+    if history is None:
+        # 压缩期间该聊天已被淘汰，重新加载的记录与 compacted 对应不上，丢弃这次的摘要
+        return
+    compacted_ids = {id(msg) for msg in compacted}
+    summary, messages = _split_summary(list(history))
+    remaining = [msg for msg in messages if id(msg) not in compacted_ids]
+    if len(remaining) == len(messages):
+        # 压缩期间历史记录被清空或重新加载过，丢弃这次的摘要
+        return
+    history.clear()
+    history.append({"role": SUMMARY_ROLE, "content": new_summary, "timestamp": datetime.now(timezone.utc).isoformat()})
+    history.extend(remaining)
+    _dirty_chats.add(chat_id)
 
 # --- 【关键补充】以下是之前被省略的函数 ---
 
@@ -64,33 +245,59 @@ def _filter_expired_history(history_list: list) -> list:
             fresh_history.append(record)
     return fresh_history
 
+def _take_dirty_histories() -> list:
+    """取出所有待保存聊天的快照并清空待保存集合。应在修改历史记录的线程 (事件循环) 中调用。"""
+    dirty = []
+    for chat_id in _dirty_chats:
+        history = chat_histories.get(chat_id)
+        if history is not None:
+            dirty.append((chat_id, list(history)))
+    _dirty_chats.clear()
+    return dirty
+
 def _save_chat_histories():
-    """将内存中的聊天记录（未过期的部分）保存到 JSON 文件。"""
+    """同步保存所有有变化的聊天以及尚未写回完成的被淘汰聊天 (用于退出时)。"""
     try:
-        serializable_histories = {}
-        current_histories = dict(chat_histories.items())
-        for chat_id, history in current_histories.items():
-            fresh_history = _filter_expired_history(list(history))
-            if fresh_history:
-                serializable_histories[str(chat_id)] = fresh_history
-        with open(CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(serializable_histories, f, ensure_ascii=False, indent=2)
+        with _writeback_lock:
+            dirty = [(chat_id, list(history)) for chat_id, history in _pending_writebacks.items()]
+        dirty += _take_dirty_histories()
+        # 排在已提交的写入之后执行，不会被更早的快照覆盖
+        _submit_history_write(dirty).result()
+        return len(dirty)
+    except Exception as e:
+        logger.error(f"保存聊天历史时出错: {e}")
+        return 0
+
+async def save_dirty_histories() -> int:
+    """在事件循环中拍快照，在写入线程中逐行写入有变化的聊天，返回保存的聊天数。失败时重新标记待保存。"""
+    dirty = _take_dirty_histories()
+    if not dirty:
+        return 0
+    try:
+        # 拍快照后立即提交，写入顺序与事件循环中的操作顺序一致
+        await asyncio.wrap_future(_submit_history_write(dirty))
     except Exception as e:
+        _dirty_chats.update(chat_id for chat_id, _ in dirty)
         logger.error(f"保存聊天历史时出错: {e}")
+        return 0
+    return len(dirty)
 
-def _load_chat_histories():
-    """从 JSON 文件加载聊天记录到内存中。"""
+def _migrate_json_histories():
+    """一次性把旧版 chat_histories.json 中的聊天记录导入数据库，完成后将文件重命名为 .migrated。"""
     if not os.path.exists(CHAT_HISTORY_FILE): return
     try:
         with open(CHAT_HISTORY_FILE, 'r', encoding='utf-8') as f:
             serialized_histories = json.load(f)
+        histories = []
         for chat_id_str, history_list in serialized_histories.items():
-            chat_id = int(chat_id_str)
             fresh_history = _filter_expired_history(history_list)
             if fresh_history:
-                chat_histories[chat_id] = deque(fresh_history, maxlen=MEMORY_DEPTH)
+                histories.append((int(chat_id_str), fresh_history[-MEMORY_DEPTH:]))
+        db.db_save_chat_histories(histories)
+        os.replace(CHAT_HISTORY_FILE, CHAT_HISTORY_FILE + '.migrated')
+        logger.info(f"已将 {len(histories)} 个聊天的历史记录从 JSON 文件迁移到数据库。")
     except Exception as e:
-        logger.error(f"加载聊天历史时出错: {e}")
+        logger.error(f"迁移聊天历史时出错: {e}")
 
 # --- 补充结束 ---
 
@@ -142,5 +349,5 @@ def record_and_get_warning_level(chat_id: int, user_id: int) -> int:
     return new_count
 
 
-# --- 启动时加载聊天记录 ---
-_load_chat_histories()
\ No newline at end of file
+# --- 启动时迁移旧版 JSON 聊天记录 ---
+_migrate_json_histories()
\ No newline at end of file
@@ -0,0 +1,136 @@
+# bot/message_ingest.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from . import statistics as db
+from .async_db import adb
+from .rank_service import rank_service
+from .topic_engine import topic_engine
+from .config import MESSAGE_BATCH_SIZE, MESSAGE_QUEUE_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class MessageIngestQueue:
+    """
+    消息写入队列：在内存中缓冲待保存的消息，达到批量大小或定时任务触发时，
+    在一个事务中用 executemany 统一写入，避免每条消息一次 commit/fsync。
+
+    - 内存有界：缓冲超过 max_pending 时，写入方会先等待一次写入完成 (背压)，
+      若数据库持续不可用，则丢弃最旧的消息并计数。
+    - 退出时由 persistence_manager.save_all_data 同步调用 flush()，保证缓冲落盘。
+    """
+
+    def __init__(self, batch_size: int = MESSAGE_BATCH_SIZE, max_pending: int = MESSAGE_QUEUE_MAX_PENDING):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._buffer: List[tuple] = []
+        self._known_chats: Dict[str, str] = {}  # 待写入的 {chat_id: chat_title}
+        self._saved_chat_titles: Dict[str, str] = {}  # 已写入的群组标题，用于去重
+        self._lock = threading.Lock()  # 保护缓冲区
+        self._flush_lock = threading.Lock()  # 保证同一时间只有一次写入
+        self._flush_task: Optional[asyncio.Task] = None
+        self.total_flushed = 0
+        self.total_dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def put(self, chat_id, chat_title, chat_username, user_id, user_name, user_username, text):
+        """将一条消息加入缓冲区。参数与 statistics.save_message 相同。"""
+        row = (
+            str(chat_id), chat_title or '', chat_username or '', str(user_id),
+            user_name, user_username or '', datetime.now().isoformat(), text
+        )
+        if self.pending >= self.max_pending:
+            await self.flush_async()
+
+        with self._lock:
+            overflow = len(self._buffer) + 1 - self.max_pending
+            if overflow > 0:
+                # 写入仍然失败，只能丢弃最旧的消息来保证内存有界
+                del self._buffer[:overflow]
+                self.total_dropped += overflow
+                logger.warning(f"消息写入队列已满，丢弃了 {overflow} 条最旧的消息。")
+            self._buffer.append(row)
+            should_flush = len(self._buffer) >= self.batch_size
+
+        if should_flush:
+            self._schedule_flush()
+
+    def note_known_chat(self, chat_id: int, chat_title: str):
+        """记录群组标题，随下一批消息一起写入 known_chats；标题未变化时不产生写入。"""
+        chat_id_str = str(chat_id)
+        if not chat_id_str.startswith('-100') or not chat_title:
+            return
+        if self._saved_chat_titles.get(chat_id_str) == chat_title:
+            return
+        with self._lock:
+            self._known_chats[chat_id_str] = chat_title
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush_async())
+
+    async def flush_async(self) -> int:
+        """在数据库线程中执行 flush()，不阻塞事件循环。"""
+        return await adb.run(self.flush)
+
+    def flush(self) -> int:
+        """将缓冲区中的所有消息写入数据库，返回写入的条数。可在任意线程中同步调用。"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                known_chats, self._known_chats = self._known_chats, {}
+            if not batch and not known_chats:
+                return 0
+
+            # 写库与排行榜增量更新在同一把锁内完成，排行榜加载不会看到“已写库未累加”的中间状态；
+            # 话题统计也在锁内提交，以便与话题重建的快照对齐
+            with rank_service.lock:
+                try:
+                    db.db_save_messages_batch(batch, known_chats)
+                except Exception as e:
+                    # 只有写库本身失败时才放回缓冲区；写库成功后再放回会导致重复插入
+                    logger.error(f"批量写入 {len(batch)} 条消息时出错，将在下次重试: {e}", exc_info=True)
+                    with self._lock:
+                        self._buffer = batch + self._buffer
+                        overflow = len(self._buffer) - self.max_pending
+                        if overflow > 0:
+                            del self._buffer[:overflow]
+                            self.total_dropped += overflow
+                        for chat_id, chat_title in known_chats.items():
+                            self._known_chats.setdefault(chat_id, chat_title)
+                    return 0
+                try:
+                    rank_service.apply_messages(batch)
+                except Exception as e:
+                    # 排行榜可能只累加了一部分，丢弃后在下次查询时从汇总表重新加载
+                    logger.error(f"更新排行榜时出错 (消息已写入，排行榜将重新加载): {e}", exc_info=True)
+                    rank_service.clear_boards()
+                try:
+                    topic_engine.submit(batch)
+                except Exception as e:
+                    logger.error(f"提交话题统计时出错 (消息已写入，跳过本批的话题统计): {e}", exc_info=True)
+
+            for row in batch:
+                if row[0].startswith('-100') and row[1]:
+                    self._saved_chat_titles[row[0]] = row[1]
+            self._saved_chat_titles.update(known_chats)
+            self.total_flushed += len(batch)
+            return len(batch)
+
+
+# 全局唯一的消息写入队列
+ingest_queue = MessageIngestQueue()
+
+
+async def flush_messages_job(context):
+    """定时任务：按时间触发批量写入。"""
+    await ingest_queue.flush_async()
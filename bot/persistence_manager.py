@@ -1,21 +1,54 @@
 # bot/persistence_manager.py (最终清理版)
 
 import logging
+from datetime import datetime, timedelta, timezone
 from . import memory # 现在只需要保存聊天记录
+from . import statistics as db
+from .message_ingest import ingest_queue
+from .async_db import adb
+from .blacklist_manager import blacklist_index
 
 logger = logging.getLogger(__name__)
 
 def save_all_data():
     """
     持久化所有需要定期保存的内存数据。
-    目前只剩下聊天记录缓存。
+    包括消息写入队列中尚未落盘的消息、黑名单变更，以及聊天记录缓存。
     """
     try:
-        logger.info("正在执行数据持久化保存 (聊天记录)...")
-        memory._save_chat_histories()
-        logger.info("聊天记录保存成功。")
+        flushed_count = ingest_queue.flush()
+        if flushed_count:
+            logger.info(f"已将写入队列中的 {flushed_count} 条消息保存到数据库。")
+    except Exception as e:
+        logger.error(f"保存写入队列中的消息时发生错误: {e}", exc_info=True)
+
+    try:
+        blacklist_index.flush()
+    except Exception as e:
+        logger.error(f"保存黑名单变更时发生错误: {e}", exc_info=True)
+
+    try:
+        saved_count = memory._save_chat_histories()
+        logger.info(f"已保存 {saved_count} 个聊天的聊天记录。")
     except Exception as e:
         logger.error(f"持久化保存聊天记录时发生错误: {e}", exc_info=True)
 
+def _prune_chat_histories():
+    # 超过有效期仍未更新的聊天不会再被使用，直接删除
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=memory.HISTORY_TTL_HOURS)
+    deleted = db.db_prune_chat_histories(cutoff.isoformat())
+    if deleted:
+        logger.info(f"已删除 {deleted} 个过期聊天的聊天记录。")
+
 async def periodic_save_job(context):
-    save_all_data()
\ No newline at end of file
+    """定时任务：只保存上次保存后有变化的聊天记录，写库在数据库线程中进行。"""
+    saved_count = await memory.save_dirty_histories()
+    if saved_count:
+        logger.debug(f"已保存 {saved_count} 个聊天的聊天记录。")
+
+async def prune_chat_histories_job(context):
+    """定时任务：删除过期聊天的聊天记录。"""
+    try:
+        await adb.run(_prune_chat_histories)
+    except Exception as e:
+        logger.error(f"清理过期聊天记录时发生错误: {e}", exc_info=True)
@@ -0,0 +1,141 @@
+# bot/rank_service.py
+from __future__ import annotations
+
+import logging
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from . import statistics as db
+from .config import RANK_SERVICE_MAX_BOARDS
+
+logger = logging.getLogger(__name__)
+
+# 群组内排名支持的周期；全服排名只统计总发言数
+CHAT_PERIODS = ('today', 'week', 'month')
+GLOBAL_SCOPE = 'global'
+
+
+class _Leaderboard:
+    """
+    单个 (范围, 周期) 的排行榜：用户发言数 + 所有用户发言数的有序列表。
+    查询排名用二分查找，为 O(log n)；内存只与用户数有关，与最大发言数无关。
+    """
+
+    def __init__(self, start_day: Optional[str], counts: Dict[str, int]):
+        self.start_day = start_day
+        self.counts: Dict[str, int] = dict(counts)
+        self._sorted_counts: List[int] = sorted(self.counts.values())
+
+    def add(self, user_id: str, delta: int):
+        old = self.counts.get(user_id, 0)
+        new = old + delta
+        if old:
+            del self._sorted_counts[bisect_left(self._sorted_counts, old)]
+        insort(self._sorted_counts, new)
+        self.counts[user_id] = new
+
+    def rank_of(self, user_id: str, excluded: List[str]) -> Tuple[int, int]:
+        """返回 (排名, 发言数)，与 SQL RANK() 一致：并列时名次相同。不在榜上时返回 (0, 0)。"""
+        count = self.counts.get(user_id, 0)
+        if not count:
+            return 0, 0
+        higher = len(self._sorted_counts) - bisect_right(self._sorted_counts, count)
+        # 排除名单通常很短，直接逐个扣除
+        higher -= sum(1 for other in excluded if other != user_id and self.counts.get(other, 0) > count)
+        return higher + 1, count
+
+
+class RankService:
+    """
+    排名服务：为每个 (群组, 周期) 和全服维护一个内存排行榜，回答“用户 X 在范围 Y 周期 Z 的排名和发言数”。
+
+    - 排行榜在首次查询时从 activity_daily 汇总表加载，之后随消息批量写入增量更新。
+    - 消息写入与增量更新在同一把锁内完成 (见 message_ingest)，加载也持有这把锁，
+      因此不会出现重复计数或遗漏。
+    - 周期切换 (新的一天/周/月) 后，旧排行榜在下次查询时自动重新加载。
+    - 排行榜数量有界，超出 RANK_SERVICE_MAX_BOARDS 时淘汰最久未使用的。
+    """
+
+    def __init__(self, max_boards: int = RANK_SERVICE_MAX_BOARDS):
+        self.lock = threading.RLock()
+        self._boards: LRUCache = LRUCache(maxsize=max_boards)
+
+    @property
+    def board_count(self) -> int:
+        return len(self._boards)
+
+    def _get_board(self, key: Tuple[str, str], start_day: Optional[str]) -> _Leaderboard:
+        board = self._boards.get(key)
+        if board is not None and board.start_day == start_day:
+            return board
+        scope, _ = key
+        if scope == GLOBAL_SCOPE:
+            counts = db.db_get_global_user_counts()
+        else:
+            counts = db.db_get_chat_user_counts(scope, start_day)
+        board = _Leaderboard(start_day, counts)
+        self._boards[key] = board
+        return board
+
+    def get_user_rank_in_chat(self, user_id: int, chat_id: int, period: str) -> Tuple[int, int]:
+        start_time = db._get_start_time_for_period(period)
+        if not start_time:
+            return 0, 0
+        user_id_str = str(user_id)
+        exclusion_list = db._get_exclusion_list()
+        if user_id_str in exclusion_list:
+            return 0, 0
+        with self.lock:
+            board = self._get_board((str(chat_id), period), start_time.date().isoformat())
+            return board.rank_of(user_id_str, exclusion_list)
+
+    def get_user_global_stats(self, user_id: int) -> Tuple[int, int]:
+        """返回 (全服排名, 总发言数)。用户自己即使不参与排名，也能看到自己的名次。"""
+        user_id_str = str(user_id)
+        exclusion_list = db._get_exclusion_list()
+        with self.lock:
+            board = self._get_board((GLOBAL_SCOPE, 'all'), None)
+            return board.rank_of(user_id_str, exclusion_list)
+
+    def apply_messages(self, rows: List[tuple]):
+        """
+        将已写入数据库的一批消息累加到已加载的排行榜上。
+        rows 的格式与 statistics.db_save_messages_batch 相同，调用方应在写库时就持有 self.lock。
+        """
+        per_user = Counter((row[0], row[3], row[6][:10]) for row in rows if not row[3].startswith('-100'))
+        if not per_user:
+            return
+        with self.lock:
+            global_board = self._boards.get((GLOBAL_SCOPE, 'all'))
+            for (chat_id, user_id, day), count in per_user.items():
+                if global_board is not None:
+                    global_board.add(user_id, count)
+                for period in CHAT_PERIODS:
+                    board = self._boards.get((chat_id, period))
+                    if board is not None and day >= board.start_day:
+                        board.add(user_id, count)
+
+    def clear_boards(self):
+        """丢弃所有已加载的排行榜，下次查询时从汇总表重新加载。"""
+        with self.lock:
+            self._boards.clear()
+
+    def rebuild_from_messages(self) -> int:
+        """
+        根据历史消息重建汇总表并清空排行榜，返回汇总行数。耗时较长，应在独立线程中调用，不要占用数据库线程。
+        耗时的全表统计在锁外进行；只有替换汇总表 (并补上统计期间新写入的消息) 时持有锁，
+        以免与批量写入交错。排行榜在下次查询时从新的汇总表重新加载。
+        """
+        cutoff_id = db.db_build_activity_rollup()
+        with self.lock:
+            row_count = db.db_swap_activity_rollup(cutoff_id)
+            self._boards.clear()
+        return row_count
+
+
+# 全局唯一的排名服务实例
+rank_service = RankService()
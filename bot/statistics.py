@@ -2,20 +2,17 @@
 from __future__ import annotations
 
 import os
+import json
 import sqlite3
 import logging
-from collections import Counter
+import threading
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Tuple, Optional
 
-from .config import USER_RANKING_BLACKLIST
-
-try:
-    import jieba
-except ImportError:
-    print("警告: 未找到 'jieba' 库。中文话题统计功能将无法正常工作。")
-    print("请通过 'pip install -r requirements.txt' 安装。")
-    jieba = None
+from .config import (
+    USER_RANKING_BLACKLIST, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_MMAP_SIZE,
+    DB_CACHE_SIZE, DB_BUSY_TIMEOUT_MS, DB_STATEMENT_CACHE_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
@@ -25,13 +22,76 @@ DB_FILE = os.path.join(DATA_DIR, 'statistics.db')
 os.makedirs(DATA_DIR, exist_ok=True)
 
 
-def _get_db_connection() -> sqlite3.Connection:
-    """获取一个数据库连接，并设置 Row Factory 以便返回类似字典的结果。"""
-    conn = sqlite3.connect(DB_FILE)
+# ==============================================================================
+# Section 0: 连接管理 (Connection Management)
+# ==============================================================================
+# 每个线程持有一条长连接，避免每次查询都重新 connect/close。
+# sqlite3 会按 SQL 文本缓存预编译语句 (cached_statements)，因此长连接上重复执行的
+# 固定 SQL 不会被重复解析。
+
+_thread_local = threading.local()
+_open_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_connection_generation = 0
+
+
+def _configure_connection(conn: sqlite3.Connection):
+    """为新连接设置 Row Factory 和性能相关的 PRAGMA。"""
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size = {int(DB_CACHE_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def _get_db_connection() -> sqlite3.Connection:
+    """获取当前线程的数据库长连接，首次调用时创建。调用方不应关闭它。"""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None and _thread_local.generation == _connection_generation:
+        if conn.in_transaction:
+            # 上一次调用异常退出时遗留的事务会一直占着写锁，这里兜底回滚
+            logger.warning("检测到未结束的数据库事务，已自动回滚。")
+            conn.rollback()
+        return conn
+
+    conn = sqlite3.connect(
+        DB_FILE,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+        check_same_thread=False,  # 连接只在所属线程中使用，仅在关闭时跨线程
+    )
+    _configure_connection(conn)
+    with _connections_lock:
+        _open_connections.append(conn)
+    _thread_local.conn = conn
+    _thread_local.generation = _connection_generation
     return conn
 
 
+def close_all_connections():
+    """关闭所有线程的长连接（用于退出或切换数据库文件），之后的调用会自动重建连接。"""
+    global _connection_generation
+    with _connections_lock:
+        _connection_generation += 1
+        for conn in _open_connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"关闭数据库连接时出错: {e}")
+        _open_connections.clear()
+
+
+def _ensure_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]):
+    """为旧数据库中已存在的表补上新增的列。"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row['name'] for row in cursor.fetchall()}
+    for name, declaration in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+
 def _initialize_database():
     """初始化数据库，创建所有需要的表。"""
     conn = _get_db_connection()
@@ -55,6 +115,39 @@ def _initialize_database():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id_timestamp ON messages (user_id, timestamp);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);")
 
+    # --- 每日活跃度汇总表 (排行榜与个人统计都从这里读取，写入消息时同步累加) ---
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'activity_daily'")
+    rollup_existed = cursor.fetchone() is not None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS activity_daily (
+        chat_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        msg_count INTEGER NOT NULL DEFAULT 0,
+        first_ts TEXT,
+        last_ts TEXT,
+        user_name TEXT,
+        user_username TEXT,
+        chat_title TEXT,
+        chat_username TEXT,
+        PRIMARY KEY (chat_id, user_id, day)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_daily_user_day ON activity_daily (user_id, day);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_daily_day ON activity_daily (day);")
+
+    # --- 每日话题词频表 (由 topic_engine 在消息写入后分词累加) ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS topic_terms (
+        chat_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        term TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, day, term)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_topic_terms_day ON topic_terms (day);")
+
     # --- 已知群组信息表 ---
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS known_chats (
@@ -81,9 +174,16 @@ def _initialize_database():
         language_code TEXT,
         autochat_enabled INTEGER NOT NULL DEFAULT 0,
         spam_filter_enabled INTEGER NOT NULL DEFAULT 1,
-        checkin_enabled INTEGER NOT NULL DEFAULT 0
+        checkin_enabled INTEGER NOT NULL DEFAULT 0,
+        flood_max_messages INTEGER,
+        flood_window_seconds REAL
     )
     """)
+    # 刷屏检测阈值，NULL 表示使用全局默认值
+    _ensure_columns(cursor, 'group_settings', {
+        'flood_max_messages': 'INTEGER',
+        'flood_window_seconds': 'REAL',
+    })
 
     # --- 关键词回复 (FAQ) 表 ---
     cursor.execute("""
@@ -151,8 +251,20 @@ def _initialize_database():
     )
     """)
 
+    # --- AI 对话历史表 (每个聊天一行，history 为 JSON 数组) ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS chat_histories (
+        chat_id TEXT PRIMARY KEY,
+        history TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """)
+
     conn.commit()
-    conn.close()
+
+    if not rollup_existed:
+        # 首次创建汇总表时，从已有的消息记录回填一次
+        db_backfill_activity_rollup()
 
 
 # ==============================================================================
@@ -183,7 +295,6 @@ def update_known_chat(chat_id: int, chat_title: str, added_by_user_id: int = Non
             """, (str(chat_id), chat_title))
 
         conn.commit()
-        conn.close()
     except Exception as e:
         logger.error(f"更新已知群组信息时出错: {e}")
 
@@ -204,7 +315,6 @@ def db_discover_and_update_known_chats():
         discovered_chats = cursor.fetchall()
         
         if not discovered_chats:
-            conn.close()
             return
 
         chats_to_upsert = [(row['chat_id'], row['chat_title']) for row in discovered_chats]
@@ -215,50 +325,151 @@ def db_discover_and_update_known_chats():
         """, chats_to_upsert)
         
         conn.commit()
-        conn.close()
         logger.info(f"成功从消息历史中扫描并更新了 {len(discovered_chats)} 个群组信息到 known_chats 表。")
     except Exception as e:
         logger.error(f"扫描并更新已知群组时出错: {e}", exc_info=True)
 
 def save_message(chat_id, chat_title, chat_username, user_id, user_name, user_username, text):
-    update_known_chat(chat_id, chat_title)
     timestamp = datetime.now().isoformat()
+    row = (str(chat_id), chat_title or '', chat_username or '', str(user_id), user_name, user_username or '', timestamp, text)
     try:
-        conn = _get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO messages (chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, text)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (str(chat_id), chat_title or '', chat_username or '', str(user_id), user_name, user_username or '', timestamp, text))
-        conn.commit()
-        conn.close()
+        db_save_messages_batch([row])
     except Exception as e:
         logger.error(f"保存消息到数据库时出错: {e}")
 
+def _aggregate_activity(rows: List[tuple]) -> List[tuple]:
+    """把一批消息按 (chat_id, user_id, 日期) 聚合成 activity_daily 的增量行。"""
+    buckets: Dict[Tuple[str, str, str], list] = {}
+    for chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, _ in rows:
+        key = (chat_id, user_id, timestamp[:10])
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, timestamp, timestamp, user_name, user_username, chat_title, chat_username]
+            continue
+        bucket[0] += 1
+        if timestamp < bucket[1]:
+            bucket[1] = timestamp
+        if timestamp >= bucket[2]:
+            bucket[2:] = [timestamp, user_name, user_username, chat_title, chat_username]
+    return [key + tuple(bucket) for key, bucket in buckets.items()]
+
+_ACTIVITY_UPSERT_SQL = """
+INSERT INTO activity_daily (chat_id, user_id, day, msg_count, first_ts, last_ts, user_name, user_username, chat_title, chat_username)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(chat_id, user_id, day) DO UPDATE SET
+    msg_count = msg_count + excluded.msg_count,
+    first_ts = MIN(first_ts, excluded.first_ts),
+    last_ts = MAX(last_ts, excluded.last_ts),
+    user_name = CASE WHEN excluded.last_ts >= last_ts THEN excluded.user_name ELSE user_name END,
+    user_username = CASE WHEN excluded.last_ts >= last_ts THEN excluded.user_username ELSE user_username END,
+    chat_title = CASE WHEN excluded.last_ts >= last_ts THEN excluded.chat_title ELSE chat_title END,
+    chat_username = CASE WHEN excluded.last_ts >= last_ts THEN excluded.chat_username ELSE chat_username END
+"""
+
+def db_save_messages_batch(rows: List[tuple], known_chats: Dict[str, str] = None):
+    """
+    在一个事务中批量写入消息，并顺带更新已知群组信息。
+    :param rows: (chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, text) 元组列表
+    :param known_chats: {chat_id: chat_title}，需要写入 known_chats 表的群组
+    失败时抛出异常，由调用方决定是否重试。
+    """
+    chats_to_upsert = dict(known_chats or {})
+    for row in rows:
+        chat_id, chat_title = row[0], row[1]
+        if chat_id.startswith('-100') and chat_title:
+            chats_to_upsert[chat_id] = chat_title
+
+    conn = _get_db_connection()
+    with conn:
+        if rows:
+            conn.executemany("""
+            INSERT INTO messages (chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.executemany(_ACTIVITY_UPSERT_SQL, _aggregate_activity(rows))
+        if chats_to_upsert:
+            conn.executemany("""
+            INSERT INTO known_chats (chat_id, chat_title)
+            VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET chat_title = excluded.chat_title
+            """, list(chats_to_upsert.items()))
+
+def db_build_activity_rollup() -> int:
+    """
+    根据当前 messages 表在本连接的临时表中统计汇总数据，返回统计到的最大消息 id。
+    只读取主库，不占用写锁，期间的批量写入照常进行。随后应在同一线程中调用 db_swap_activity_rollup。
+    """
+    conn = _get_db_connection()
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS temp.activity_rebuild")
+        cutoff_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        conn.execute("""
+        CREATE TEMP TABLE activity_rebuild AS
+        SELECT chat_id, user_id, day, msg_count, first_ts, timestamp AS last_ts, user_name, user_username, chat_title, chat_username
+        FROM (
+            SELECT
+                chat_id, user_id, SUBSTR(timestamp, 1, 10) AS day, timestamp,
+                user_name, user_username, chat_title, chat_username,
+                COUNT(*) OVER w AS msg_count,
+                MIN(timestamp) OVER w AS first_ts,
+                ROW_NUMBER() OVER (PARTITION BY chat_id, user_id, SUBSTR(timestamp, 1, 10) ORDER BY timestamp DESC, id DESC) AS rn
+            FROM messages
+            WHERE id <= ?
+            WINDOW w AS (PARTITION BY chat_id, user_id, SUBSTR(timestamp, 1, 10))
+        )
+        WHERE rn = 1
+        """, (cutoff_id,))
+    return cutoff_id
+
+def db_swap_activity_rollup(cutoff_id: int) -> int:
+    """
+    用 db_build_activity_rollup 的结果替换 activity_daily，并补上统计之后新写入 (id > cutoff_id) 的消息，
+    返回汇总行数。只是几条短语句，调用方应持有写库锁 (rank_service.lock)，以免与批量写入交错。
+    """
+    conn = _get_db_connection()
+    try:
+        with conn:
+            conn.execute("DELETE FROM activity_daily")
+            conn.execute("""
+            INSERT INTO activity_daily (chat_id, user_id, day, msg_count, first_ts, last_ts, user_name, user_username, chat_title, chat_username)
+            SELECT chat_id, user_id, day, msg_count, first_ts, last_ts, user_name, user_username, chat_title, chat_username
+            FROM temp.activity_rebuild
+            """)
+            newer_rows = conn.execute("""
+            SELECT chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, text
+            FROM messages WHERE id > ?
+            """, (cutoff_id,)).fetchall()
+            if newer_rows:
+                conn.executemany(_ACTIVITY_UPSERT_SQL, _aggregate_activity([tuple(row) for row in newer_rows]))
+            row_count = conn.execute("SELECT COUNT(*) FROM activity_daily").fetchone()[0]
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.activity_rebuild")
+    logger.info(f"已根据历史消息重建活跃度汇总表，共 {row_count} 行。")
+    return row_count
+
+def db_backfill_activity_rollup() -> int:
+    """根据 messages 表重建 activity_daily 汇总表，返回生成的汇总行数 (用于首次建表，此时没有并发写入)。"""
+    return db_swap_activity_rollup(db_build_activity_rollup())
+
 def get_all_known_groups() -> List[Tuple[str, str]]:
     conn = _get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT chat_id, chat_title FROM known_chats ORDER BY chat_title ASC")
     results = cursor.fetchall()
-    conn.close()
     return [(row['chat_id'], row['chat_title']) for row in results]
 
 def db_get_groups_for_user(user_id: int) -> List[Tuple[str, str]]:
     conn = _get_db_connection()
     cursor = conn.cursor()
+    # 只有一个 MAX() 聚合时，SQLite 的裸列取自最大值所在的那一行，即最近的群组标题
     cursor.execute("""
-        SELECT T1.chat_id, T1.chat_title
-        FROM messages AS T1
-        INNER JOIN (
-            SELECT chat_id, MAX(timestamp) AS max_ts
-            FROM messages
-            WHERE user_id = ? AND chat_id LIKE '-100%' AND chat_title IS NOT NULL AND chat_title != ''
-            GROUP BY chat_id
-        ) AS T2 ON T1.chat_id = T2.chat_id AND T1.timestamp = T2.max_ts
-        ORDER BY T1.chat_title
+        SELECT chat_id, chat_title, MAX(last_ts) AS max_ts
+        FROM activity_daily
+        WHERE user_id = ? AND chat_id LIKE '-100%' AND chat_title IS NOT NULL AND chat_title != ''
+        GROUP BY chat_id
+        ORDER BY chat_title
     """, (str(user_id),))
     results = cursor.fetchall()
-    conn.close()
     return [(row['chat_id'], row['chat_title']) for row in results]
 
 def get_user_id_by_username(username: str) -> Optional[int]:
@@ -267,7 +478,6 @@ def get_user_id_by_username(username: str) -> Optional[int]:
     cursor = conn.cursor()
     cursor.execute("SELECT user_id FROM messages WHERE LOWER(user_username) = ? ORDER BY timestamp DESC LIMIT 1", (cleaned_username,))
     result = cursor.fetchone()
-    conn.close()
     try:
         return int(result['user_id']) if result else None
     except (ValueError, TypeError):
@@ -292,58 +502,70 @@ def db_get_user_activity_across_groups(user_id: int) -> List[Tuple[str, str, int
     cursor = conn.cursor()
     query = """
     SELECT
-        T1.chat_title,
-        T1.chat_username,
-        T2.msg_count
+        chat_title,
+        chat_username,
+        SUM(msg_count) AS msg_count,
+        MAX(last_ts) AS max_ts
     FROM
-        messages AS T1
-    INNER JOIN (
-        SELECT
-            chat_id,
-            COUNT(*) AS msg_count,
-            MAX(timestamp) AS max_ts
-        FROM
-            messages
-        WHERE
-            user_id = ? AND chat_id LIKE '-100%'
-        GROUP BY
-            chat_id
-    ) AS T2 ON T1.chat_id = T2.chat_id AND T1.timestamp = T2.max_ts
+        activity_daily
+    WHERE
+        user_id = ? AND chat_id LIKE '-100%'
+    GROUP BY
+        chat_id
     ORDER BY
-        T2.msg_count DESC;
+        msg_count DESC;
     """
     cursor.execute(query, (str(user_id),))
     results = cursor.fetchall()
-    conn.close()
     return [(row['chat_title'], row['chat_username'], row['msg_count']) for row in results]
 
 # ==============================================================================
 # Section 2: 统计与排行榜函数 (Statistics & Ranking Functions)
 # ==============================================================================
 
+# 排除名单每次排名查询都要用到，缓存在内存中，只在用户切换“参与排名”时失效 (见 user_manager)
+_exclusion_cache: Optional[List[str]] = None
+_exclusion_generation = 0  # 每次失效 +1，防止并发读取把失效前读到的旧名单写回缓存
+_exclusion_lock = threading.Lock()
+
 def _get_exclusion_list() -> List[str]:
+    """返回不参与排名的用户 ID 列表。返回的是共享的缓存对象，调用方不要修改。"""
+    global _exclusion_cache
+    with _exclusion_lock:
+        if _exclusion_cache is not None:
+            return _exclusion_cache
+        generation = _exclusion_generation
     opt_out_users = db_get_all_ranking_opt_out_users()
-    return list(set(USER_RANKING_BLACKLIST + opt_out_users))
+    exclusion_list = list(set(USER_RANKING_BLACKLIST + opt_out_users))
+    with _exclusion_lock:
+        if generation == _exclusion_generation:
+            _exclusion_cache = exclusion_list
+    return exclusion_list
+
+def invalidate_exclusion_list():
+    """使排除名单缓存失效，下次查询时重新读取。"""
+    global _exclusion_cache, _exclusion_generation
+    with _exclusion_lock:
+        _exclusion_generation += 1
+        _exclusion_cache = None
 
 def get_daily_activity_for_chat(chat_id: int, start_date: datetime, end_date: datetime) -> Dict:
     conn = _get_db_connection()
     cursor = conn.cursor()
     cursor.execute("""
-    SELECT DATE(timestamp) as activity_date, COUNT(*) as msg_count
-    FROM messages WHERE chat_id = ? AND timestamp >= ? AND timestamp <= ?
-    GROUP BY activity_date ORDER BY activity_date ASC
-    """, (str(chat_id), start_date.isoformat(), end_date.isoformat()))
+    SELECT day as activity_date, SUM(msg_count) as msg_count
+    FROM activity_daily WHERE chat_id = ? AND day >= ? AND day <= ?
+    GROUP BY day ORDER BY day ASC
+    """, (str(chat_id), start_date.date().isoformat(), end_date.date().isoformat()))
     results = cursor.fetchall()
-    conn.close()
     return {datetime.strptime(row['activity_date'], '%Y-%m-%d').date(): row['msg_count'] for row in results}
 
 def get_user_stats_in_chat(user_id: int, chat_id: int) -> dict:
     conn = _get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*), MIN(timestamp) FROM messages WHERE user_id = ? AND chat_id = ?", (str(user_id), str(chat_id)))
+    cursor.execute("SELECT SUM(msg_count), MIN(first_ts) FROM activity_daily WHERE chat_id = ? AND user_id = ?", (str(chat_id), str(user_id)))
     result = cursor.fetchone()
-    conn.close()
-    total_count = result[0] if result else 0
+    total_count = (result[0] or 0) if result else 0
     first_message_iso = result[1] if result and result[1] else None
     first_message_date = None
     if first_message_iso:
@@ -352,48 +574,27 @@ def get_user_stats_in_chat(user_id: int, chat_id: int) -> dict:
         except: pass
     return {"total_count": total_count, "first_date": first_message_date}
 
-def get_user_rank_in_chat(user_id: int, chat_id: int, period: str) -> tuple[int, int]:
-    start_time = _get_start_time_for_period(period)
-    if not start_time: return 0, 0
+def db_get_chat_user_counts(chat_id: int, start_day: str) -> Dict[str, int]:
+    """返回群组内自 start_day 起每个用户的发言数，供 rank_service 构建排行榜。"""
     conn = _get_db_connection()
     cursor = conn.cursor()
-    exclusion_list = _get_exclusion_list()
-    placeholders = ','.join('?' for _ in exclusion_list)
-    where_clause = "WHERE chat_id = ? AND timestamp >= ? AND user_id NOT LIKE '-100%'"
-    params = [str(chat_id), start_time.isoformat()]
-    if exclusion_list:
-        where_clause += f" AND user_id NOT IN ({placeholders})"
-        params.extend(exclusion_list)
-    base_query = f"CREATE TEMP TABLE rank_table AS SELECT user_id, COUNT(*) as msg_count FROM messages {where_clause} GROUP BY user_id ORDER BY msg_count DESC"
-    cursor.execute("DROP TABLE IF EXISTS rank_table;")
-    cursor.execute(base_query, tuple(params))
-    cursor.execute("SELECT rank, msg_count FROM (SELECT user_id, msg_count, RANK() OVER (ORDER BY msg_count DESC) as rank FROM rank_table) WHERE user_id = ?", (str(user_id),))
-    result = cursor.fetchone()
-    conn.close()
-    return (result['rank'], result['msg_count']) if result else (0, 0)
+    cursor.execute("""
+    SELECT user_id, SUM(msg_count) AS msg_count FROM activity_daily
+    WHERE chat_id = ? AND day >= ? AND user_id NOT LIKE '-100%'
+    GROUP BY user_id
+    """, (str(chat_id), start_day))
+    return {row['user_id']: row['msg_count'] for row in cursor.fetchall()}
 
-def get_user_global_stats(user_id: int) -> tuple[int, int]:
+def db_get_global_user_counts() -> Dict[str, int]:
+    """返回每个用户在所有会话中的总发言数，供 rank_service 构建全服排行榜。"""
     conn = _get_db_connection()
     cursor = conn.cursor()
-    exclusion_list = _get_exclusion_list()
-    user_id_str = str(user_id)
-    if user_id_str in exclusion_list: exclusion_list.remove(user_id_str)
-    placeholders = ','.join('?' for _ in exclusion_list)
-    where_clause = "WHERE user_id NOT LIKE '-100%'"
-    params = []
-    if exclusion_list:
-        where_clause += f" AND user_id NOT IN ({placeholders})"
-        params.extend(exclusion_list)
-    base_query = f"CREATE TEMP TABLE global_rank_table AS SELECT user_id, COUNT(*) as msg_count FROM messages {where_clause} GROUP BY user_id ORDER BY msg_count DESC"
-    cursor.execute("DROP TABLE IF EXISTS global_rank_table;")
-    cursor.execute(base_query, tuple(params))
-    cursor.execute("SELECT rank, msg_count FROM (SELECT user_id, msg_count, RANK() OVER (ORDER BY msg_count DESC) as rank FROM global_rank_table) WHERE user_id = ?", (user_id_str,))
-    result = cursor.fetchone()
-    cursor.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id_str,))
-    total_count_result = cursor.fetchone()
-    total_count = total_count_result[0] if total_count_result else 0
-    conn.close()
-    return (result['rank'], total_count) if result else (0, total_count)
+    cursor.execute("""
+    SELECT user_id, SUM(msg_count) AS msg_count FROM activity_daily
+    WHERE user_id NOT LIKE '-100%'
+    GROUP BY user_id
+    """)
+    return {row['user_id']: row['msg_count'] for row in cursor.fetchall()}
 
 def get_top_users_by_period(chat_id: int, period: str, limit: int = 10) -> list:
     start_time = _get_start_time_for_period(period)
@@ -402,17 +603,17 @@ def get_top_users_by_period(chat_id: int, period: str, limit: int = 10) -> list:
     cursor = conn.cursor()
     exclusion_list = _get_exclusion_list()
     placeholders = ','.join('?' for _ in exclusion_list)
-    where_clause = "WHERE chat_id = ? AND timestamp >= ? AND user_id NOT LIKE '-100%'"
-    params = [str(chat_id), start_time.isoformat()]
+    where_clause = "WHERE chat_id = ? AND day >= ? AND user_id NOT LIKE '-100%'"
+    params = [str(chat_id), start_time.date().isoformat()]
     if exclusion_list:
         where_clause += f" AND user_id NOT IN ({placeholders})"
         params.extend(exclusion_list)
     
-    base_query = f"SELECT T1.user_id, T1.user_name, T1.user_username, T2.msg_count FROM messages AS T1 INNER JOIN (SELECT user_id, COUNT(*) AS msg_count, MAX(timestamp) AS max_ts FROM messages {where_clause} GROUP BY user_id) AS T2 ON T1.user_id = T2.user_id AND T1.timestamp = T2.max_ts ORDER BY T2.msg_count DESC LIMIT ?"
+    # 用户名等裸列取自 MAX(last_ts) 所在的行，即该用户最近一次发言时的名字
+    base_query = f"SELECT user_id, user_name, user_username, SUM(msg_count) AS msg_count, MAX(last_ts) AS max_ts FROM activity_daily {where_clause} GROUP BY user_id ORDER BY msg_count DESC LIMIT ?"
     params.append(limit)
     cursor.execute(base_query, tuple(params))
     results = cursor.fetchall()
-    conn.close()
     return [(row['user_id'], row['user_name'], row['user_username'], row['msg_count']) for row in results]
 
 def get_global_top_users_by_period(period: str, limit: int = 10) -> list:
@@ -422,17 +623,16 @@ def get_global_top_users_by_period(period: str, limit: int = 10) -> list:
     cursor = conn.cursor()
     exclusion_list = _get_exclusion_list()
     placeholders = ','.join('?' for _ in exclusion_list)
-    where_clause = "WHERE timestamp >= ? AND user_id NOT LIKE '-100%'"
-    params = [start_time.isoformat()]
+    where_clause = "WHERE day >= ? AND user_id NOT LIKE '-100%'"
+    params = [start_time.date().isoformat()]
     if exclusion_list:
         where_clause += f" AND user_id NOT IN ({placeholders})"
         params.extend(exclusion_list)
 
-    base_query = f"SELECT T1.user_id, T1.user_name, T1.user_username, T2.msg_count FROM messages AS T1 INNER JOIN (SELECT user_id, COUNT(*) AS msg_count, MAX(timestamp) AS max_ts FROM messages {where_clause} GROUP BY user_id) AS T2 ON T1.user_id = T2.user_id AND T1.timestamp = T2.max_ts ORDER BY T2.msg_count DESC LIMIT ?"
+    base_query = f"SELECT user_id, user_name, user_username, SUM(msg_count) AS msg_count, MAX(last_ts) AS max_ts FROM activity_daily {where_clause} GROUP BY user_id ORDER BY msg_count DESC LIMIT ?"
     params.append(limit)
     cursor.execute(base_query, tuple(params))
     results = cursor.fetchall()
-    conn.close()
     return [(row['user_id'], row['user_name'], row['user_username'], row['msg_count']) for row in results]
 
 def get_global_top_groups_by_period(period: str, limit: int = 10) -> list:
@@ -442,67 +642,84 @@ def get_global_top_groups_by_period(period: str, limit: int = 10) -> list:
     cursor = conn.cursor()
     query = """
     SELECT 
-        T1.chat_title, 
-        T1.chat_username, 
-        T2.msg_count
+        chat_title, 
+        chat_username, 
+        SUM(msg_count) AS msg_count, 
+        MAX(last_ts) AS max_ts 
     FROM 
-        messages AS T1
-    INNER JOIN (
-        SELECT 
-            chat_id, 
-            COUNT(*) AS msg_count, 
-            MAX(timestamp) AS max_ts 
-        FROM 
-            messages 
-        WHERE 
-            timestamp >= ? AND chat_id LIKE '-100%'
-        GROUP BY 
-            chat_id
-    ) AS T2 ON T1.chat_id = T2.chat_id AND T1.timestamp = T2.max_ts
+        activity_daily 
+    WHERE 
+        day >= ? AND chat_id LIKE '-100%'
+    GROUP BY 
+        chat_id
     ORDER BY 
-        T2.msg_count DESC 
+        msg_count DESC 
     LIMIT ?
     """
-    cursor.execute(query, (start_time.isoformat(), limit))
+    cursor.execute(query, (start_time.date().isoformat(), limit))
     results = cursor.fetchall()
-    conn.close()
     return [(row['chat_title'], row['chat_username'], row['msg_count']) for row in results]
 
-def is_valid_topic(text: str) -> bool:
-    cleaned_text = text.strip()
-    if len(cleaned_text) < 2 or cleaned_text.startswith('/') or not any(char.isalpha() for char in cleaned_text) or (len(cleaned_text) > 4 and len(set(cleaned_text)) <= 2):
-        return False
-    return True
+def db_add_topic_terms(term_counts: List[Tuple[str, str, str, int]]):
+    """批量累加话题词频。:param term_counts: (chat_id, day, term, count) 元组列表"""
+    if not term_counts:
+        return
+    conn = _get_db_connection()
+    with conn:
+        conn.executemany("""
+        INSERT INTO topic_terms (chat_id, day, term, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(chat_id, day, term) DO UPDATE SET count = count + excluded.count
+        """, term_counts)
 
-def _fetch_texts_for_period(period: str, chat_id: str = None) -> list:
-    start_time = _get_start_time_for_period(period)
-    if not start_time: return []
+def db_replace_topic_terms_since(start_day: str, term_counts: List[Tuple[str, str, str, int]]):
+    """用重新统计的结果替换 start_day 及之后的话题词频 (用于回填)。"""
+    conn = _get_db_connection()
+    with conn:
+        conn.execute("DELETE FROM topic_terms WHERE day >= ?", (start_day,))
+        conn.executemany("""
+        INSERT INTO topic_terms (chat_id, day, term, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(chat_id, day, term) DO UPDATE SET count = count + excluded.count
+        """, term_counts)
+
+def db_prune_topic_terms(before_day: str) -> int:
+    """删除 before_day 之前的话题词频，返回删除的行数。"""
+    conn = _get_db_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM topic_terms WHERE day < ?", (before_day,))
+    return cursor.rowcount
+
+def db_get_messages_since(start_time: datetime) -> List[tuple]:
+    """返回 start_time 之后的消息，格式与 db_save_messages_batch 的参数相同 (用于回填话题词频)。"""
     conn = _get_db_connection()
     cursor = conn.cursor()
-    exclusion_list = _get_exclusion_list()
-    placeholders = ','.join('?' for _ in exclusion_list)
-    base_query = "SELECT text FROM messages WHERE timestamp >= ? AND user_id NOT LIKE '-100%'"
-    params = [start_time.isoformat()]
-    if exclusion_list:
-        base_query += f" AND user_id NOT IN ({placeholders})"
-        params.extend(exclusion_list)
+    cursor.execute("""
+    SELECT chat_id, chat_title, chat_username, user_id, user_name, user_username, timestamp, text
+    FROM messages WHERE timestamp >= ?
+    """, (start_time.isoformat(),))
+    return [tuple(row) for row in cursor.fetchall()]
+
+def _get_top_terms(start_day: str, chat_id: str = None, limit: int = 10) -> list:
+    conn = _get_db_connection()
+    cursor = conn.cursor()
+    base_query = "SELECT term, SUM(count) AS total FROM topic_terms WHERE day >= ?"
+    params = [start_day]
     if chat_id:
         base_query += " AND chat_id = ?"
-        params.append(str(chat_id))
+        params.append(chat_id)
+    base_query += " GROUP BY term ORDER BY total DESC LIMIT ?"
+    params.append(limit)
     cursor.execute(base_query, tuple(params))
-    results = [row[0] for row in cursor.fetchall() if row[0] and is_valid_topic(row[0])]
-    conn.close()
-    return results
+    return [(row['term'], row['total']) for row in cursor.fetchall()]
 
 def get_top_topics_by_period(chat_id: int, period: str, limit: int = 10) -> list:
-    valid_texts = _fetch_texts_for_period(period, chat_id=str(chat_id))
-    if not valid_texts: return []
-    return Counter(valid_texts).most_common(limit)
+    start_time = _get_start_time_for_period(period)
+    if not start_time: return []
+    return _get_top_terms(start_time.date().isoformat(), chat_id=str(chat_id), limit=limit)
 
 def get_global_top_topics_by_period(period: str, limit: int = 10) -> list:
-    valid_texts = _fetch_texts_for_period(period)
-    if not valid_texts: return []
-    return Counter(valid_texts).most_common(limit)
+    start_time = _get_start_time_for_period(period)
+    if not start_time: return []
+    return _get_top_terms(start_time.date().isoformat(), limit=limit)
 
 # ==============================================================================
 # Section 3: 设置与数据管理函数 (Settings & Data Management Functions)
@@ -513,7 +730,6 @@ def db_get_user_settings(user_id: int) -> Optional[sqlite3.Row]:
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM user_settings WHERE user_id = ?", (str(user_id),))
     result = cursor.fetchone()
-    conn.close()
     return result
 
 def db_update_user_setting(user_id: int, **kwargs):
@@ -526,14 +742,12 @@ def db_update_user_setting(user_id: int, **kwargs):
     params = list(kwargs.values()) + [user_id_str]
     cursor.execute(f"UPDATE user_settings SET {set_clause} WHERE user_id = ?", tuple(params))
     conn.commit()
-    conn.close()
 
 def db_get_all_ranking_opt_out_users() -> List[str]:
     conn = _get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_id FROM user_settings WHERE ranking_enabled = 0")
     results = [row['user_id'] for row in cursor.fetchall()]
-    conn.close()
     return results
 
 def db_get_group_settings(chat_id: int) -> Optional[sqlite3.Row]:
@@ -541,7 +755,6 @@ def db_get_group_settings(chat_id: int) -> Optional[sqlite3.Row]:
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM group_settings WHERE chat_id = ?", (str(chat_id),))
     result = cursor.fetchone()
-    conn.close()
     return result
 
 def db_update_group_setting(chat_id: int, **kwargs):
@@ -554,7 +767,6 @@ def db_update_group_setting(chat_id: int, **kwargs):
     params = list(kwargs.values()) + [chat_id_str]
     cursor.execute(f"UPDATE group_settings SET {set_clause} WHERE chat_id = ?", tuple(params))
     conn.commit()
-    conn.close()
 
 def db_add_faq(chat_id: int, question: str, answer: str, keywords: str) -> bool:
     try:
@@ -562,9 +774,9 @@ def db_add_faq(chat_id: int, question: str, answer: str, keywords: str) -> bool:
         cursor = conn.cursor()
         cursor.execute("INSERT INTO faqs (chat_id, question, answer, keywords) VALUES (?, ?, ?, ?)", (str(chat_id), question, answer, keywords))
         conn.commit()
-        conn.close()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False
 
 def db_delete_faq(faq_id: int) -> bool:
@@ -573,42 +785,43 @@ def db_delete_faq(faq_id: int) -> bool:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM faqs WHERE id = ?", (faq_id,))
         conn.commit()
-        conn.close()
         return cursor.rowcount > 0
     except Exception as e:
         logger.error(f"从数据库删除FAQ (ID: {faq_id}) 时出错: {e}")
         return False
 
+def db_get_all_faq_questions() -> List[Tuple[str, str]]:
+    conn = _get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT chat_id, question FROM faqs")
+    return [(row['chat_id'], row['question']) for row in cursor.fetchall()]
+
 def db_get_faqs_for_chat(chat_id: int) -> List[sqlite3.Row]:
     conn = _get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM faqs WHERE chat_id = ? ORDER BY id ASC", (str(chat_id),))
     results = cursor.fetchall()
-    conn.close()
     return results
 
-def db_get_blacklist_entry(user_id: int) -> Optional[sqlite3.Row]:
+def db_get_all_blacklist_entries() -> List[sqlite3.Row]:
     conn = _get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM blacklist WHERE user_id = ?", (str(user_id),))
-    result = cursor.fetchone()
-    conn.close()
-    return result
-
-def db_add_to_blacklist(user_id: int, expiration_timestamp: str):
-    conn = _get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO blacklist (user_id, expiration_timestamp) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET expiration_timestamp = excluded.expiration_timestamp", (str(user_id), expiration_timestamp))
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT user_id, expiration_timestamp FROM blacklist")
+    return cursor.fetchall()
 
-def db_remove_from_blacklist(user_id: int) -> bool:
+def db_save_blacklist_changes(upserts: List[Tuple[int, str]], deletes: List[int]):
+    """在一个事务中批量写入黑名单的新增/更新 (user_id, 解封时间) 和删除。"""
+    if not upserts and not deletes:
+        return
     conn = _get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM blacklist WHERE user_id = ?", (str(user_id),))
-    conn.commit()
-    conn.close()
-    return cursor.rowcount > 0
+    with conn:
+        if upserts:
+            conn.executemany(
+                "INSERT INTO blacklist (user_id, expiration_timestamp) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET expiration_timestamp = excluded.expiration_timestamp",
+                [(str(user_id), expiration_timestamp) for user_id, expiration_timestamp in upserts]
+            )
+        if deletes:
+            conn.executemany("DELETE FROM blacklist WHERE user_id = ?", [(str(user_id),) for user_id in deletes])
 
 def db_clear_expired_blacklist_entries():
     now_iso = datetime.now(timezone.utc).isoformat()
@@ -617,7 +830,6 @@ def db_clear_expired_blacklist_entries():
     cursor.execute("DELETE FROM blacklist WHERE expiration_timestamp < ?", (now_iso,))
     deleted_count = cursor.rowcount
     conn.commit()
-    conn.close()
     if deleted_count > 0:
         logger.info(f"成功从数据库清除了 {deleted_count} 条过期的黑名单记录。")
 
@@ -626,7 +838,6 @@ def db_get_user_warning(chat_id: int, user_id: int) -> Optional[sqlite3.Row]:
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM user_warnings WHERE chat_id = ? AND user_id = ?", (str(chat_id), str(user_id)))
     result = cursor.fetchone()
-    conn.close()
     return result
 
 def db_update_user_warning(chat_id: int, user_id: int, count: int, timestamp: str):
@@ -634,7 +845,44 @@ def db_update_user_warning(chat_id: int, user_id: int, count: int, timestamp: st
     cursor = conn.cursor()
     cursor.execute("INSERT INTO user_warnings (chat_id, user_id, warning_count, last_warning_timestamp) VALUES (?, ?, ?, ?) ON CONFLICT(chat_id, user_id) DO UPDATE SET warning_count = excluded.warning_count, last_warning_timestamp = excluded.last_warning_timestamp", (str(chat_id), str(user_id), count, timestamp))
     conn.commit()
-    conn.close()
+
+def db_get_chat_history(chat_id: int) -> Optional[list]:
+    """读取单个聊天的 AI 对话历史，没有记录时返回 None。"""
+    conn = _get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT history FROM chat_histories WHERE chat_id = ?", (str(chat_id),))
+    result = cursor.fetchone()
+    if not result:
+        return None
+    try:
+        return json.loads(result['history'])
+    except ValueError as e:
+        logger.error(f"解析聊天 {chat_id} 的对话历史时出错: {e}")
+        return None
+
+def db_save_chat_histories(histories: List[Tuple[int, list]]):
+    """批量写入多个聊天的 AI 对话历史，空列表表示删除该聊天的记录。"""
+    if not histories:
+        return
+    now_iso = datetime.now(timezone.utc).isoformat()
+    upserts = [(str(chat_id), json.dumps(history, ensure_ascii=False), now_iso) for chat_id, history in histories if history]
+    deletes = [(str(chat_id),) for chat_id, history in histories if not history]
+    conn = _get_db_connection()
+    with conn:
+        if upserts:
+            conn.executemany("""
+                INSERT INTO chat_histories (chat_id, history, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET history = excluded.history, updated_at = excluded.updated_at
+            """, upserts)
+        if deletes:
+            conn.executemany("DELETE FROM chat_histories WHERE chat_id = ?", deletes)
+
+def db_prune_chat_histories(before_iso: str) -> int:
+    """删除在 before_iso 之前就不再更新的对话历史，返回删除的行数。"""
+    conn = _get_db_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM chat_histories WHERE updated_at < ?", (before_iso,))
+    return cursor.rowcount
 
 
 # ==============================================================================
@@ -647,7 +895,6 @@ def db_get_user_points(user_id: int, chat_id: int) -> int:
     cursor = conn.cursor()
     cursor.execute("SELECT points FROM user_points WHERE user_id = ? AND chat_id = ?", (str(user_id), str(chat_id)))
     result = cursor.fetchone()
-    conn.close()
     return result['points'] if result else 0
 
 def db_add_points(user_id: int, chat_id: int, points_to_add: int, cooldown_seconds: int = 1) -> tuple[bool, int]:
@@ -676,7 +923,7 @@ def db_add_points(user_id: int, chat_id: int, points_to_add: int, cooldown_secon
         try:
             last_update_time = datetime.fromisoformat(result['last_update_timestamp'])
             if (now - last_update_time).total_seconds() < cooldown_seconds:
-                conn.close()
+                conn.rollback()
                 return (False, current_points)
         except (ValueError, TypeError):
             pass
@@ -688,7 +935,6 @@ def db_add_points(user_id: int, chat_id: int, points_to_add: int, cooldown_secon
     )
     
     conn.commit()
-    conn.close()
     return (True, new_points)
 
 def db_check_if_user_checked_in_today(user_id: int, chat_id: int) -> bool:
@@ -698,7 +944,6 @@ def db_check_if_user_checked_in_today(user_id: int, chat_id: int) -> bool:
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM checkin_log WHERE user_id = ? AND chat_id = ? AND checkin_date = ?", (str(user_id), str(chat_id), today_str))
     result = cursor.fetchone()
-    conn.close()
     return result is not None
 
 def db_record_checkin(user_id: int, chat_id: int):
@@ -708,7 +953,6 @@ def db_record_checkin(user_id: int, chat_id: int):
     cursor = conn.cursor()
     cursor.execute("INSERT INTO checkin_log (user_id, chat_id, checkin_date) VALUES (?, ?, ?)", (str(user_id), str(chat_id), today_str))
     conn.commit()
-    conn.close()
 
 # ==============================================================================
 # Section 5: 商店系统 (Shop System)
@@ -719,7 +963,6 @@ def db_get_shop_items() -> List[sqlite3.Row]:
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM shop_items WHERE is_active = 1 ORDER BY cost ASC")
     results = cursor.fetchall()
-    conn.close()
     return results
 
 def db_get_shop_item_by_id(item_id: int) -> Optional[sqlite3.Row]:
@@ -727,7 +970,6 @@ def db_get_shop_item_by_id(item_id: int) -> Optional[sqlite3.Row]:
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM shop_items WHERE id = ?", (item_id,))
     result = cursor.fetchone()
-    conn.close()
     return result
 
 def db_add_shop_item(name: str, description: str, cost: int, stock: int) -> bool:
@@ -740,12 +982,11 @@ def db_add_shop_item(name: str, description: str, cost: int, stock: int) -> bool
             (name, description, cost, stock)
         )
         conn.commit()
-        conn.close()
         logger.info(f"成功向数据库添加新奖品: {name}")
         return True
     except sqlite3.IntegrityError:
         logger.warning(f"尝试添加一个已存在的奖品名称: {name}")
-        conn.close()
+        conn.rollback()
         return False
 
 def db_redeem_item(user_id: int, chat_id: int, item: sqlite3.Row) -> bool:
@@ -764,8 +1005,6 @@ def db_redeem_item(user_id: int, chat_id: int, item: sqlite3.Row) -> bool:
         conn.rollback()
         logger.error(f"兑换奖品时发生数据库错误: {e}")
         return False
-    finally:
-        conn.close()
 
 
 # ==============================================================================
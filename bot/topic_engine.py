@@ -0,0 +1,220 @@
+# bot/topic_engine.py
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from . import statistics as db
+from .async_db import adb
+from .config import TOPIC_WORKER_THREADS, TOPIC_RETENTION_DAYS, TOPIC_MAX_TEXT_LENGTH
+from .rank_service import rank_service
+
+logger = logging.getLogger(__name__)
+
+# --- jieba 延迟加载 ---
+# 导入 jieba 并加载词典需要数秒，因此不在模块导入时进行，而是在机器人启动后由
+# start_warmup() 在后台线程中完成。词典缓存放在 data/ 目录下，重启后可直接复用。
+JIEBA_CACHE_FILE = os.path.join(db.DATA_DIR, 'jieba.cache')
+
+jieba = None
+jieba_ready = threading.Event()
+_warmup_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
+
+def _load_jieba():
+    global jieba
+    start = time.perf_counter()
+    try:
+        import jieba as jieba_module
+        jieba_module.setLogLevel(logging.WARNING)
+        jieba_module.dt.cache_file = JIEBA_CACHE_FILE
+        jieba_module.initialize()
+        jieba = jieba_module
+        logger.info(f"jieba 词典加载完成，耗时 {time.perf_counter() - start:.1f} 秒。")
+    except ImportError:
+        logger.warning("未找到 'jieba' 库，中文话题将按整段文本统计。请通过 'pip install -r requirements.txt' 安装。")
+    except Exception as e:
+        logger.error(f"加载 jieba 词典时出错，中文话题将按整段文本统计: {e}", exc_info=True)
+    finally:
+        jieba_ready.set()
+
+def start_warmup():
+    """在后台线程中加载 jieba 词典 (只会启动一次)。"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_load_jieba, name="jieba-warmup", daemon=True)
+            _warmup_thread.start()
+
+def is_ready() -> bool:
+    """jieba 词典是否已加载完成 (或确认无法加载)。"""
+    return jieba_ready.is_set()
+
+# 连续的中文片段交给 jieba 分词，英文单词直接用正则切分
+_TOKEN_RE = re.compile(r"[\u4e00-\u9fff]+|[A-Za-z][A-Za-z0-9+#'\-]*")
+_URL_RE = re.compile(r"https?://\S+|www\.\S+|t\.me/\S+")
+
+STOPWORDS = frozenset("""
+的 了 是 我 你 他 她 它 们 我们 你们 他们 她们 它们 这 那 这个 那个 这些 那些 这样 那样 这里 那里
+在 有 和 与 或 就 都 也 还 又 很 太 更 最 不 没 没有 不是 不会 不要 不能 可以 可能 应该 需要
+会 要 能 想 去 来 到 说 看 给 让 被 把 对 从 向 跟 比 为 为了 因为 所以 但是 但 而且 如果 虽然
+然后 还是 就是 只是 什么 怎么 怎么样 为什么 哪 哪里 哪个 谁 多少 几 吗 呢 吧 啊 呀 哦 哈 哈哈 哈哈哈
+嗯 额 呃 嘛 啦 哇 诶 唉 喔 一个 一下 一些 一点 一样 一起 已经 现在 今天 明天 昨天 时候 知道 觉得
+自己 大家 东西 事情 真的 其实 然后 好的 好吧 谢谢 感谢 不用 还有 而已 确实 应该 估计 好像 这么 那么
+the a an and or but if then so of to in on at by for with from as is are was were be been being
+it its this that these those i you he she we they me him her us them my your his our their
+do does did done have has had not no yes can could will would should may might must just
+what which who whom when where why how all any some more most other such only own same than too
+very also about into over after before again there here out up down off just get got like
+ok okay lol im dont its thats yeah yep nope hi hello thanks thank please
+""".split())
+
+
+def extract_terms(text: str) -> Set[str]:
+    """从一条消息中提取话题词 (已去重、去停用词，英文统一小写)。"""
+    if not text:
+        return set()
+    text = text.strip()
+    if not text or text.startswith('/'):
+        return set()
+    text = _URL_RE.sub(' ', text[:TOPIC_MAX_TEXT_LENGTH])
+
+    terms = set()
+    for match in _TOKEN_RE.finditer(text):
+        segment = match.group(0)
+        if segment[0].isascii():
+            words = [segment.strip("'-").lower()]
+        elif jieba is not None:
+            words = jieba.lcut(segment)
+        else:
+            words = [segment]
+        for word in words:
+            if len(word) < 2 or word in STOPWORDS:
+                continue
+            # 过滤 "哈哈哈哈"、"aaaa" 这类重复字符
+            if len(word) > 2 and len(set(word)) == 1:
+                continue
+            terms.add(word)
+    return terms
+
+
+def count_terms(rows: List[tuple]) -> List[Tuple[str, str, str, int]]:
+    """
+    对一批消息分词并按 (chat_id, 日期, 词) 计数，每条消息中同一个词只计一次。
+    不参与排名的用户 (含关闭了排名的用户) 的消息不计入话题。
+    rows 的格式与 statistics.db_save_messages_batch 相同。
+    """
+    excluded = set(db._get_exclusion_list())
+    counter: Counter = Counter()
+    for chat_id, _, _, user_id, _, _, timestamp, text in rows:
+        if user_id.startswith('-100') or user_id in excluded:
+            continue
+        day = timestamp[:10]
+        for term in extract_terms(text):
+            counter[(chat_id, day, term)] += 1
+    return [key + (count,) for key, count in counter.items()]
+
+
+class TopicEngine:
+    """
+    话题统计引擎：消息写入数据库后，把这批消息交给分词线程池，
+    分词结果按天累加到 topic_terms 表，话题排行直接读取该表。
+
+    重建 (rebuild_recent) 与增量统计的协调：每批消息在写库的同一把锁 (rank_service.lock) 内
+    提交并记下当时的“代数”，重建在这把锁内读取快照并把代数加一。因此快照之前写库的批次
+    代数一定更小，已包含在快照中，尚未累加的直接丢弃；快照之后的批次在重建完成前先暂存，
+    替换完成后再累加，既不重复也不遗漏。
+    """
+
+    def __init__(self, worker_count: int = TOPIC_WORKER_THREADS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, worker_count), thread_name_prefix="topic-worker")
+        self._state_lock = threading.Lock()
+        self._generation = 0
+        self._rebuilding = False
+        self._deferred: List[Tuple[str, str, str, int]] = []
+        self.total_messages = 0
+        self.total_failures = 0
+
+    def _process(self, rows: List[tuple], generation: int):
+        # 词典未就绪时任务在线程池中排队等待，消息处理本身不受影响
+        start_warmup()
+        jieba_ready.wait()
+        try:
+            term_counts = count_terms(rows)
+            with self._state_lock:
+                if generation < self._generation:
+                    return  # 这批消息已包含在重建的快照中
+                if self._rebuilding:
+                    self._deferred.extend(term_counts)
+                else:
+                    db.db_add_topic_terms(term_counts)
+                self.total_messages += len(rows)
+        except Exception as e:
+            self.total_failures += 1
+            logger.error(f"统计 {len(rows)} 条消息的话题词频时出错: {e}", exc_info=True)
+
+    def submit(self, rows: List[tuple]):
+        """
+        异步统计一批已保存的消息。调用方应在写库时持有 rank_service.lock，并在锁内调用。
+        解释器退出阶段线程池不再接受任务，此时直接在当前线程处理。
+        """
+        if not rows:
+            return
+        generation = self._generation
+        try:
+            self._executor.submit(self._process, rows, generation)
+        except RuntimeError:
+            self._process(rows, generation)
+
+    def rebuild_recent(self, days: int = 31) -> int:
+        """根据最近 days 天的历史消息重新统计话题词频，返回统计的消息条数。在分词线程中排队执行。"""
+        return self._executor.submit(self._rebuild_recent, days).result()
+
+    def _rebuild_recent(self, days: int) -> int:
+        start_warmup()
+        jieba_ready.wait()
+        start_time = (datetime.now() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        term_counts = None
+        try:
+            # 只在读取快照时持有写库锁，耗时的分词在锁外进行
+            with rank_service.lock:
+                with self._state_lock:
+                    self._generation += 1
+                    self._rebuilding = True
+                rows = db.db_get_messages_since(start_time)
+            term_counts = count_terms(rows)
+        finally:
+            # 重建失败时也要把暂存的增量写回，并恢复正常统计
+            with self._state_lock:
+                try:
+                    if term_counts is not None:
+                        db.db_replace_topic_terms_since(start_time.date().isoformat(), term_counts)
+                    db.db_add_topic_terms(self._deferred)
+                finally:
+                    self._deferred = []
+                    self._rebuilding = False
+        logger.info(f"已根据最近 {days} 天的 {len(rows)} 条消息重建话题词频。")
+        return len(rows)
+
+    def shutdown(self):
+        """等待已提交的分词任务完成。"""
+        self._executor.shutdown(wait=True)
+
+
+# 全局唯一的话题统计引擎
+topic_engine = TopicEngine()
+
+
+async def prune_topic_terms_job(context):
+    """定时任务：清理超过保留期的话题词频。"""
+    before_day = (datetime.now() - timedelta(days=TOPIC_RETENTION_DAYS)).date().isoformat()
+    deleted = await adb.db_prune_topic_terms(before_day)
+    if deleted:
+        logger.info(f"已清理 {deleted} 行 {before_day} 之前的话题词频。")
@@ -1,10 +1,16 @@
 # bot/user_manager.py (已添加垃圾拦截开关功能的最终完整版)
 from __future__ import annotations
 
+import contextvars
 import logging
-from typing import Optional
-from .config import DEFAULT_LANGUAGE # 仍然需要默认语言设置
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from cachetools import TTLCache
+from .config import (
+    DEFAULT_LANGUAGE, SETTINGS_CACHE_MAXSIZE, SETTINGS_CACHE_TTL_SECONDS, FLOOD_MAX_MESSAGES, FLOOD_WINDOW_SECONDS
+)
 from . import statistics as db # 将 statistics 模块作为数据库访问层导入，并简称为 db
+from .async_db import adb
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +18,99 @@ logger = logging.getLogger(__name__)
 # --- 删除了全局变量 user_database 和 group_database ---
 
 
+# ==============================================================================
+# 设置缓存 (Settings Cache)
+# ==============================================================================
+# 每条消息都会多次读取同一行设置，这里用有界的 TTL/LRU 缓存挡住重复查询。
+# 缓存按需填充（没有设置记录的 None 也会被缓存），所有写入都经过下面的
+# _update_* 函数，写库后立即失效对应条目。TTLCache 不是线程安全的，用锁保护。
+
+_MISSING = object()
+_user_settings_cache: TTLCache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=SETTINGS_CACHE_TTL_SECONDS)
+_group_settings_cache: TTLCache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=SETTINGS_CACHE_TTL_SECONDS)
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+_invalidation_count = 0  # 每次失效 +1，防止并发读取把失效前读到的旧值写回缓存
+# 为 True 时缓存未命中不访问数据库，而是抛出 _SettingsCacheMiss (见 get_setting)
+_cache_only = contextvars.ContextVar('settings_cache_only', default=False)
+
+
+class _SettingsCacheMiss(Exception):
+    pass
+
+
+def _cached_settings(cache: TTLCache, key: str, loader):
+    with _cache_lock:
+        settings = cache.get(key, _MISSING)
+        if settings is not _MISSING:
+            _cache_stats['hits'] += 1
+            return settings
+        if _cache_only.get():
+            raise _SettingsCacheMiss(key)
+        _cache_stats['misses'] += 1
+        generation = _invalidation_count
+    settings = loader(key)
+    with _cache_lock:
+        if generation == _invalidation_count:
+            cache[key] = settings
+    return settings
+
+def _get_user_settings(user_id: int):
+    return _cached_settings(_user_settings_cache, str(user_id), db.db_get_user_settings)
+
+def _get_group_settings(chat_id: int):
+    return _cached_settings(_group_settings_cache, str(chat_id), db.db_get_group_settings)
+
+async def get_setting(func: Callable, *args) -> Any:
+    """
+    在事件循环中读取设置，例如 await get_setting(is_auto_chat_on, chat_id)。
+    所需的设置都在缓存中时直接返回，不经过数据库线程；有未命中时才交给数据库线程加载。
+    func 只能读取用户/群组设置，不能有其他数据库访问。
+    """
+    token = _cache_only.set(True)
+    try:
+        return func(*args)
+    except _SettingsCacheMiss:
+        pass
+    finally:
+        _cache_only.reset(token)
+    return await adb.run(func, *args)
+
+def _update_user_setting(user_id: int, **kwargs):
+    db.db_update_user_setting(user_id, **kwargs)
+    invalidate_user_settings(user_id)
+    if 'ranking_enabled' in kwargs:
+        db.invalidate_exclusion_list()
+
+def _update_group_setting(chat_id: int, **kwargs):
+    db.db_update_group_setting(chat_id, **kwargs)
+    invalidate_group_settings(chat_id)
+
+def invalidate_user_settings(user_id: int):
+    """使指定用户的设置缓存失效。"""
+    global _invalidation_count
+    with _cache_lock:
+        _invalidation_count += 1
+        _user_settings_cache.pop(str(user_id), None)
+
+def invalidate_group_settings(chat_id: int):
+    """使指定群组的设置缓存失效。"""
+    global _invalidation_count
+    with _cache_lock:
+        _invalidation_count += 1
+        _group_settings_cache.pop(str(chat_id), None)
+
+def get_settings_cache_stats() -> Dict[str, int]:
+    """返回设置缓存的命中/未命中次数和当前条目数。"""
+    with _cache_lock:
+        return {
+            'hits': _cache_stats['hits'],
+            'misses': _cache_stats['misses'],
+            'user_entries': len(_user_settings_cache),
+            'group_entries': len(_group_settings_cache),
+        }
+
+
 # ==============================================================================
 # 用户设置 (User Settings)
 # ==============================================================================
@@ -20,14 +119,14 @@ def set_user_language(user_id: int, lang_code: str):
     """
     在数据库中设置指定用户的语言偏好。
     """
-    db.db_update_user_setting(user_id, language_code=lang_code)
+    _update_user_setting(user_id, language_code=lang_code)
     logger.info(f"用户 {user_id} 的语言已在数据库中更新为: {lang_code}")
 
 def get_user_language(user_id: int) -> Optional[str]:
     """
     从数据库中获取指定用户的语言偏好。
     """
-    settings = db.db_get_user_settings(user_id)
+    settings = _get_user_settings(user_id)
     # 如果 settings 不为 None 且 language_code 字段有值，则返回它
     if settings and settings['language_code']:
         return settings['language_code']
@@ -38,7 +137,7 @@ def is_user_ranking_enabled(user_id: int) -> bool:
     从数据库检查用户是否选择参与全服排名。
     默认值为 True (参与)。
     """
-    settings = db.db_get_user_settings(user_id)
+    settings = _get_user_settings(user_id)
     # 如果没有设置记录，或者 ranking_enabled 字段为 1 (或 True)，则视为参与
     if not settings:
         return True # 新用户默认为参与
@@ -52,7 +151,7 @@ def toggle_user_ranking_participation(user_id: int) -> bool:
     new_status = not current_status
     
     # 将布尔值转换为整数 1 或 0 存入数据库
-    db.db_update_user_setting(user_id, ranking_enabled=int(new_status))
+    _update_user_setting(user_id, ranking_enabled=int(new_status))
     logger.info(f"用户 {user_id} 的全服排名参与状态已在数据库中切换为: {new_status}")
     return new_status
 
@@ -72,14 +171,14 @@ def set_group_language(chat_id: int, lang_code: str):
     """
     在数据库中设置指定群组的语言。
     """
-    db.db_update_group_setting(chat_id, language_code=lang_code)
+    _update_group_setting(chat_id, language_code=lang_code)
     logger.info(f"群组 {chat_id} 的语言已在数据库中更新为: {lang_code}")
 
 def get_group_language(chat_id: int) -> Optional[str]:
     """
     从数据库中获取指定群组的语言。
     """
-    settings = db.db_get_group_settings(chat_id)
+    settings = _get_group_settings(chat_id)
     if settings and settings['language_code']:
         return settings['language_code']
     return None
@@ -89,14 +188,14 @@ def set_auto_chat_mode(chat_id: int, is_on: bool):
     在数据库中设置群组的自由对话模式状态。
     """
     # 将布尔值转换为整数 1 或 0
-    db.db_update_group_setting(chat_id, autochat_enabled=int(is_on))
+    _update_group_setting(chat_id, autochat_enabled=int(is_on))
     logger.info(f"群组 {chat_id} 的自由对话模式已在数据库中更新为: {is_on}")
     
 def is_auto_chat_on(chat_id: int) -> bool:
     """
     从数据库检查群组的自由对话模式是否开启。
     """
-    settings = db.db_get_group_settings(chat_id)
+    settings = _get_group_settings(chat_id)
     if not settings:
         return False # 默认关闭
     return bool(settings['autochat_enabled'])
@@ -105,14 +204,14 @@ def set_spam_filter_mode(chat_id: int, is_on: bool):
     """
     在数据库中设置群组的垃圾拦截模式状态。
     """
-    db.db_update_group_setting(chat_id, spam_filter_enabled=int(is_on))
+    _update_group_setting(chat_id, spam_filter_enabled=int(is_on))
     logger.info(f"群组 {chat_id} 的垃圾拦截模式已在数据库中更新为: {is_on}")
 
 def is_spam_filter_on(chat_id: int) -> bool:
     """
     从数据库检查群组的垃圾拦截模式是否开启。
     """
-    settings = db.db_get_group_settings(chat_id)
+    settings = _get_group_settings(chat_id)
     # 如果没有设置记录，默认为开启
     if not settings:
         return True
@@ -126,16 +225,31 @@ def toggle_group_checkin(chat_id: int) -> bool:
     current_status = is_group_checkin_on(chat_id)
     new_status = not current_status
     
-    db.db_update_group_setting(chat_id, checkin_enabled=int(new_status))
+    _update_group_setting(chat_id, checkin_enabled=int(new_status))
     logger.info(f"群组 {chat_id} 的签到功能已在数据库中切换为: {new_status}")
     return new_status
 
 def is_group_checkin_on(chat_id: int) -> bool:
     """从数据库检查群组的签到功能是否开启。"""
-    settings = db.db_get_group_settings(chat_id)
+    settings = _get_group_settings(chat_id)
     if not settings:
         return False # 默认关闭
     return bool(settings['checkin_enabled'])
 
+def get_flood_thresholds(chat_id: int) -> Tuple[int, float]:
+    """返回群组的刷屏检测阈值 (窗口内最多消息数, 窗口秒数)，未单独设置时使用全局默认值。消息数为 0 表示关闭。"""
+    settings = _get_group_settings(chat_id)
+    max_messages = settings['flood_max_messages'] if settings else None
+    window_seconds = settings['flood_window_seconds'] if settings else None
+    return (
+        FLOOD_MAX_MESSAGES if max_messages is None else max_messages,
+        FLOOD_WINDOW_SECONDS if window_seconds is None else window_seconds,
+    )
+
+def set_flood_thresholds(chat_id: int, max_messages: Optional[int], window_seconds: Optional[float]):
+    """设置群组的刷屏检测阈值，传入 None 表示恢复全局默认值。"""
+    _update_group_setting(chat_id, flood_max_messages=max_messages, flood_window_seconds=window_seconds)
+    logger.info(f"群组 {chat_id} 的刷屏检测阈值已更新为: {max_messages} 条 / {window_seconds} 秒")
+
 # --- 启动时不再需要加载任何数据 ---
 # _load_data()
\ No newline at end of file
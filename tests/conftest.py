@@ -0,0 +1,21 @@
+# tests/conftest.py
+import pytest
+
+from bot import statistics as db
+from bot.rank_service import rank_service
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """让 statistics 模块在测试期间使用临时数据库文件，结束后切换回原来的数据库。"""
+    original_db_file = db.DB_FILE
+    db.close_all_connections()
+    db.DB_FILE = str(tmp_path / 'test.db')
+    db._initialize_database()
+    db.invalidate_exclusion_list()
+    rank_service.clear_boards()
+    yield db
+    rank_service.clear_boards()
+    db.close_all_connections()
+    db.DB_FILE = original_db_file
+    db.invalidate_exclusion_list()
@@ -0,0 +1,57 @@
+# tests/test_ad_blocker.py
+import os
+import random
+
+from bot import ad_blocker
+from bot.ad_blocker import KeywordMatcher
+
+
+def _substring_scan(keywords, text):
+    """旧实现：逐个关键词做子串查找。"""
+    return [keyword for keyword in keywords if keyword in text]
+
+
+def test_matcher_agrees_with_substring_scan():
+    rng = random.Random(5)
+    alphabet = 'abc加微信'
+    for _ in range(300):
+        keywords = {''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))}
+        matcher = KeywordMatcher(keywords)
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        found = matcher.find(text)
+        expected = _substring_scan(keywords, text)
+        if expected:
+            assert found in expected
+        else:
+            assert found is None
+
+
+def test_matcher_finds_keyword_behind_failed_prefix():
+    matcher = KeywordMatcher(['abcd', 'bc', '免费领取'])
+    assert matcher.find('xabce') == 'bc'
+    assert matcher.find('点击免费领') is None
+    assert matcher.find('点击免费领取红包') == '免费领取'
+    assert KeywordMatcher([]).find('anything') is None
+
+
+def test_reload_keeps_last_good_keywords(tmp_path, monkeypatch):
+    keyword_file = tmp_path / 'blacklist_keywords.txt'
+    keyword_file.write_text('Spam\n\n  加微信 \n', encoding='utf-8')
+    monkeypatch.setattr(ad_blocker, 'KEYWORD_FILE', str(keyword_file))
+    monkeypatch.setattr(ad_blocker, 'BLOCKED_KEYWORDS', set())
+    monkeypatch.setattr(ad_blocker, '_matcher', KeywordMatcher(()))
+    monkeypatch.setattr(ad_blocker, '_loaded_mtime', None)
+    monkeypatch.setattr(ad_blocker, '_failed_mtime', None)
+
+    assert ad_blocker.reload_blocked_keywords() == (True, 2, ad_blocker.last_build_seconds)
+    assert ad_blocker.find_spam_keyword('buy SPAM now') == 'spam'
+    assert ad_blocker.is_spam('请加微信')
+    assert not ad_blocker.is_spam('hello')
+    # 文件未变化时不重新加载
+    assert ad_blocker.reload_blocked_keywords()[0] is False
+
+    # 编辑器保存文件的间隙文件不存在：保留已加载的关键词，也不创建空文件
+    os.remove(keyword_file)
+    assert ad_blocker.reload_blocked_keywords(force=True)[:2] == (False, 2)
+    assert ad_blocker.is_spam('spam')
+    assert not keyword_file.exists()
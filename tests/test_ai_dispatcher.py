@@ -0,0 +1,133 @@
+# tests/test_ai_dispatcher.py
+import asyncio
+import threading
+import warnings
+
+import pytest
+from telegram import Update, User
+from telegram.ext import ApplicationBuilder, ExtBot, MessageHandler, filters
+
+from bot.ai_dispatcher import AiDispatcher, AiQueueFull, AiRequestSuperseded
+
+
+class _OfflineBot(ExtBot):
+    """initialize 时不请求 Telegram 的机器人。"""
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(1, 'test', True, username='test_bot')
+        return self._bot_user
+
+
+def _text_update(bot, update_id: int, chat_id: int, text: str) -> Update:
+    data = {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'group', 'title': 'test'},
+            'from': {'id': 1000 + update_id, 'is_bot': False, 'first_name': 'u'},
+            'text': text,
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+async def _wait_for(predicate, timeout: float = 5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "等待超时"
+        await asyncio.sleep(0.01)
+
+
+def _run_updates(dispatcher: AiDispatcher, texts, coalesce: bool):
+    """用非阻塞的 MessageHandler 依次处理同一聊天的几条更新，返回每条更新的结果。"""
+    release = threading.Event()
+    results = {}
+
+    def reply(text):
+        release.wait(5)
+        return f"reply:{text}"
+
+    async def handler(update, context):
+        text = update.message.text
+        try:
+            results[text] = await dispatcher.submit(update.effective_chat.id, reply, text, coalesce=coalesce)
+        except AiRequestSuperseded:
+            results[text] = 'superseded'
+        except AiQueueFull:
+            results[text] = 'busy'
+
+    async def scenario():
+        application = ApplicationBuilder().bot(_OfflineBot("123:TEST")).build()
+        application.add_handler(MessageHandler(filters.TEXT, handler, block=False))
+        async with application:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                for update_id, text in enumerate(texts, start=1):
+                    # process_update 在处理器开始后立即返回，后续更新不必等待 AI 回复
+                    await asyncio.wait_for(
+                        application.process_update(_text_update(application.bot, update_id, -100, text)), 1)
+            # 第一条在执行，其余已排队或已被拒绝/合并
+            await _wait_for(lambda: dispatcher.running == 1 and
+                            dispatcher.pending + len(results) == len(texts) - 1)
+            release.set()
+            await _wait_for(lambda: len(results) == len(texts))
+        return results
+
+    return asyncio.run(scenario())
+
+
+def test_same_chat_updates_coalesce():
+    dispatcher = AiDispatcher(max_workers=1, max_pending=10, max_pending_per_chat=5)
+    results = _run_updates(dispatcher, ['a', 'b', 'c'], coalesce=True)
+
+    assert results == {'a': 'reply:a', 'b': 'superseded', 'c': 'reply:c'}
+    assert dispatcher.total_superseded == 1
+    assert dispatcher.pending == 0
+
+
+def test_same_chat_updates_rejected_when_queue_full():
+    dispatcher = AiDispatcher(max_workers=1, max_pending=10, max_pending_per_chat=1)
+    results = _run_updates(dispatcher, ['a', 'b', 'c'], coalesce=False)
+
+    assert results == {'a': 'reply:a', 'b': 'reply:b', 'c': 'busy'}
+    assert dispatcher.total_rejected == 1
+
+
+def test_chats_take_turns():
+    async def scenario():
+        dispatcher = AiDispatcher(max_workers=1, max_pending=10, max_pending_per_chat=5)
+        release = threading.Event()
+        order = []
+
+        def work(tag):
+            release.wait(5)
+            order.append(tag)
+            return tag
+
+        tasks = [asyncio.create_task(dispatcher.submit(chat_id, work, tag))
+                 for chat_id, tag in [(1, 'a1'), (1, 'a2'), (1, 'a3'), (2, 'b1')]]
+        await _wait_for(lambda: dispatcher.running == 1)
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+
+    # 聊天 2 的请求排在聊天 1 的第二个请求之后，而不是等聊天 1 全部完成
+    assert asyncio.run(scenario()) == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_total_pending_limit():
+    async def scenario():
+        dispatcher = AiDispatcher(max_workers=1, max_pending=1, max_pending_per_chat=5)
+        release = threading.Event()
+        running = asyncio.create_task(dispatcher.submit(1, release.wait, 5))
+        await _wait_for(lambda: dispatcher.running == 1)
+        queued = asyncio.create_task(dispatcher.submit(2, lambda: 'queued'))
+        await _wait_for(lambda: dispatcher.pending == 1)
+        with pytest.raises(AiQueueFull):
+            await dispatcher.submit(3, lambda: 'rejected')
+        release.set()
+        return await running, await queued
+
+    assert asyncio.run(scenario()) == (True, 'queued')
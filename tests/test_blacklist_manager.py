@@ -0,0 +1,57 @@
+# tests/test_blacklist_manager.py
+from datetime import datetime, timedelta, timezone
+
+from bot.blacklist_manager import BlacklistIndex
+
+
+def _in(seconds: float) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+
+def test_purge_expired_pops_only_expired_entries():
+    index = BlacklistIndex()
+    index.add(1, _in(-10))
+    index.add(2, _in(3600))
+    index.add(3, _in(-5))
+    assert sorted(index.purge_expired()) == [1, 3]
+    assert len(index) == 1
+    assert index.purge_expired() == []
+    assert index.get_expiration(2) is not None
+
+
+def test_stale_heap_entries_are_skipped():
+    index = BlacklistIndex()
+    # 延长禁言后，旧的 (已过期的) 堆条目不能把用户移出黑名单
+    index.add(1, _in(-10))
+    index.add(1, _in(3600))
+    # 移除后再被拉黑：第一次的堆条目同样失效
+    index.add(2, _in(-5))
+    index.remove(2)
+    assert index.purge_expired() == []
+    assert index.get_expiration(1) is not None
+    assert index.get_expiration(2) is None
+    index.add(2, _in(-1))
+    assert index.purge_expired() == [2]
+
+
+def test_get_expiration_drops_expired_entry():
+    index = BlacklistIndex()
+    index.add(1, _in(-1))
+    assert index.get_expiration(1) is None
+    assert len(index) == 0
+
+
+def test_flush_persists_last_change_per_user(temp_db):
+    index = BlacklistIndex()
+    index.add(1, _in(3600))
+    index.add(2, _in(3600))
+    index.remove(2)
+    later = _in(7200)
+    index.add(1, later)
+    assert index.flush() == 2
+    assert index.pending == 0
+
+    reloaded = BlacklistIndex()
+    assert reloaded.load() == 1
+    assert reloaded.get_expiration(1) == later
+    assert reloaded.get_expiration(2) is None
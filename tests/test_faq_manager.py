@@ -0,0 +1,46 @@
+# tests/test_faq_manager.py
+import random
+from difflib import SequenceMatcher
+
+from bot import faq_manager
+from bot.faq_manager import _FaqBounds, _FaqIndex, _extract_keywords
+
+
+def test_bounds_never_reject_a_real_match():
+    rng = random.Random(9)
+    alphabet = 'abcdef 你好吗'
+    for _ in range(500):
+        questions = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 20))) for _ in range(rng.randint(1, 5))]
+        bounds = _FaqBounds(questions)
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 20)))
+        best = max(SequenceMatcher(None, text, q.lower()).ratio() for q in questions)
+        assert bounds.max_similarity(text) >= best - 1e-9
+
+
+def test_bounds_reject_unrelated_text():
+    bounds = _FaqBounds(['怎么 重置 密码', 'how do i reset my password'])
+    assert bounds.max_similarity('今天天气不错') < faq_manager.SIMILARITY_THRESHOLD
+    assert bounds.max_similarity('how do i reset my password?') >= faq_manager.SIMILARITY_THRESHOLD
+
+
+def test_index_candidates_rank_closest_question_first():
+    questions = ['How do I reset my password', '怎么修改群组名称', 'where is the rules page', 'reset the bot']
+    index = _FaqIndex([{'question': q, 'answer': f"answer {i}", 'keywords': _extract_keywords(q)}
+                       for i, q in enumerate(questions)])
+    assert index.candidates('how to reset password', 2)[0] == 0
+    assert index.candidates('群组名称怎么改', 1) == [1]
+    assert index.candidates('!!!', 3) == []
+
+
+def test_find_similar_question_uses_database(temp_db, monkeypatch):
+    monkeypatch.setattr(faq_manager, '_prefilter_bounds', {})
+    monkeypatch.setattr(faq_manager, '_prefilter_loaded', True)
+    assert faq_manager.add_faq(-1001, 'How do I reset my password', 'Use /reset')
+    assert faq_manager.should_try_match(-1001, 'how do i reset my password?')
+    assert not faq_manager.should_try_match(-1002, 'how do i reset my password?')
+    assert faq_manager.find_similar_question(-1001, 'how do i reset my password?') == 'Use /reset'
+    assert faq_manager.find_similar_question(-1001, 'what time is it') is None
+
+    assert faq_manager.delete_faq(-1001, 0) == 'How do I reset my password'
+    assert faq_manager.find_similar_question(-1001, 'how do i reset my password?') is None
+    assert not faq_manager.should_try_match(-1001, 'how do i reset my password?')
@@ -0,0 +1,66 @@
+# tests/test_flood_detector.py
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bot import flood_detector as flood_module
+from bot.flood_detector import FloodDetector, _Window
+
+
+def test_window_flags_exactly_n_messages_within_window():
+    window = _Window(3)
+    assert not window.record(100.0, 10)
+    assert not window.record(101.0, 10)
+    assert window.record(102.0, 10)
+
+
+def test_window_slides_past_old_messages():
+    window = _Window(3)
+    for now in (100.0, 105.0):
+        window.record(now, 10)
+    # 第三条距第一条超过窗口，不算刷屏；再来一条时只看最近三条
+    assert not window.record(111.0, 10)
+    assert window.record(112.0, 10)
+    window.reset()
+    assert not window.record(113.0, 10)
+
+
+def test_check_resets_after_flagging(monkeypatch):
+    monkeypatch.setattr(flood_module, 'FLOOD_MAX_MESSAGES', 3)
+    monkeypatch.setattr(flood_module, 'FLOOD_WINDOW_SECONDS', 10)
+    detector = FloodDetector(max_entries=100, idle_seconds=60)
+
+    async def run():
+        results = [await detector.check(1, 2, False, now=100.0 + i) for i in range(6)]
+        other_user = await detector.check(1, 3, False, now=106.0)
+        return results, other_user
+
+    results, other_user = asyncio.run(run())
+    assert results == [False, False, True, False, False, True]
+    assert other_user is False
+    assert detector.get_stats()['flagged'] == 2
+
+
+def test_should_notify_once_per_mute():
+    detector = FloodDetector(max_entries=100, idle_seconds=60)
+    first_mute = datetime.now(timezone.utc) + timedelta(hours=48)
+    assert detector.should_notify(1, 2, first_mute)
+    assert not detector.should_notify(1, 2, first_mute)
+    assert detector.should_notify(5, 2, first_mute)
+    # 重新拉黑后解封时间不同，会再提示一次
+    assert detector.should_notify(1, 2, first_mute + timedelta(hours=1))
+
+
+def test_notified_marker_lives_until_unmute(monkeypatch):
+    now = datetime.now(timezone.utc)
+    clock = [now.timestamp()]
+    monkeypatch.setattr(flood_module.time, 'time', lambda: clock[0])
+    detector = FloodDetector(max_entries=100, idle_seconds=60)
+    long_mute = now + timedelta(days=3)
+    short_mute = now + timedelta(minutes=5)
+    assert detector.should_notify(1, 2, long_mute)
+    assert detector.should_notify(1, 3, short_mute)
+
+    # 两天后：短禁言的记录已过期，三天的禁言仍然只提示过一次
+    clock[0] += 2 * 86400
+    assert not detector.should_notify(1, 2, long_mute)
+    assert detector.get_stats()['notified'] == 1
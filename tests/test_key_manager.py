@@ -0,0 +1,78 @@
+# tests/test_key_manager.py
+import pytest
+
+from bot import key_manager
+from bot.key_manager import ApiKeyManager, _TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的 time.monotonic。"""
+    now = [1000.0]
+    monkeypatch.setattr(key_manager.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def manager(monkeypatch, clock):
+    monkeypatch.setattr(key_manager, 'GOOGLE_API_KEYS', ['key-a', 'key-b'])
+    monkeypatch.setattr(key_manager, 'GOOGLE_API_KEY_RPM', 2)
+    monkeypatch.setattr(key_manager, 'GOOGLE_API_KEY_TPM', 1000)
+    monkeypatch.setattr(key_manager, 'GOOGLE_API_KEY_COOLDOWN_SECONDS', 10)
+    monkeypatch.setattr(key_manager, 'GOOGLE_API_KEY_MAX_COOLDOWN_SECONDS', 30)
+    monkeypatch.setattr(ApiKeyManager, '_instance', None)
+    return ApiKeyManager()
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = _TokenBucket(60)
+    bucket.tokens = 0.0
+    bucket.refill(clock[0] + 10)
+    assert bucket.tokens == pytest.approx(10)
+    assert bucket.seconds_until(15) == pytest.approx(5)
+    # 超过容量的请求按装满计算，不会永远等待
+    assert bucket.seconds_until(1000) == pytest.approx(50)
+    bucket.refill(clock[0] + 1000)
+    assert bucket.tokens == 60
+
+
+def test_acquire_spreads_requests_across_keys(manager):
+    first = manager.acquire(timeout=0)
+    second = manager.acquire(timeout=0)
+    assert {first, second} == {'key-a', 'key-b'}
+    manager.report_success(first, tokens_used=10)
+    manager.report_success(second, tokens_used=10)
+    assert sorted(manager.acquire(timeout=0) for _ in range(2)) == ['key-a', 'key-b']
+    # 每个密钥每分钟 2 次，配额用完后立即返回 None
+    assert manager.acquire(timeout=0) is None
+
+
+def test_rate_limit_recovers_over_time(manager, clock):
+    for _ in range(4):
+        assert manager.acquire(timeout=0) is not None
+    assert manager.acquire(timeout=0) is None
+    clock[0] += 30  # 2 RPM，30 秒补充 1 个令牌
+    assert manager.acquire(timeout=0) is not None
+
+
+def test_token_budget_limits_large_requests(manager):
+    assert manager.acquire(estimated_tokens=900, exclude=['key-b'], timeout=0) == 'key-a'
+    assert manager.acquire(estimated_tokens=900, timeout=0) == 'key-b'
+    assert manager.acquire(estimated_tokens=900, timeout=0) is None
+
+
+def test_exhausted_key_cools_down_with_backoff(manager, clock):
+    key = manager.acquire(exclude=['key-b'], timeout=0)
+    manager.report_exhausted(key)
+    assert manager.acquire(exclude=['key-b'], timeout=0) is None
+    clock[0] += 10
+    # 冷却结束后从空桶开始补充，2 RPM 需要再等 30 秒
+    assert manager.acquire(exclude=['key-b'], timeout=0) is None
+    clock[0] += 30
+    key = manager.acquire(exclude=['key-b'], timeout=0)
+    assert key == 'key-a'
+    manager.report_exhausted(key)
+    stats = {s['index']: s for s in manager.get_stats()}
+    assert stats[0]['cooldown_seconds'] == pytest.approx(20)
+    assert stats[0]['exhausted'] == 2
+    assert stats[0]['in_flight'] == 0
@@ -0,0 +1,109 @@
+# tests/test_message_ingest.py
+import asyncio
+
+import pytest
+
+from bot import message_ingest
+from bot.message_ingest import MessageIngestQueue
+from bot.rank_service import rank_service
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """记录提交给话题统计的批次，不在测试中启动分词线程。"""
+    batches = []
+    monkeypatch.setattr(message_ingest.topic_engine, 'submit', batches.append)
+    return batches
+
+
+def _count_messages(db) -> int:
+    return db._get_db_connection().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def _put_messages(queue: MessageIngestQueue, count: int, chat_id: int = -1001, user_id: int = 1):
+    async def put_all():
+        for i in range(count):
+            await queue.put(chat_id, 'group', None, user_id, 'user', None, f"message {i}")
+    asyncio.run(put_all())
+
+
+def test_flush_writes_batch_once(temp_db, submitted):
+    queue = MessageIngestQueue(batch_size=100, max_pending=100)
+    _put_messages(queue, 5)
+
+    assert queue.flush() == 5
+    assert queue.flush() == 0
+    assert _count_messages(temp_db) == 5
+    assert queue.pending == 0
+    assert queue.total_flushed == 5
+    assert [len(batch) for batch in submitted] == [5]
+
+
+def test_failed_write_is_requeued(temp_db, submitted, monkeypatch):
+    queue = MessageIngestQueue(batch_size=100, max_pending=100)
+    _put_messages(queue, 3)
+    save = temp_db.db_save_messages_batch
+
+    def failing_save(rows, known_chats):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(temp_db, 'db_save_messages_batch', failing_save)
+    assert queue.flush() == 0
+    assert queue.pending == 3
+    assert _count_messages(temp_db) == 0
+    assert submitted == []
+
+    monkeypatch.setattr(temp_db, 'db_save_messages_batch', save)
+    assert queue.flush() == 3
+    assert _count_messages(temp_db) == 3
+    assert queue.pending == 0
+
+
+def test_requeue_respects_max_pending(temp_db, submitted, monkeypatch):
+    queue = MessageIngestQueue(batch_size=100, max_pending=4)
+    _put_messages(queue, 3)
+
+    def failing_save(rows, known_chats):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(temp_db, 'db_save_messages_batch', failing_save)
+    assert queue.flush() == 0
+    # 重试期间又来了新消息，放回后超出上限的最旧消息被丢弃
+    with queue._lock:
+        queue._buffer.extend(queue._buffer[:2])
+    assert queue.flush() == 0
+    assert queue.pending == 4
+    assert queue.total_dropped == 1
+
+
+def test_rank_update_failure_does_not_requeue(temp_db, submitted, monkeypatch):
+    queue = MessageIngestQueue(batch_size=100, max_pending=100)
+    _put_messages(queue, 4)
+    # 先加载排行榜，确认失败后会被丢弃
+    rank_service.get_user_global_stats(1)
+    assert rank_service.board_count == 1
+
+    def failing_apply(rows):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(rank_service, 'apply_messages', failing_apply)
+    assert queue.flush() == 4
+    assert queue.pending == 0
+    assert queue.flush() == 0
+    assert _count_messages(temp_db) == 4
+    assert rank_service.board_count == 0
+    monkeypatch.undo()
+    assert rank_service.get_user_global_stats(1) == (1, 4)
+
+
+def test_topic_failure_does_not_requeue(temp_db, monkeypatch):
+    queue = MessageIngestQueue(batch_size=100, max_pending=100)
+    _put_messages(queue, 2)
+
+    def failing_submit(rows):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(message_ingest.topic_engine, 'submit', failing_submit)
+    assert queue.flush() == 2
+    assert queue.pending == 0
+    assert _count_messages(temp_db) == 2
@@ -0,0 +1,108 @@
+# tests/test_rank_service.py
+import random
+from datetime import datetime, timedelta
+
+from bot.message_ingest import MessageIngestQueue
+from bot.rank_service import CHAT_PERIODS, RankService, _Leaderboard, rank_service
+
+CHATS = ['-1001', '-1002', '42']
+USERS = [str(user_id) for user_id in range(1, 16)]
+
+
+def _random_rows(rng: random.Random, count: int):
+    now = datetime.now()
+    rows = []
+    for _ in range(count):
+        chat_id = rng.choice(CHATS)
+        timestamp = now - timedelta(days=rng.choice([0, 0, 1, 3, 10, 40]), minutes=rng.randint(0, 600))
+        rows.append((chat_id, 'group', '', rng.choice(USERS), 'user', '', timestamp.isoformat(), 'hi'))
+    return rows
+
+
+def _sql_rank(db, user_id: str, chat_id=None, period=None):
+    """用 SQL COUNT 直接统计 messages 表，按 RANK() 规则计算 (排名, 发言数)。"""
+    sql = "SELECT user_id, COUNT(*) FROM messages WHERE user_id NOT LIKE '-100%'"
+    params = []
+    if chat_id is not None:
+        start_time = db._get_start_time_for_period(period)
+        sql += " AND chat_id = ? AND timestamp >= ?"
+        params += [chat_id, start_time.isoformat()]
+    counts = dict(db._get_db_connection().execute(sql + " GROUP BY user_id", params).fetchall())
+    count = counts.get(user_id, 0)
+    if not count:
+        return 0, 0
+    excluded = set(db._get_exclusion_list()) - {user_id}
+    higher = sum(1 for other, other_count in counts.items() if other not in excluded and other_count > count)
+    return higher + 1, count
+
+
+def _assert_matches_sql(db):
+    for user_id in USERS:
+        assert rank_service.get_user_global_stats(int(user_id)) == _sql_rank(db, user_id)
+        for chat_id in CHATS:
+            for period in CHAT_PERIODS:
+                if user_id in db._get_exclusion_list():
+                    continue
+                expected = _sql_rank(db, user_id, chat_id, period)
+                assert rank_service.get_user_rank_in_chat(int(user_id), int(chat_id), period) == expected
+
+
+def test_incremental_updates_match_sql_count(temp_db, monkeypatch):
+    monkeypatch.setattr('bot.message_ingest.topic_engine.submit', lambda rows: None)
+    rng = random.Random(7)
+    queue = MessageIngestQueue(batch_size=10000, max_pending=10000)
+    with queue._lock:
+        queue._buffer.extend(_random_rows(rng, 300))
+    queue.flush()
+    # 加载所有排行榜后再写入新消息，检验增量累加
+    _assert_matches_sql(temp_db)
+    for _ in range(5):
+        with queue._lock:
+            queue._buffer.extend(_random_rows(rng, 60))
+        queue.flush()
+        _assert_matches_sql(temp_db)
+
+
+def test_rebuild_matches_sql_count(temp_db, monkeypatch):
+    monkeypatch.setattr('bot.message_ingest.topic_engine.submit', lambda rows: None)
+    rng = random.Random(11)
+    temp_db.db_save_messages_batch(_random_rows(rng, 200))
+    # 汇总表被清空后，从历史消息重建
+    with temp_db._get_db_connection() as conn:
+        conn.execute("DELETE FROM activity_daily")
+    assert rank_service.rebuild_from_messages() > 0
+    _assert_matches_sql(temp_db)
+
+
+def test_excluded_users_do_not_count_as_higher(temp_db, monkeypatch):
+    monkeypatch.setattr(temp_db, '_get_exclusion_list', lambda: ['1'])
+    rows = [('-1001', 'group', '', user_id, 'user', '', datetime.now().isoformat(), 'hi')
+            for user_id, count in [('1', 5), ('2', 3), ('3', 3), ('4', 1)] for _ in range(count)]
+    temp_db.db_save_messages_batch(rows)
+    service = RankService()
+    assert service.get_user_global_stats(2) == (1, 3)
+    assert service.get_user_global_stats(3) == (1, 3)
+    assert service.get_user_global_stats(4) == (3, 1)
+    # 用户自己不参与排名时也能看到自己的名次
+    assert service.get_user_global_stats(1) == (1, 5)
+    assert service.get_user_rank_in_chat(1, -1001, 'today') == (0, 0)
+
+
+def test_leaderboard_matches_brute_force():
+    rng = random.Random(3)
+    counts = {}
+    board = _Leaderboard(None, {})
+    for _ in range(2000):
+        user_id = str(rng.randint(1, 40))
+        delta = rng.randint(1, 5)
+        board.add(user_id, delta)
+        counts[user_id] = counts.get(user_id, 0) + delta
+    excluded = [str(user_id) for user_id in rng.sample(range(1, 41), 5)]
+    for user_id in map(str, range(1, 42)):
+        count = counts.get(user_id, 0)
+        if not count:
+            assert board.rank_of(user_id, excluded) == (0, 0)
+            continue
+        higher = sum(1 for other, other_count in counts.items()
+                     if other_count > count and (other == user_id or other not in excluded))
+        assert board.rank_of(user_id, excluded) == (higher + 1, count)